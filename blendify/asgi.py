@@ -6,8 +6,13 @@ import core.routing
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'blendify.settings')
 
+http_application = get_asgi_application()
+
+from core.metrics_utils import metrics
+metrics.enable() # daphne serves for as long as the container runs, so it shares its metrics
+
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
+    "http": http_application,
     "websocket": AuthMiddlewareStack(
         URLRouter(
             core.routing.websocket_urlpatterns
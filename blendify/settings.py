@@ -87,13 +87,50 @@ LOGOUT_REDIRECT_URL = '/'
 # Database Config
 ####################################################################
 
-# SQLite stored in /data
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'data' / 'db.sqlite3',
+# SQLite stored in /data by default, PostgreSQL (pip install blendify-web[postgres]) when DATABASE_ENGINE=postgres
+if os.getenv('DATABASE_ENGINE', 'sqlite').lower() in ('postgres', 'postgresql'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('POSTGRES_DB', 'blendify'),
+            'USER': os.getenv('POSTGRES_USER', 'blendify'),
+            'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
+            'HOST': os.getenv('POSTGRES_HOST', 'localhost'),
+            'PORT': os.getenv('POSTGRES_PORT', '5432'),
+            'OPTIONS': {},
+        }
+    }
+
+    if os.getenv('DATABASE_POOL', 'true').lower() == 'true': # psycopg's pool, which can't be combined with persistent connections
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.getenv('DATABASE_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.getenv('DATABASE_POOL_MAX_SIZE', 10)),
+            'timeout': float(os.getenv('DATABASE_POOL_TIMEOUT', 10)),
+        }
+    else:
+        DATABASES['default']['CONN_MAX_AGE'] = int(os.getenv('DATABASE_CONN_MAX_AGE', 60))
+        DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'data' / 'db.sqlite3',
+            'CONN_MAX_AGE': int(os.getenv('DATABASE_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                # WAL lets readers carry on while someone writes, and NORMAL only syncs at checkpoints (safe under WAL)
+                'init_command': (
+                    "PRAGMA journal_mode=WAL;"
+                    f"PRAGMA synchronous={os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')};"
+                    "PRAGMA temp_store=MEMORY;"
+                ),
+                # writers wait this long for the lock instead of failing with "database is locked"
+                'timeout': float(os.getenv('SQLITE_BUSY_TIMEOUT', 20)),
+                # transactions take the write lock up front, so they can't deadlock upgrading from a read
+                'transaction_mode': 'IMMEDIATE',
+            },
+        }
     }
-}
 
 # Our default field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -108,9 +145,15 @@ AUTHENTICATION_BACKENDS = (
     'django.contrib.auth.backends.ModelBackend',
 )
 
-# Channels are how we handle toast notifications
+# Channels are how we handle toast notifications, shared between every process on the host through SQLite
 CHANNEL_LAYERS = {
-    "default": { "BACKEND": "channels.layers.InMemoryChannelLayer" }
+    "default": {
+        "BACKEND": "core.channel_layers.SQLiteChannelLayer",
+        "CONFIG": {
+            "path": os.getenv('CHANNEL_LAYER_FILE', BASE_DIR / 'data' / 'channels.sqlite3'),
+            "expiry": int(os.getenv('CHANNEL_LAYER_EXPIRY', 60)),
+        },
+    }
 }
 
 INSTALLED_APPS = [
@@ -154,5 +197,17 @@ TEMPLATES = [
     },
 ]
 
+# Send our app's logs (API client stats, cache hits, etc) to the console
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': { 'class': 'logging.StreamHandler' },
+    },
+    'loggers': {
+        'core': { 'handlers': ['console'], 'level': os.getenv('BLENDIFY_LOG_LEVEL', 'INFO') },
+    },
+}
+
 ASGI_APPLICATION = 'blendify.asgi.application' # Async support
 WSGI_APPLICATION = 'blendify.wsgi.application' # Sync support
\ No newline at end of file
@@ -1,14 +1,38 @@
 from django.contrib import admin
-from .models import Playlist, Song, Generated
+from django.utils import timezone
+from .models import BlendJob, Playlist, PlaylistEntry, Song, SongMiss, Generated
+
+@admin.register(BlendJob)
+class BlendJobAdmin(admin.ModelAdmin):
+    list_display = ('spotify_playlist_name', 'user', 'status', 'stage', 'created_at', 'finished_at')
+    list_filter = ('status',)
 
 @admin.register(Generated)
 class GeneratedAdmin(admin.ModelAdmin):
     list_display = ('playlist_name', 'user_id', 'themes')
 
+class PlaylistEntryInline(admin.TabularInline):
+    model = PlaylistEntry
+    raw_id_fields = ('song',)
+    extra = 0
+
 @admin.register(Playlist)
 class PlaylistAdmin(admin.ModelAdmin):
-    list_display = ('theme',)
+    list_display = ('theme', 'theme_key', 'created_at', 'last_used_at', 'hit_count')
+    inlines = (PlaylistEntryInline,)
 
 @admin.register(Song)
 class SongAdmin(admin.ModelAdmin):
-    list_display = ('name', 'spotify_uri')
\ No newline at end of file
+    list_display = ('name', 'spotify_uri', 'last_used_at', 'hit_count')
+
+@admin.register(SongMiss)
+class SongMissAdmin(admin.ModelAdmin):
+    list_display = ('name', 'attempts', 'checked_at', 'expires_at')
+    search_fields = ('name',)
+    ordering = ('-attempts', 'name')
+    actions = ('recheck_misses',)
+
+    @admin.action(description="Re-check selected songs on the next blend")
+    def recheck_misses(self, request, queryset):
+        updated = queryset.update(expires_at=timezone.now())
+        self.message_user(request, f"{updated} song(s) will be searched again on the next blend.")
@@ -0,0 +1,87 @@
+####################################################################
+# Library & Modules
+####################################################################
+
+# system level stuff
+import time
+import random
+import statistics
+
+# blendify specific imports
+from core.models import Song
+
+
+####################################################################
+# Functions
+####################################################################
+
+def seed_songs(
+    start: int,
+    end: int,
+    batch_size: int = 5000,
+) -> None:
+    """
+    Top the Song table up from `start` to `end` rows of "Artist n - Track n", all of them cached hits.
+
+    Parameters:
+    ---
+        start: How many rows are already seeded.
+        end: How many rows there should be.
+        batch_size: Rows per bulk insert.
+    """
+    for i in range(start, end, batch_size):
+        Song.objects.bulk_create([
+            Song(name=f"Artist {n} - Track {n}", key=f"artist {n} - track {n}", spotify_uri=f"spotify:track:{n:022d}")
+            for n in range(i, min(i + batch_size, end))
+        ])
+
+
+def sample_songs(
+    rows: int,
+    songs: int,
+) -> list[str]:
+    """
+    A blend-like batch of songs against a table from seed_songs: 80% cached (with the LLM's
+    usual casing drift), the rest misses.
+
+    Parameters:
+    ---
+        rows: How many rows are seeded.
+        songs: How many songs to return.
+
+    Returns:
+    ---
+        A list of "Artist - Song Title" strings, hits first.
+    """
+    hits = [f"ARTIST {n} - track {n}" for n in random.sample(range(rows), int(songs * 0.8))]
+    misses = [f"Unknown {n} - Song {n}" for n in range(songs - len(hits))]
+    return hits + misses
+
+
+def median_ms(
+    func,
+    repeat: int,
+    setup=None,
+) -> float:
+    """
+    Median wall time of `func` after one warm up run.
+
+    Parameters:
+    ---
+        func: What to time, called with no arguments.
+        repeat: How many timed runs to take the median of.
+        setup: Optional, called (untimed) before each timed run.
+
+    Returns:
+    ---
+        The median time in milliseconds.
+    """
+    func() # warm up
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
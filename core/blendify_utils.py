@@ -4,18 +4,26 @@
 
 # system level stuff
 import os
+import logging
 import dotenv
 
 # data analysis
 import random
 
 # parallel processing
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import asyncio
 
 # blendify specific imports
-from core.openai_utils import generate_chatgpt_playlist, generate_chatgpt_playlist_description, generate_chatgpt_playlist_name, invoke_chatgpt
-from core.spotify_utils import get_spotify_playlist_description, get_spotify_track_uris
-from core.models import Playlist, Song
+from core.openai_utils import generate_chatgpt_playlist, generate_chatgpt_playlists, generate_chatgpt_playlist_description, generate_chatgpt_playlist_details, generate_chatgpt_playlist_name, invoke_chatgpt, invoke_chatgpt_json, stream_chatgpt_lines
+from core.spotify_utils import SpotifyClient
+from core.cache_utils import playlist_cache, playlist_usage, song_cache, song_usage, theme_flight
+from core.theme_utils import normalize_theme, theme_index
+from core.metrics_utils import theme_lookups
+from core.models import Playlist, PlaylistEntry, Song, SongMiss, ThemeClaim, normalize_song_key
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+from datetime import timedelta
 
 
 ####################################################################
@@ -23,14 +31,19 @@ from core.models import Playlist, Song
 ####################################################################
 
 dotenv.load_dotenv()
+logger = logging.getLogger(__name__)
+
+_refreshing = set() # background theme refreshes, held so they aren't garbage collected mid-flight
 
 
 ####################################################################
 # Functions
 ####################################################################
 
-def build_individual_playlists(
+async def build_individual_playlists(
     themes: list[str],
+    on_song=None,
+    on_progress=None,
 ) -> dict[str, list[str]]:
     """
     Handler function for batch processing of ChatGPT generated playlists.
@@ -38,18 +51,32 @@ def build_individual_playlists(
     Parameters:
     ---
         themes: A list of themes to build playlists for.
+        on_song: Optional callback, handed each newly generated song as soon as it streams in.
+        on_progress: Optional callback, handed (themes finished, total themes) as each theme finishes.
 
     Returns:
     ---
         A dictionary of themes, with their corresponding playlist.
     """
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        futures = {executor.submit(build_individual_playlist, theme): theme for theme in themes}
-        results = {futures[future]: future.result() for future in as_completed(futures)}
-    return results
+    if os.getenv('OPENAI_BATCH_THEMES', 'false').lower() == 'true':
+        await generate_batched_playlists(themes, on_song)
+
+    finished = 0
+
+    async def build_and_count(theme):
+        nonlocal finished
+        songs = await build_individual_playlist(theme, on_song)
+        finished += 1
+        if on_progress:
+            on_progress(finished, len(themes))
+        return songs
+
+    playlists = await asyncio.gather(*(build_and_count(theme) for theme in themes))
+    return dict(zip(themes, playlists))
 
-def build_individual_playlist(
+async def build_individual_playlist(
     theme: str,
+    on_song=None,
 ) -> list[str]:
     """
     Build an individual playlist for a given theme using ChatGPT.
@@ -57,22 +84,271 @@ def build_individual_playlist(
     Parameters:
     ---
         theme: The theme to build a playlist for.
+        on_song: Optional callback, handed each newly generated song as soon as it streams in.
 
     Returns:
     ---
         A list of songs.
     """
 
-    existing = Playlist.objects.filter(theme__iexact=theme).first()
+    # keyed on the normalized theme, so paraphrases like "rock 80s" share "80s rock"'s entry
+    cache_key = normalize_theme(theme)
+
+    songs = playlist_cache.get(cache_key)
+    if songs is None: # only one caller per theme goes to the database (and the LLM)
+        songs = await theme_flight.do(cache_key, lambda: load_or_generate_playlist(theme, on_song))
+        playlist_cache.set(cache_key, songs)
+
+    await playlist_usage.touch([cache_key])
+    return songs
+
+def playlists_for_theme(
+    theme: str,
+):
+    """
+    The cached playlist for a theme, matched on its normalized key (the same key as the in-memory
+    cache), so case variants and paraphrases like "Rock 80's" and "80s rock" share one row.
+    """
+    return Playlist.objects.filter(theme_key=normalize_theme(theme))
+
+async def find_cached_playlist(
+    theme: str,
+) -> Playlist | None:
+    """
+    Find a cached playlist for a theme, either by name or by a near-duplicate theme
+    (eg. "80s rock" for "Rock 80's").
+
+    Parameters:
+    ---
+        theme: The theme to look up.
+
+    Returns:
+    ---
+        The cached Playlist, or None.
+    """
+    existing = await playlists_for_theme(theme).afirst()
     if existing:
-        songs = existing.song_list
-    else:
-        conversation = generate_chatgpt_playlist(theme)
-        songs = [song.strip() for song in invoke_chatgpt(conversation).splitlines() if song.strip()]
-        Playlist.objects.create(theme=theme.lower(), song_list=songs)
+        theme_lookups.inc(result='exact')
+        return existing
+
+    while similar := await theme_index.find(theme):
+        if existing := await playlists_for_theme(similar).afirst():
+            theme_lookups.inc(result='similar')
+            return existing
+        theme_index.remove(similar) # evicted since we indexed it, try the next best
+
+    theme_lookups.inc(result='miss')
+    return None
+
+async def load_or_generate_playlist(
+    theme: str,
+    on_song=None,
+) -> list[str]:
+    """
+    Load a theme's playlist from the database, generating it with ChatGPT if it isn't there.
+    A ThemeClaim row makes sure only one worker process generates a given theme, the others
+    wait for it to land in the database. A playlist older than THEME_MAX_AGE days is still
+    served, and regenerated in the background for next time.
+
+    Parameters:
+    ---
+        theme: The theme to build a playlist for.
+        on_song: Optional callback, handed each newly generated song as soon as it streams in.
+
+    Returns:
+    ---
+        A list of songs.
+    """
+    claim_timeout = timedelta(seconds=int(os.getenv('THEME_CLAIM_TIMEOUT', 120)))
+    claim_key = normalize_theme(theme)
+
+    while True:
+        existing = await find_cached_playlist(theme)
+        if existing:
+            if is_stale(existing):
+                refresh_playlist_in_background(existing.theme)
+            if existing.theme_key != claim_key: # a paraphrase's playlist, build_individual_playlist only counts our own key
+                await playlist_usage.touch([existing.theme_key])
+            return await load_playlist_songs(existing)
+
+        try: # claim the theme, the unique constraint makes this atomic across processes
+            await ThemeClaim.objects.acreate(theme=claim_key, claimed_at=timezone.now())
+        except IntegrityError: # someone else is generating it, give them a moment
+            await ThemeClaim.objects.filter(theme=claim_key, claimed_at__lt=timezone.now() - claim_timeout).adelete()
+            await asyncio.sleep(0.5)
+            continue
+
+        try:
+            # they may have finished between our lookup and our claim
+            existing = await find_cached_playlist(theme)
+            if existing:
+                return await load_playlist_songs(existing)
+
+            songs = await generate_playlist(theme, on_song)
+            await save_playlist(theme, songs)
+            theme_index.add(theme.lower())
+            return songs
+        finally:
+            await ThemeClaim.objects.filter(theme=claim_key).adelete()
+
+def is_stale(
+    playlist: Playlist,
+) -> bool:
+    """
+    Whether a cached playlist is older than THEME_MAX_AGE days (0 turns expiry off).
+
+    Parameters:
+    ---
+        playlist: The cached Playlist.
+
+    Returns:
+    ---
+        True if it's due to be regenerated.
+    """
+    max_age = float(os.getenv('THEME_MAX_AGE', 30))
+    return max_age > 0 and playlist.created_at < timezone.now() - timedelta(days=max_age)
+
+def refresh_playlist_in_background(
+    theme: str,
+) -> None:
+    """
+    Regenerate a stale theme's playlist without anyone waiting on it.
+
+    Parameters:
+    ---
+        theme: The theme as stored on the Playlist.
+    """
+    task = asyncio.create_task(refresh_playlist(theme))
+    _refreshing.add(task)
+    task.add_done_callback(_refreshing.discard)
+
+async def refresh_playlist(
+    theme: str,
+) -> None:
+    """
+    Regenerate a theme's playlist and swap it in for the stale one. Takes the theme's claim
+    like load_or_generate_playlist, so a theme is refreshed once however many blends notice
+    it's stale, and gives up quietly if someone else holds it. Failures are logged, the stale
+    playlist stays until the next attempt.
+
+    Parameters:
+    ---
+        theme: The theme as stored on the Playlist.
+    """
+    claim_key = normalize_theme(theme)
+    try:
+        await ThemeClaim.objects.acreate(theme=claim_key, claimed_at=timezone.now())
+    except IntegrityError:
+        return
+
+    try:
+        songs = await generate_playlist(theme)
+        if not songs:
+            raise Exception("ChatGPT returned an empty playlist")
+
+        await save_playlist(theme, songs)
+        playlist_cache.set(claim_key, songs)
+        logger.info("Refreshed the stale playlist for %r", theme)
+    except Exception as e:
+        logger.warning("Refreshing the stale playlist for %r failed, keeping the old one: %s", theme, e)
+    finally:
+        await ThemeClaim.objects.filter(theme=claim_key).adelete()
+
+async def generate_playlist(
+    theme: str,
+    on_song=None,
+) -> list[str]:
+    """
+    Generate a playlist for a theme with ChatGPT. With OPENAI_STREAMING on, songs are
+    handed to `on_song` line by line while the rest of the completion is still coming in.
+
+    Parameters:
+    ---
+        theme: The theme to build a playlist for.
+        on_song: Optional callback, handed each song as soon as it streams in.
+
+    Returns:
+    ---
+        A list of songs.
+    """
+    conversation = generate_chatgpt_playlist(theme)
+
+    if os.getenv('OPENAI_STREAMING', 'false').lower() != 'true':
+        return [song.strip() for song in (await invoke_chatgpt(conversation)).splitlines() if song.strip()]
+
+    songs = []
+    async for song in stream_chatgpt_lines(conversation):
+        songs.append(song)
+        if on_song:
+            on_song(song)
 
     return songs
 
+async def generate_batched_playlists(
+    themes: list[str],
+    on_song=None,
+) -> None:
+    """
+    Generate every uncached theme in one structured ChatGPT call, instead of one call per theme.
+    Each valid playlist is stored on its own, any theme that comes back missing or malformed
+    is left uncached so the usual per-theme generation picks it up.
+
+    Parameters:
+    ---
+        themes: A list of themes to build playlists for.
+        on_song: Optional callback, handed each newly generated song.
+    """
+    uncached = {}
+    for theme in themes:
+        cache_key = normalize_theme(theme)
+        if cache_key in uncached or playlist_cache.get(cache_key) is not None:
+            continue
+
+        if not await find_cached_playlist(theme):
+            uncached[cache_key] = theme
+
+    if len(uncached) < 2: # nothing to save over a regular call
+        return
+
+    claimed = []
+    try:
+        for theme in uncached.values():
+            try: # same claim as load_or_generate_playlist, so nobody generates these twice
+                await ThemeClaim.objects.acreate(theme=normalize_theme(theme), claimed_at=timezone.now())
+            except IntegrityError:
+                continue
+            claimed.append(theme)
+
+        # they may have finished between our lookup and our claim
+        to_generate = [theme for theme in claimed if not await playlists_for_theme(theme).aexists()]
+        if len(to_generate) < 2:
+            return
+
+        try:
+            response = await invoke_chatgpt_json(generate_chatgpt_playlists(to_generate))
+        except Exception as e:
+            logger.warning("Batched generation of %d themes failed, falling back to one call per theme: %s", len(to_generate), e)
+            return
+
+        playlists = {str(theme).casefold(): songs for theme, songs in response.items()}
+        for theme in to_generate:
+            songs = playlists.get(theme.casefold())
+            if not isinstance(songs, list) or not songs or not all(isinstance(song, str) and song.strip() for song in songs):
+                logger.warning("Batched generation returned no usable playlist for %r, falling back to its own call", theme)
+                continue
+
+            songs = [song.strip() for song in songs]
+            await save_playlist(theme, songs)
+            theme_index.add(theme.lower())
+            playlist_cache.set(normalize_theme(theme), songs)
+
+            if on_song:
+                for song in songs:
+                    on_song(song)
+    finally:
+        if claimed:
+            await ThemeClaim.objects.filter(theme__in=[normalize_theme(theme) for theme in claimed]).adelete()
+
 def build_combined_playlist(
     individual_playlists: dict[str, list[str]],
 ) -> list[str]:
@@ -117,7 +393,7 @@ def build_combined_playlist(
     
     return combined_playlist
 
-def build_playlist_name(
+async def build_playlist_name(
     combined_playlist: list[str],
     spotify_playlist_name: str,
     playlist_rename: bool,
@@ -136,12 +412,12 @@ def build_playlist_name(
         A string of the playlist name.
     """
     if playlist_rename:
-        return invoke_chatgpt(generate_chatgpt_playlist_name(combined_playlist))
+        return await invoke_chatgpt(generate_chatgpt_playlist_name(combined_playlist))
     else:
         return spotify_playlist_name
     
-def build_playlist_description(
-    access_token: str,
+async def build_playlist_description(
+    spotify: SpotifyClient,
     combined_playlist: list[str],
     spotify_playlist_id: str,
     playlist_rename: bool,
@@ -151,7 +427,7 @@ def build_playlist_description(
 
     Parameters:
     ---
-        access_token: The user's Spotify access token.
+        spotify: The user's Spotify client.
         combined_playlist: A list of songs.
         spotify_playlist_id: The ID of the Spotify playlist.
         playlist_rename: Whether to rename the playlist.
@@ -161,21 +437,226 @@ def build_playlist_description(
         A string of the playlist description.
     """
     if playlist_rename:
-        return invoke_chatgpt(generate_chatgpt_playlist_description(combined_playlist))
+        return await invoke_chatgpt(generate_chatgpt_playlist_description(combined_playlist))
     else:
-        return get_spotify_playlist_description(access_token, spotify_playlist_id)
+        return await spotify.get_playlist_description(spotify_playlist_id)
 
-def build_song_uris(
-    access_token: str,
+async def build_playlist_details(
+    spotify: SpotifyClient,
+    combined_playlist: list[str],
+    spotify_playlist_name: str,
+    spotify_playlist_id: str,
+    playlist_rename: bool,
+) -> tuple[str, str | None]:
+    """
+    Build a name and description for a combined playlist. When renaming, both come from
+    a single ChatGPT call, falling back to the separate prompts if its response doesn't hold up.
+
+    Parameters:
+    ---
+        spotify: The user's Spotify client.
+        combined_playlist: A list of songs.
+        spotify_playlist_name: The name of the Spotify playlist.
+        spotify_playlist_id: The ID of the Spotify playlist.
+        playlist_rename: Whether to rename the playlist.
+
+    Returns:
+    ---
+        The playlist name and description.
+    """
+    if playlist_rename:
+        try:
+            details = await invoke_chatgpt_json(generate_chatgpt_playlist_details(combined_playlist))
+            name, description = details.get('name'), details.get('description')
+            if isinstance(name, str) and name.strip() and isinstance(description, str) and description.strip():
+                return name.strip(), description.strip()
+            logger.warning("ChatGPT returned unusable playlist details, falling back to separate prompts: %r", details)
+        except Exception as e:
+            logger.warning("Generating playlist details failed, falling back to separate prompts: %s", e)
+
+    return await asyncio.gather(
+        build_playlist_name(combined_playlist, spotify_playlist_name, playlist_rename),
+        build_playlist_description(spotify, combined_playlist, spotify_playlist_id, playlist_rename),
+    )
+
+def chunked(
+    items: list,
+) -> list[list]:
+    """
+    Split a list into chunks that fit the database's query parameter limit (999 on SQLite).
+
+    Parameters:
+    ---
+        items: The list to split.
+
+    Returns:
+    ---
+        A list of chunks.
+    """
+    chunk_size = connection.features.max_query_params or len(items) or 1
+    return [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+
+async def lookup_song_uris(
+    keys: list[str],
+) -> dict[str, str]:
+    """
+    Look up cached URIs by normalized song key.
+
+    Parameters:
+    ---
+        keys: A list of normalized song keys.
+
+    Returns:
+    ---
+        A dictionary of song keys and their URIs, for the keys we have a URI for.
+    """
+    found = {}
+    for chunk in chunked(list(set(keys))):
+        async for key, uri in Song.objects.filter(key__in=chunk, spotify_uri__isnull=False).values_list('key', 'spotify_uri'):
+            found[key] = uri
+
+    return found
+
+async def load_playlist_songs(
+    playlist: Playlist,
+) -> list[str]:
+    """
+    A cached playlist's songs in order, joined to their Song rows in one indexed query.
+    The URIs that come along are put in the song cache, so build_song_uris doesn't
+    look them up by name again.
+
+    Parameters:
+    ---
+        playlist: The cached Playlist.
+
+    Returns:
+    ---
+        A list of songs.
+    """
+    songs = []
+    uris = {}
+    async for name, key, uri in PlaylistEntry.objects.filter(playlist=playlist).order_by('position').values_list('song__name', 'song__key', 'song__spotify_uri'):
+        songs.append(name)
+        if uri:
+            uris[key] = uri
+
+    song_cache.set_many(uris)
+    return songs
+
+async def save_playlist(
+    theme: str,
+    songs: list[str],
+) -> Playlist:
+    """
+    Cache a generated playlist: the Playlist row, a Song for any song we haven't seen
+    before (without a URI until a blend resolves it) and the ordered entries linking them,
+    in one transaction so nobody loads it half written. The Playlist is upserted on its
+    normalized theme, so saving a theme again (a refresh, or a lost race) replaces its
+    songs instead of adding a duplicate row.
+
+    Parameters:
+    ---
+        theme: The theme the playlist was generated for.
+        songs: The generated songs, in order.
+
+    Returns:
+    ---
+        The saved Playlist.
+    """
+    keys = [normalize_song_key(song) for song in songs]
+
+    @transaction.atomic
+    def save():
+        playlist, created = Playlist.objects.update_or_create(
+            theme_key=normalize_theme(theme),
+            defaults={ 'theme': theme.lower(), 'created_at': timezone.now() },
+        )
+        if not created:
+            playlist.entries.all().delete()
+
+        Song.objects.bulk_create([Song(name=song, key=key) for song, key in zip(songs, keys)], ignore_conflicts=True)
+
+        song_ids = {}
+        for chunk in chunked(list(set(keys))):
+            song_ids.update(Song.objects.filter(key__in=chunk).values_list('key', 'id'))
+
+        PlaylistEntry.objects.bulk_create([
+            PlaylistEntry(playlist=playlist, song_id=song_ids[key], position=position)
+            for position, key in enumerate(keys)
+        ])
+        return playlist
+
+    return await sync_to_async(save)()
+
+async def lookup_song_misses(
+    keys: list[str],
+) -> dict[str, SongMiss]:
+    """
+    Look up songs Spotify previously couldn't resolve.
+
+    Parameters:
+    ---
+        keys: A list of normalized song keys.
+
+    Returns:
+    ---
+        A dictionary of song keys and their SongMiss records, expired or not.
+    """
+    misses = {}
+    for chunk in chunked(list(set(keys))):
+        async for miss in SongMiss.objects.filter(key__in=chunk):
+            misses[miss.key] = miss
+
+    return misses
+
+async def record_song_misses(
+    misses: dict[str, str],
+    existing: dict[str, SongMiss],
+) -> None:
+    """
+    Remember songs Spotify couldn't resolve, so we skip searching them until they expire.
+    Each repeat miss doubles the wait before the next re-check (up to 8x SONG_MISS_TTL_DAYS).
+
+    Parameters:
+    ---
+        misses: A dictionary of normalized song keys and song names that came back empty.
+        existing: The SongMiss records we already had for those keys.
+    """
+    now = timezone.now()
+    ttl = timedelta(days=float(os.getenv('SONG_MISS_TTL_DAYS', 7)))
+
+    misses_to_update = []
+    misses_to_create = []
+    for key, song in misses.items():
+        if miss := existing.get(key):
+            miss.attempts += 1
+            miss.checked_at = now
+            miss.expires_at = now + ttl * 2 ** min(miss.attempts - 1, 3)
+            misses_to_update.append(miss)
+        else:
+            misses_to_create.append(SongMiss(name=song, key=key, checked_at=now, expires_at=now + ttl))
+
+    if misses_to_update:
+        await SongMiss.objects.abulk_update(misses_to_update, ['attempts', 'checked_at', 'expires_at'])
+
+    if misses_to_create:
+        await SongMiss.objects.abulk_create(misses_to_create, ignore_conflicts=True)
+
+async def build_song_uris(
+    spotify: SpotifyClient,
     song_list: list[str],
+    on_progress=None,
+    track_usage: bool = True,
 ) -> list[str]:
     """
     Get URIs for songs using batch processing.
 
     Parameters:
     ---
-        access_token: The user's Spotify access token.
+        spotify: The user's Spotify client.
         song_list: A list of songs.
+        on_progress: Optional callback, handed (songs resolved, total songs) as lookups finish.
+        track_usage: Count this as a use of the songs found, for cache eviction. Off for lookups that aren't a blend's final songs.
 
     Returns:
     ---
@@ -183,44 +664,165 @@ def build_song_uris(
     """
     if not song_list:
         return []
-    
-    cached_songs = {}
-    existing_songs = Song.objects.filter(
-        name__iregex=r'^(' + '|'.join([
-            song.replace('(', r'\(').replace(')', r'\)').replace('[', r'\[').replace(']', r'\]')
-            for song in song_list
-        ]) + ')$'
-    ).values('name', 'spotify_uri')
-    
-    for song_obj in existing_songs:
-        for original_song in song_list:
-            if song_obj['name'].lower() == original_song.lower() and song_obj['spotify_uri']:
-                cached_songs[original_song] = song_obj['spotify_uri']
-                break
-    
-    uncached_songs = [song for song in song_list if song not in cached_songs]
-    
+
+    keys = {song: normalize_song_key(song) for song in song_list}
+    found = song_cache.get_many(keys.values())
+
+    if missing_keys := [key for key in keys.values() if key not in found]:
+        from_db = await lookup_song_uris(missing_keys)
+        song_cache.set_many(from_db)
+        found.update(from_db)
+
+    uncached_songs = {}
+    for song, key in keys.items():
+        if key not in found:
+            uncached_songs.setdefault(key, song)
+
+    # skip songs spotify recently told us it doesn't have
+    known_misses = await lookup_song_misses(list(uncached_songs)) if uncached_songs else {}
+    now = timezone.now()
+    for key, miss in known_misses.items():
+        if miss.expires_at > now:
+            del uncached_songs[key]
+
+    total = len(set(keys.values()))
+    if on_progress: # everything we already knew about is done
+        on_progress(total - len(uncached_songs), total)
+
     if uncached_songs:
-        new_uris = get_spotify_track_uris(access_token, uncached_songs)
-        
+        searched = total - len(uncached_songs)
+        new_uris = await spotify.get_track_uris(
+            list(uncached_songs.values()),
+            on_progress=(lambda finished, _: on_progress(searched + finished, total)) if on_progress else None,
+        )
+
         songs_to_create = []
-        for song, uri in new_uris.items():
-            if uri:
-                songs_to_create.append(Song(name=song, spotify_uri=uri))
-                cached_songs[song] = uri
-        
+        new_misses = {}
+        for key, song in uncached_songs.items():
+            if uri := new_uris.get(song):
+                songs_to_create.append(Song(name=song, key=key, spotify_uri=uri))
+                found[key] = uri
+                song_cache.set(key, uri)
+            elif song in new_uris: # searched fine, spotify just doesn't have it
+                new_misses[key] = song
+
+        if new_misses:
+            await record_song_misses(new_misses, known_misses)
+
+        if resolved_misses := [key for key in known_misses if key in found]:
+            await SongMiss.objects.filter(key__in=resolved_misses).adelete()
+
         if songs_to_create:
-            try:
-                Song.objects.bulk_create(songs_to_create, ignore_conflicts=True)
-            except Exception as e:
-                print(f"Error bulk creating songs: {e}")
+            try: # songs from cached playlists already have a row, waiting on its URI
+                await Song.objects.abulk_create(songs_to_create, update_conflicts=True, unique_fields=['key'], update_fields=['spotify_uri'])
+            except Exception:
+                logger.exception("Bulk creating %d songs failed, saving them one at a time", len(songs_to_create))
                 for song_obj in songs_to_create:
                     try:
-                        Song.objects.get_or_create(
-                            name__iexact=song_obj.name,
-                            defaults={'name': song_obj.name, 'spotify_uri': song_obj.spotify_uri}
+                        await Song.objects.aupdate_or_create(
+                            key=song_obj.key,
+                            defaults={'spotify_uri': song_obj.spotify_uri},
+                            create_defaults={'name': song_obj.name, 'spotify_uri': song_obj.spotify_uri},
                         )
                     except Exception:
                         pass  # Skip problematic songs
-    
-    return [cached_songs.get(song) for song in song_list if cached_songs.get(song)]
\ No newline at end of file
+
+    if track_usage:
+        await song_usage.touch([key for key in set(keys.values()) if key in found])
+    return [found[keys[song]] for song in song_list if keys[song] in found]
+
+
+####################################################################
+# Classes
+####################################################################
+
+class SongPrefetcher:
+    """
+    Resolves song URIs in the background while playlists are still being generated.
+
+    Songs handed to `add` are queued and looked up in small batches through `build_song_uris`,
+    which caches what it finds, so the URI stage afterwards is mostly cache hits. Lookups are
+    best effort: a failed batch is logged and left for the URI stage to retry. They don't count
+    towards song usage, most streamed songs never make the combined playlist and the URI stage
+    counts the ones that do.
+
+    Usage:
+    ---
+        prefetcher = SongPrefetcher(spotify)
+        individual_playlists = await build_individual_playlists(themes, on_song=prefetcher.add)
+        await prefetcher.join()
+    """
+
+    def __init__(
+        self,
+        spotify: SpotifyClient,
+    ):
+        self.spotify = spotify
+        self.queued = 0
+
+        self._queue = asyncio.Queue()
+        self._batches = set()
+        self._drainer = None
+
+    def add(
+        self,
+        song: str,
+    ) -> None:
+        """
+        Queue a song for URI resolution.
+        """
+        if self._drainer is None:
+            self._drainer = asyncio.create_task(self._drain())
+
+        self.queued += 1
+        self._queue.put_nowait(song)
+
+    async def _drain(self) -> None:
+        """
+        Start a lookup for whatever has queued up, as often as songs arrive.
+        """
+        while True:
+            batch = [await self._queue.get()]
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            task = asyncio.create_task(self._resolve(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _resolve(
+        self,
+        batch: list[str],
+    ) -> None:
+        """
+        Look up a batch of songs, marking them done whether it worked or not.
+        """
+        try:
+            await build_song_uris(self.spotify, batch, track_usage=False)
+        except Exception as e:
+            logger.warning("Prefetching %d song URIs failed: %s", len(batch), e)
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+    async def join(self) -> None:
+        """
+        Wait for every queued song to be looked up, then stop.
+        """
+        if self._drainer is None:
+            return
+
+        await self._queue.join()
+        self.cancel()
+        logger.info("Prefetched URIs for %d streamed songs", self.queued)
+
+    def cancel(self) -> None:
+        """
+        Stop prefetching, abandoning any lookups still in flight.
+        """
+        if self._drainer is not None:
+            self._drainer.cancel()
+            self._drainer = None
+
+        for task in list(self._batches):
+            task.cancel()
@@ -0,0 +1,371 @@
+####################################################################
+# Library & Modules
+####################################################################
+
+# system level stuff
+import os
+import time
+import logging
+import threading
+from dotenv import load_dotenv
+
+# parallel processing
+import asyncio
+from concurrent.futures import Future
+
+# data analysis
+from collections import Counter, OrderedDict
+
+# blendify specific imports
+from core.models import Playlist, Song
+from django.db import connection
+from django.db.models import F
+from django.utils import timezone
+
+
+####################################################################
+# Environment Variables
+####################################################################
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# lets us cache falsy values and still tell them apart from a miss
+_MISSING = object()
+
+class LeaderCancelled(Exception):
+    """
+    Handed to SingleFlight followers when the caller doing the work was cancelled.
+    """
+
+
+####################################################################
+# Classes
+####################################################################
+
+class LRUCache:
+    """
+    Bounded in-process cache that sits in front of a database table.
+
+    Holds up to `max_entries` values, evicting the least recently used one when full,
+    and treats anything older than `ttl` seconds as a miss. Keeps hit, miss, eviction
+    and expiration counters so we can tell how much database traffic it's saving.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_entries: int,
+        ttl: float,
+    ):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        self._data = OrderedDict() # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(
+        self,
+        key,
+        default=None,
+    ):
+        """
+        Get a value, marking it as recently used.
+
+        Parameters:
+        ---
+            key: The key to look up.
+            default: What to return on a miss.
+
+        Returns:
+        ---
+            The cached value, or `default`.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def get_many(
+        self,
+        keys,
+    ) -> dict:
+        """
+        Get every cached value out of `keys`.
+
+        Parameters:
+        ---
+            keys: The keys to look up.
+
+        Returns:
+        ---
+            A dictionary of the keys that were cached, and their values.
+        """
+        found = {}
+        for key in keys:
+            value = self.get(key, _MISSING)
+            if value is not _MISSING:
+                found[key] = value
+        return found
+
+    def set(
+        self,
+        key,
+        value,
+    ) -> None:
+        """
+        Cache a value, evicting the least recently used entry if we're full.
+
+        Parameters:
+        ---
+            key: The key to store under.
+            value: The value to store.
+        """
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def set_many(
+        self,
+        mapping: dict,
+    ) -> None:
+        """
+        Cache every key/value pair in `mapping`.
+        """
+        for key, value in mapping.items():
+            self.set(key, value)
+
+    def delete(
+        self,
+        key,
+    ) -> None:
+        """
+        Drop a key from the cache, if it's there.
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        """
+        Drop everything from the cache.
+        """
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        """
+        The cache's size and counters.
+        """
+        return {
+            'name': self.name,
+            'entries': len(self._data),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+class SingleFlight:
+    """
+    Coalesces concurrent work for the same key.
+
+    The first caller for a key runs the work, and anyone else asking for that key while
+    it's in flight waits on the same result instead of repeating it. Results are handed
+    over through thread-safe futures, so callers on other threads (or event loops) can wait too.
+    If the caller doing the work is cancelled (eg. its blend timed out), one of the waiting
+    callers takes over rather than being cancelled along with it, and a waiting caller
+    being cancelled only stops its own wait.
+    """
+
+    def __init__(self):
+        self._calls = {} # key -> Future
+        self._lock = threading.Lock()
+
+    async def do(
+        self,
+        key,
+        func,
+    ):
+        """
+        Run `func` for `key`, or wait on the caller that's already running it.
+
+        Parameters:
+        ---
+            key: What to coalesce on.
+            func: A no-argument coroutine function that does the work.
+
+        Returns:
+        ---
+            Whatever `func` returned (or raises whatever it raised).
+        """
+        while True:
+            with self._lock:
+                future = self._calls.get(key)
+                leader = future is None
+                if leader:
+                    future = self._calls[key] = Future()
+
+            if leader:
+                break
+
+            waiter = asyncio.wrap_future(future)
+            try: # shielded, so our cancellation doesn't cancel the shared future for everyone else
+                return await asyncio.shield(waiter)
+            except LeaderCancelled:
+                continue # try again, and most likely do the work ourselves
+            except asyncio.CancelledError: # nobody's left to read the result, don't warn about it
+                waiter.add_done_callback(lambda waiter: waiter.cancelled() or waiter.exception())
+                raise
+
+        try:
+            result = await func()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.set_exception(LeaderCancelled())
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+class UsageTracker:
+    """
+    Batched last_used_at and hit_count bookkeeping for a cache table.
+
+    Reads are tallied in memory per row key and written out at most every `flush_interval`
+    seconds, one UPDATE per distinct hit count rather than one per read. last_used_at is
+    only as fresh as the flush, which is plenty for picking what to evict. Tallies that
+    haven't been flushed when the process dies are lost, they're a hint, not a ledger.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        model,
+        key_field: str,
+        flush_interval: float,
+    ):
+        self.name = name
+        self.model = model
+        self.key_field = key_field
+        self.flush_interval = flush_interval
+
+        self._pending = Counter() # key -> hits since the last flush
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    async def touch(
+        self,
+        keys,
+    ) -> None:
+        """
+        Count a read of each key, flushing if the last flush was long enough ago.
+
+        Parameters:
+        ---
+            keys: The row keys that were read.
+        """
+        with self._lock:
+            self._pending.update(keys)
+            due = time.monotonic() - self._last_flush >= self.flush_interval
+
+        if due:
+            await self.flush()
+
+    async def flush(self) -> None:
+        """
+        Write the pending tallies to the table.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+            self._last_flush = time.monotonic()
+
+        by_hits = {}
+        for key, hits in pending.items():
+            by_hits.setdefault(hits, []).append(key)
+
+        now = timezone.now()
+        chunk_size = connection.features.max_query_params or 1000
+        try:
+            for hits, keys in by_hits.items():
+                for i in range(0, len(keys), chunk_size):
+                    await self.model.objects.filter(**{f"{self.key_field}__in": keys[i:i + chunk_size]}).aupdate(
+                        last_used_at=now,
+                        hit_count=F('hit_count') + hits,
+                    )
+        except Exception as e:
+            logger.warning("Couldn't record %s usage for %d keys: %s", self.name, len(pending), e)
+
+
+####################################################################
+# Caches
+####################################################################
+
+# theme key (normalize_theme) -> list of songs
+playlist_cache = LRUCache(
+    'playlists',
+    max_entries=int(os.getenv('PLAYLIST_CACHE_MAX_ENTRIES', 1000)),
+    ttl=float(os.getenv('CACHE_TTL', 3600)),
+)
+
+# normalized song key -> spotify URI
+song_cache = LRUCache(
+    'songs',
+    max_entries=int(os.getenv('SONG_CACHE_MAX_ENTRIES', 50000)),
+    ttl=float(os.getenv('CACHE_TTL', 3600)),
+)
+
+# spotify user ID -> { playlists, etag, fresh_until }, kept past freshness so it can be revalidated
+spotify_playlists_cache = LRUCache(
+    'spotify playlists',
+    max_entries=int(os.getenv('SPOTIFY_PLAYLISTS_CACHE_MAX_ENTRIES', 1000)),
+    ttl=float(os.getenv('CACHE_TTL', 3600)),
+)
+
+# django user ID -> { access_token, spotify_id, expires_at }
+spotify_token_cache = LRUCache(
+    'spotify tokens',
+    max_entries=int(os.getenv('SPOTIFY_TOKEN_CACHE_MAX_ENTRIES', 1000)),
+    ttl=3600,
+)
+
+# theme key (normalize_theme) -> in flight playlist generation
+theme_flight = SingleFlight()
+
+# usage of the Playlist and Song tables behind the caches above, for compact_cache to evict by
+playlist_usage = UsageTracker('playlists', Playlist, 'theme_key', flush_interval=float(os.getenv('USAGE_FLUSH_INTERVAL', 60)))
+song_usage = UsageTracker('songs', Song, 'key', flush_interval=float(os.getenv('USAGE_FLUSH_INTERVAL', 60)))
+
+def cache_stats() -> list[dict]:
+    """
+    Stats for every in-process cache.
+    """
+    return [cache.stats() for cache in (playlist_cache, song_cache, spotify_playlists_cache, spotify_token_cache)]
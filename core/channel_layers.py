@@ -0,0 +1,344 @@
+####################################################################
+# Library & Modules
+####################################################################
+
+# system level stuff
+import time
+import uuid
+import base64
+import sqlite3
+import threading
+from pathlib import Path
+
+# data analysis
+import json
+
+# parallel processing
+import asyncio
+
+# channels
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+
+####################################################################
+# Functions
+####################################################################
+
+def encode_message(
+    message: dict,
+) -> str:
+    """
+    Serialize a channel message to JSON, keeping any bytes (eg. binary websocket frames) intact.
+    """
+    def encode_bytes(value):
+        if isinstance(value, bytes):
+            return { "__bytes__": base64.b64encode(value).decode() }
+        raise TypeError(f"Can't send {type(value).__name__} over the channel layer")
+
+    return json.dumps(message, default=encode_bytes)
+
+def decode_message(
+    payload: str,
+) -> dict:
+    """
+    The inverse of encode_message.
+    """
+    def decode_bytes(value):
+        if set(value) == { "__bytes__" }:
+            return base64.b64decode(value["__bytes__"])
+        return value
+
+    return json.loads(payload, object_hook=decode_bytes)
+
+
+####################################################################
+# Classes
+####################################################################
+
+class SQLiteChannelLayer(BaseChannelLayer):
+    """
+    Channel layer backed by a SQLite file, so every daphne (and worker) process on the
+    host shares groups and messages without running Redis.
+
+    Messages are rows keyed by their inbox (the part of the channel name up to the "!"),
+    and each process runs a single poller that pulls the rows for the channels it's
+    receiving on and hands them to the waiting consumers. The poller checks every
+    `poll_interval` seconds while messages are coming in, backs off to `max_poll_interval`
+    while they aren't, and only takes the write lock when there's something to take.
+    Messages expire after `expiry` seconds, group memberships after `group_expiry`,
+    and a channel holding `capacity` messages refuses more.
+
+    Usage (settings.py):
+    ---
+        CHANNEL_LAYERS = {
+            "default": {
+                "BACKEND": "core.channel_layers.SQLiteChannelLayer",
+                "CONFIG": { "path": BASE_DIR / "data" / "channels.sqlite3" },
+            }
+        }
+    """
+
+    extensions = ["groups", "flush"]
+
+    def __init__(
+        self,
+        path: str,
+        expiry: float = 60,
+        group_expiry: float = 86400,
+        capacity: int = 100,
+        channel_capacity: dict | None = None,
+        poll_interval: float = 0.05,
+        max_poll_interval: float = 0.5,
+    ):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity)
+        self.path = Path(path)
+        self.group_expiry = group_expiry
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max(max_poll_interval, poll_interval)
+        self.channel_capacity = self.compile_capacities(channel_capacity or {})
+        self.client_prefix = uuid.uuid4().hex
+
+        self._local = threading.local()
+        self._queues = {} # channel -> asyncio.Queue of received messages
+        self._waiters = {} # channel -> number of receive() calls waiting on it
+        self._buffered_until = {} # channel -> when the newest message in its buffer expires
+        self._poller = None
+        self._last_cleanup = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        This thread's connection to the layer's database, created (along with the schema) on first use.
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript("""
+                CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    inbox TEXT NOT NULL,
+                    channel TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    expires REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS messages_inbox_idx ON messages (inbox, id);
+                CREATE INDEX IF NOT EXISTS messages_channel_idx ON messages (channel);
+                CREATE TABLE IF NOT EXISTS groups (
+                    name TEXT NOT NULL,
+                    channel TEXT NOT NULL,
+                    expires REAL NOT NULL,
+                    PRIMARY KEY (name, channel)
+                );
+            """)
+            self._local.connection = connection
+        return connection
+
+    async def _execute(
+        self,
+        func,
+        *args,
+    ):
+        """
+        Run a blocking database function in a thread, handing it this thread's connection.
+        """
+        return await asyncio.to_thread(lambda: func(self._connection(), *args))
+
+    ## channel layer API ##
+
+    async def new_channel(
+        self,
+        prefix: str = "specific",
+    ) -> str:
+        """
+        A new channel name, routed to this process's inbox.
+        """
+        return f"{prefix}.{self.client_prefix}!{uuid.uuid4().hex}"
+
+    async def send(
+        self,
+        channel: str,
+        message: dict,
+    ) -> None:
+        """
+        Send a message to a channel, raising ChannelFull if it's at capacity.
+        """
+        assert isinstance(message, dict), "message is not a dict"
+        self.require_valid_channel_name(channel)
+
+        def insert(connection):
+            now = time.time()
+            queued = connection.execute("SELECT COUNT(*) FROM messages WHERE channel = ? AND expires > ?", (channel, now)).fetchone()[0]
+            if queued >= self.get_capacity(channel):
+                raise ChannelFull(channel)
+
+            connection.execute(
+                "INSERT INTO messages (inbox, channel, payload, expires) VALUES (?, ?, ?, ?)",
+                (self.non_local_name(channel), channel, encode_message(message), now + self.expiry),
+            )
+
+        await self._execute(insert)
+
+    async def receive(
+        self,
+        channel: str,
+    ) -> dict:
+        """
+        Wait for the next message on a channel.
+        """
+        self.require_valid_channel_name(channel)
+
+        queue = self._queues.setdefault(channel, asyncio.Queue())
+        self._waiters[channel] = self._waiters.get(channel, 0) + 1
+        if self._poller is None or self._poller.done() or self._poller.get_loop() is not asyncio.get_running_loop():
+            self._poller = asyncio.create_task(self._poll())
+
+        try:
+            while True:
+                expires, message = await queue.get()
+                if expires > time.time():
+                    return message
+        finally:
+            self._waiters[channel] -= 1
+            if not self._waiters[channel]:
+                del self._waiters[channel]
+                if queue.empty():
+                    self._queues.pop(channel, None)
+
+    async def _poll(self) -> None:
+        """
+        Pull this process's messages off the database into per-channel buffers, for as long
+        as anyone is receiving. Messages for a channel that's between receive() calls wait
+        in its buffer.
+        """
+        def fetch(connection, inboxes):
+            placeholders = ",".join("?" * len(inboxes))
+            # a read first, so an idle process doesn't take the write lock every poll
+            if not connection.execute(f"SELECT EXISTS (SELECT 1 FROM messages WHERE inbox IN ({placeholders}))", inboxes).fetchone()[0]:
+                return []
+            return connection.execute(
+                f"DELETE FROM messages WHERE inbox IN ({placeholders}) RETURNING id, channel, payload, expires",
+                inboxes,
+            ).fetchall()
+
+        interval = self.poll_interval
+        while self._waiters:
+            rows = await self._execute(fetch, sorted({self.non_local_name(channel) for channel in self._waiters}))
+
+            for _, channel, payload, expires in sorted(rows):
+                self._queues.setdefault(channel, asyncio.Queue()).put_nowait((expires, decode_message(payload)))
+                self._buffered_until[channel] = max(expires, self._buffered_until.get(channel, 0))
+
+            if time.time() - self._last_cleanup > 10:
+                self._last_cleanup = time.time()
+                self._drop_stale_buffers()
+                await self._execute(self._cleanup)
+
+            if rows:
+                interval = self.poll_interval
+            else: # nothing for us, check less often until something turns up
+                await asyncio.sleep(interval)
+                interval = min(interval * 2, self.max_poll_interval)
+
+    def _drop_stale_buffers(self) -> None:
+        """
+        Forget buffers nobody is receiving from once everything in them has expired
+        (their consumer has most likely disconnected).
+        """
+        now = time.time()
+        for channel, buffered_until in list(self._buffered_until.items()):
+            if buffered_until < now:
+                del self._buffered_until[channel]
+                if channel not in self._waiters:
+                    self._queues.pop(channel, None)
+
+    def _cleanup(
+        self,
+        connection: sqlite3.Connection,
+    ) -> None:
+        """
+        Drop expired messages and group memberships.
+        """
+        now = time.time()
+        connection.execute("DELETE FROM messages WHERE expires < ?", (now,))
+        connection.execute("DELETE FROM groups WHERE expires < ?", (now,))
+
+    async def flush(self) -> None:
+        """
+        Drop every message and group.
+        """
+        def delete_all(connection):
+            connection.execute("DELETE FROM messages")
+            connection.execute("DELETE FROM groups")
+
+        await self._execute(delete_all)
+        for queue in self._queues.values(): # receivers keep waiting on their (now empty) buffers
+            while not queue.empty():
+                queue.get_nowait()
+        self._buffered_until.clear()
+
+    async def close(self) -> None:
+        """
+        Nothing to close, connections live with their threads.
+        """
+
+    ## groups extension ##
+
+    async def group_add(
+        self,
+        group: str,
+        channel: str,
+    ) -> None:
+        """
+        Add a channel to a group (or refresh its membership).
+        """
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+
+        await self._execute(lambda connection: connection.execute(
+            "INSERT OR REPLACE INTO groups (name, channel, expires) VALUES (?, ?, ?)",
+            (group, channel, time.time() + self.group_expiry),
+        ))
+
+    async def group_discard(
+        self,
+        group: str,
+        channel: str,
+    ) -> None:
+        """
+        Remove a channel from a group.
+        """
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+
+        await self._execute(lambda connection: connection.execute(
+            "DELETE FROM groups WHERE name = ? AND channel = ?",
+            (group, channel),
+        ))
+
+    async def group_send(
+        self,
+        group: str,
+        message: dict,
+    ) -> None:
+        """
+        Send a message to every channel in a group, skipping any that are at capacity.
+        """
+        assert isinstance(message, dict), "message is not a dict"
+        self.require_valid_group_name(group)
+
+        def fan_out(connection):
+            now = time.time()
+            payload = encode_message(message)
+            channels = [
+                channel for (channel,) in connection.execute("SELECT channel FROM groups WHERE name = ? AND expires > ?", (group, now))
+                if connection.execute("SELECT COUNT(*) FROM messages WHERE channel = ? AND expires > ?", (channel, now)).fetchone()[0] < self.get_capacity(channel)
+            ]
+            connection.executemany(
+                "INSERT INTO messages (inbox, channel, payload, expires) VALUES (?, ?, ?, ?)",
+                [(self.non_local_name(channel), channel, payload, now + self.expiry) for channel in channels],
+            )
+
+        await self._execute(fan_out)
@@ -1,16 +1,71 @@
+import asyncio
 import json
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.urls import reverse
+
+from core.models import BlendJob
 
 class ProgressConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.group_name = f"user_{self.scope['user'].id}"
+        self.watcher = None
+        self.job_id = None
+        self.last_state = None
         await self.channel_layer.group_add(self.group_name, self.channel_name)
         await self.accept()
 
     async def disconnect(self, close_code):
+        if self.watcher:
+            self.watcher.cancel()
         await self.channel_layer.group_discard(self.group_name, self.channel_name)
 
+    async def receive(self, text_data=None, bytes_data=None):
+        data = json.loads(text_data or '{}')
+        if str(data.get('job_id', '')).isdigit() and not self.watcher:
+            self.job_id = int(data['job_id'])
+            self.watcher = asyncio.create_task(self.watch_job(self.job_id))
+
+    async def watch_job(self, job_id, poll_interval=5.0):
+        """
+        Catch up on a queued blend from its BlendJob row. Live stage changes come from the
+        worker through send_progress, this covers whatever happened before the socket
+        joined (or got lost on the way), until the blend finishes.
+        """
+        while True:
+            job = await BlendJob.objects.filter(id=job_id, user_id=self.scope['user'].id).afirst()
+            if job is None:
+                return
+
+            await self.send_job_state(job.id, job.status, job.stage, job.message)
+
+            if job.status in (BlendJob.DONE, BlendJob.FAILED):
+                return
+
+            await asyncio.sleep(poll_interval)
+
+    async def send_job_state(self, job_id, status, stage, message, progress=None):
+        """
+        Tell the browser about a blend's stage, once per change from the database and on every
+        (already throttled) progress update from the worker. A finished blend comes with a
+        redirect to its results.
+        """
+        finished = (BlendJob.DONE, BlendJob.FAILED)
+        if (not progress and (status, stage) == self.last_state) or (self.last_state and self.last_state[0] in finished):
+            return
+        self.last_state = (status, stage)
+
+        event = { 'message': message or 'Your blend is in the queue...', 'type': 'info', 'stage': stage, **(progress or {}) }
+        if status in finished:
+            event['type'] = 'success' if status == BlendJob.DONE else 'danger'
+            event['redirect'] = f"{reverse('blend')}?job={job_id}"
+        await self.send(text_data=json.dumps(event))
+
     async def send_progress(self, event):
+        if 'job_id' in event: # a blend's progress, from the worker
+            if event['job_id'] == self.job_id:
+                await self.send_job_state(event['job_id'], event['status'], event['stage'], event['message'], event.get('progress'))
+            return
+
         await self.send(text_data=json.dumps({
             'message': event['message']
-        }))
\ No newline at end of file
+        }))
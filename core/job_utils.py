@@ -0,0 +1,472 @@
+####################################################################
+# Library & Modules
+####################################################################
+
+# system level stuff
+import os
+import time
+import logging
+import dotenv
+
+# parallel processing
+import asyncio
+
+# django
+from datetime import timedelta
+from django.utils import timezone
+from channels.layers import get_channel_layer
+
+# blendify specific imports
+from core.blendify_utils import SongPrefetcher, build_individual_playlists, build_combined_playlist, build_song_uris, build_playlist_details
+from core.spotify_utils import SpotifyClient, spotify_tokens
+from core.cache_utils import cache_stats, playlist_usage, song_usage, spotify_playlists_cache
+from core.theme_utils import theme_index
+from core.metrics_utils import blend_seconds, blend_stage_seconds, blend_queue_seconds
+from core.models import BlendJob, Generated
+
+
+####################################################################
+# Environment Variables
+####################################################################
+
+dotenv.load_dotenv()
+logger = logging.getLogger(__name__)
+
+# where each stage starts and ends on the progress bar, in percent
+STAGE_PROGRESS = {
+    'create': (0, 5),
+    'source': (5, 55),
+    'combine': (55, 60),
+    'uris': (60, 85),
+    'details': (85, 95),
+    'push': (95, 100),
+}
+
+# what the counts reported during a stage are counting
+STAGE_UNITS = {
+    'source': 'themes sourced',
+    'uris': 'URIs resolved',
+}
+
+# user id -> when their next progress message may go out, shared by all of their blends in this worker
+progress_slots = {}
+
+
+####################################################################
+# Functions
+####################################################################
+
+async def enqueue_blend_job(
+    user,
+    themes: list[str],
+    spotify_playlist_id: str,
+    spotify_playlist_name: str,
+    playlist_rename: bool,
+) -> BlendJob:
+    """
+    Persist a blend request for the worker pool to pick up.
+
+    Parameters:
+    ---
+        user: The user requesting the blend.
+        themes: A list of themes to blend.
+        spotify_playlist_id: The ID of the Spotify playlist, or "create_new".
+        spotify_playlist_name: The name of the Spotify playlist (or the new playlist's name).
+        playlist_rename: Whether to rename the playlist.
+
+    Returns:
+    ---
+        The queued BlendJob.
+    """
+    return await BlendJob.objects.acreate(
+        user=user,
+        themes=themes,
+        spotify_playlist_id=spotify_playlist_id,
+        spotify_playlist_name=spotify_playlist_name,
+        playlist_rename=playlist_rename,
+    )
+
+async def set_blend_job_stage(
+    job: BlendJob,
+    stage: str,
+    message: str,
+) -> None:
+    """
+    Record the stage a job has reached, along with a timestamp for it.
+
+    Parameters:
+    ---
+        job: The job being processed.
+        stage: A short name for the stage (eg. "source", "push").
+        message: The progress message shown to the user.
+    """
+    job.stage = stage
+    job.message = message
+    job.stage_timestamps[stage] = timezone.now().isoformat()
+    await job.asave(update_fields=['stage', 'message', 'stage_timestamps'])
+
+async def notify_blend_job(
+    job: BlendJob,
+    **progress,
+) -> None:
+    """
+    Push a job's progress to the user's open sockets, whichever daphne process holds them.
+    Progress is best effort (the socket catches up from the database), so failures are only logged.
+
+    Parameters:
+    ---
+        job: The job being processed.
+        **progress: Structured progress to send along (percent, done, total, unit, elapsed_ms).
+    """
+    try:
+        await get_channel_layer().group_send(f"user_{job.user_id}", {
+            'type': 'send_progress',
+            'job_id': job.id,
+            'status': job.status,
+            'stage': job.stage,
+            'message': job.message,
+            'progress': progress,
+        })
+    except Exception as e:
+        logger.warning("Couldn't send progress for blend job %s: %s", job.id, e)
+
+async def claim_next_blend_job() -> BlendJob | None:
+    """
+    Atomically claim the oldest queued job, so two workers never run the same one.
+
+    Returns:
+    ---
+        The claimed BlendJob, or None if the queue is empty.
+    """
+    async for job_id in BlendJob.objects.filter(status=BlendJob.QUEUED).order_by('created_at').values_list('id', flat=True)[:10]:
+        claimed = await BlendJob.objects.filter(id=job_id, status=BlendJob.QUEUED).aupdate(
+            status=BlendJob.RUNNING,
+            started_at=timezone.now(),
+        )
+        if claimed:
+            return await BlendJob.objects.select_related('user').aget(id=job_id)
+
+    return None
+
+async def run_blend_job(
+    job: BlendJob,
+) -> None:
+    """
+    Run every stage of a blend for a claimed job, recording the result or the error on it.
+
+    Parameters:
+    ---
+        job: The claimed job to process.
+    """
+    progress = BlendProgress(job)
+    if job.started_at: # claimed off the queue, rather than run directly
+        blend_queue_seconds.observe((job.started_at - job.created_at).total_seconds())
+    cancelled = False
+    try:
+        job.result = await asyncio.wait_for(process_blend_job(job, progress), timeout=int(os.getenv('BLEND_JOB_TIMEOUT', 600)))
+        job.status = BlendJob.DONE
+        job.message = 'Playlist updated successfully.'
+    except TimeoutError:
+        job.status = BlendJob.FAILED
+        job.error = job.message = 'Blend timed out, please try again.'
+    except asyncio.CancelledError: # the worker is shutting down, record it before we go
+        cancelled = True
+        job.status = BlendJob.FAILED
+        job.error = job.message = 'Blend was cancelled, please try again.'
+    except Exception as e:
+        job.status = BlendJob.FAILED
+        job.error = job.message = str(e)
+    finally:
+        progress.cancel()
+
+    progress.end_stage()
+    blend_seconds.observe(progress.elapsed_ms() / 1000, status=job.status)
+
+    job.finished_at = timezone.now()
+    job.stage_timestamps[job.status] = job.finished_at.isoformat()
+    await job.asave(update_fields=['status', 'result', 'error', 'message', 'finished_at', 'stage_timestamps'])
+    await notify_blend_job(job, percent=100 if job.status == BlendJob.DONE else progress.percent(), elapsed_ms=progress.elapsed_ms())
+
+    if cancelled:
+        raise asyncio.CancelledError
+
+    for stats in cache_stats():
+        logger.info("%(name)s cache: %(entries)d/%(max_entries)d entries, %(hits)d hits, %(misses)d misses, %(evictions)d evictions, %(expirations)d expirations", stats)
+
+async def process_blend_job(
+    job: BlendJob,
+    progress: 'BlendProgress | None' = None,
+) -> dict:
+    """
+    The blend pipeline: source, combine, look up URIs, name and push.
+
+    Parameters:
+    ---
+        job: The job being processed.
+        progress: Where to report progress, one is made for the job if not given.
+
+    Returns:
+    ---
+        A dictionary with the playlist name, description, combined and individual playlists.
+    """
+    progress = progress or BlendProgress(job)
+    themes = job.themes
+    spotify_playlist_id = job.spotify_playlist_id
+    spotify_playlist_name = job.spotify_playlist_name
+
+    try: # get the user's access token, refreshing it if it's expired
+        access_token, user_id = await spotify_tokens.get(job.user)
+    except Exception as e:
+        raise Exception(f'Error updating Spotify access token: {e}')
+
+    async with SpotifyClient(access_token, token_provider=lambda: spotify_tokens.refresh(job.user)) as spotify:
+        if spotify_playlist_id == 'create_new': # we're creating a new playlist
+            try:
+                await progress.stage('create', f"Creating playlist {spotify_playlist_name}...")
+                spotify_playlist_id = await spotify.create_playlist(user_id, spotify_playlist_name)
+            except Exception as e:
+                raise Exception(f'Error creating new playlist: {e}')
+
+        # with streaming on, songs get looked up on spotify while the rest are still being generated
+        prefetcher = SongPrefetcher(spotify)
+        try:
+            try: # build the individual playlists
+                await progress.stage('source', "Sourcing playlists for:<br>" + "<br>".join([f" {i+1}. {theme}" for i, theme in enumerate(themes)]))
+                individual_playlists = await build_individual_playlists(themes, on_song=prefetcher.add, on_progress=progress.count)
+            except Exception as e:
+                raise Exception(f'Error building individual playlists: {e}')
+
+            try: # build the combined playlist
+                await progress.stage('combine', "Building combined playlist")
+                combined_playlist = build_combined_playlist(individual_playlists)
+            except Exception as e:
+                raise Exception(f'Error building combined playlist: {e}')
+
+            try: # grab URIs for the songs in the combined playlist, mostly cached by the prefetch
+                await progress.stage('uris', "Adding song URIs to database...")
+                await prefetcher.join()
+                song_uris = await build_song_uris(spotify, combined_playlist, on_progress=progress.count)
+            except Exception as e:
+                raise Exception(f'Error building song URIs: {e}')
+        finally:
+            prefetcher.cancel()
+
+        try: # build a name and description for the playlist (if selected)
+            await progress.stage('details', "Creating a new playlist name and description...")
+            playlist_name, playlist_description = await build_playlist_details(spotify, combined_playlist, spotify_playlist_name, spotify_playlist_id, job.playlist_rename)
+        except Exception as e:
+            raise Exception(f'Error building playlist name and description: {e}')
+
+        try: # push the combined playlist to spotify
+            await progress.stage('push', "Pushing new playlist to Spotify...")
+            await spotify.update_playlist(spotify_playlist_id, song_uris, playlist_name, playlist_description)
+        except Exception as e:
+            raise Exception(f'Error updating playlist: {e}')
+
+        spotify_playlists_cache.delete(user_id) # the playlist may have been renamed
+
+    await Generated.objects.aupdate_or_create(playlist_name=playlist_name, user_id=user_id, defaults={'themes': themes})
+
+    return {
+        'playlist_name': playlist_name,
+        'playlist_description': playlist_description,
+        'combined_playlist': combined_playlist,
+        'individual_playlists': individual_playlists,
+    }
+
+async def fail_orphaned_blend_jobs() -> int:
+    """
+    Fail jobs still RUNNING well past BLEND_JOB_TIMEOUT. A live worker times its own jobs out
+    at the timeout, so these were orphaned by a worker that died mid-blend, and their
+    pages are told so instead of spinning forever.
+
+    Returns:
+    ---
+        How many jobs were failed.
+    """
+    stale_before = timezone.now() - timedelta(seconds=int(os.getenv('BLEND_JOB_TIMEOUT', 600)) + 60)
+    failed = 0
+
+    async for job in BlendJob.objects.filter(status=BlendJob.RUNNING, started_at__lt=stale_before):
+        job.status = BlendJob.FAILED
+        job.error = job.message = 'Blend was interrupted, please try again.'
+        job.finished_at = timezone.now()
+        # only if it's still running, another worker's sweep may have beaten us to it
+        if await BlendJob.objects.filter(id=job.id, status=BlendJob.RUNNING).aupdate(status=job.status, error=job.error, message=job.message, finished_at=job.finished_at):
+            await notify_blend_job(job)
+            failed += 1
+
+    if failed:
+        logger.warning("Failed %d blend jobs orphaned by a dead worker", failed)
+    return failed
+
+async def run_blend_worker(
+    concurrency: int = 4,
+    poll_interval: float = 1.0,
+    sweep_interval: float = 60.0,
+) -> None:
+    """
+    Pull jobs off the queue forever, running up to `concurrency` of them at once. When the
+    worker is cancelled (eg. on SIGTERM), the blends in flight are cancelled and recorded
+    as failed before it stops.
+
+    Parameters:
+    ---
+        concurrency: The maximum number of blends in flight.
+        poll_interval: How long to wait between polls when idle, in seconds.
+        sweep_interval: How often to fail jobs orphaned by dead workers, in seconds.
+    """
+    await theme_index.refresh() # build it now, rather than during the first blend
+
+    running = set()
+    last_sweep = 0
+    try:
+        while True:
+            if time.monotonic() - last_sweep >= sweep_interval:
+                await fail_orphaned_blend_jobs()
+                last_sweep = time.monotonic()
+
+            while len(running) < concurrency and (job := await claim_next_blend_job()):
+                running.add(asyncio.create_task(run_blend_job(job)))
+
+            if running:
+                _, running = await asyncio.wait(running, timeout=poll_interval, return_when=asyncio.FIRST_COMPLETED)
+            else:
+                await asyncio.sleep(poll_interval)
+    finally:
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+
+        # don't lose the last batch of cache usage on shutdown
+        await playlist_usage.flush()
+        await song_usage.flush()
+
+
+####################################################################
+# Classes
+####################################################################
+
+class BlendProgress:
+    """
+    Structured progress for a running blend: the stage, overall percent, counts within the
+    stage (eg. 14/20 URIs resolved) and elapsed time.
+
+    Stage changes are saved on the job, and how long each stage took goes to the
+    blendify_blend_stage_seconds histogram. Everything is pushed to the user's sockets through a
+    coalescing throttle, at most `max_rate` messages a second per user (blends running side by
+    side in a worker take turns), where anything reported while a message is held back just
+    updates it. Reporting never waits on the channel layer, so the pipeline doesn't slow down
+    however often the fan-out loops call `count`.
+    """
+
+    def __init__(
+        self,
+        job: BlendJob,
+        max_rate: float = float(os.getenv('PROGRESS_MAX_RATE', 5)),
+    ):
+        self.job = job
+        self.interval = 1 / max_rate
+        self.started = time.monotonic()
+        self.stage_started = None
+        self.done = None
+        self.total = None
+
+        self._pending = None
+
+    def elapsed_ms(self) -> int:
+        """
+        Milliseconds since the blend started.
+        """
+        return int((time.monotonic() - self.started) * 1000)
+
+    def percent(self) -> int:
+        """
+        How far through the whole blend we are, going by the stage and its counts.
+        """
+        start, end = STAGE_PROGRESS.get(self.job.stage, (0, 0))
+        if self.total:
+            return int(start + (end - start) * self.done / self.total)
+        return start
+
+    async def stage(
+        self,
+        stage: str,
+        message: str,
+    ) -> None:
+        """
+        Move on to a new stage.
+
+        Parameters:
+        ---
+            stage: A short name for the stage (eg. "source", "push").
+            message: The progress message shown to the user.
+        """
+        self.end_stage()
+        self.stage_started = time.monotonic()
+        self.done = self.total = None
+        await set_blend_job_stage(self.job, stage, message)
+        self._schedule()
+
+    def end_stage(self) -> None:
+        """
+        Record how long the current stage took, if we're in one.
+        """
+        if self.stage_started is not None:
+            blend_stage_seconds.observe(time.monotonic() - self.stage_started, stage=self.job.stage)
+            self.stage_started = None
+
+    def count(
+        self,
+        done: int,
+        total: int,
+    ) -> None:
+        """
+        Report progress within the current stage, safe to call from tight loops.
+
+        Parameters:
+        ---
+            done: How many items are finished.
+            total: How many items there are.
+        """
+        self.done, self.total = done, total
+        self._schedule()
+
+    def cancel(self) -> None:
+        """
+        Drop any held back message (eg. once the blend has finished).
+        """
+        if self._pending:
+            self._pending.cancel()
+            self._pending = None
+
+    def _schedule(self) -> None:
+        """
+        Send the current progress in the user's next free slot, unless a send is already waiting.
+        """
+        if self._pending is None:
+            now = time.monotonic()
+            for user_id in [user_id for user_id, slot in progress_slots.items() if slot <= now]:
+                del progress_slots[user_id] # nothing to wait out, don't hold on to every user we've seen
+            slot = max(now, progress_slots.get(self.job.user_id, now))
+            progress_slots[self.job.user_id] = slot + self.interval
+            self._pending = asyncio.create_task(self._send(slot - now))
+
+    async def _send(
+        self,
+        delay: float,
+    ) -> None:
+        """
+        Wait out the throttle, then send whatever the latest progress is.
+        """
+        await asyncio.sleep(delay)
+        self._pending = None
+
+        await notify_blend_job(
+            self.job,
+            percent=self.percent(),
+            done=self.done,
+            total=self.total,
+            unit=STAGE_UNITS.get(self.job.stage) if self.total else None,
+            elapsed_ms=self.elapsed_ms(),
+        )
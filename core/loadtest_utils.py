@@ -0,0 +1,357 @@
+####################################################################
+# Library & Modules
+####################################################################
+
+# system level stuff
+import re
+import time
+import uuid
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# data analysis
+import json
+import hashlib
+from collections import Counter
+
+
+####################################################################
+# Functions
+####################################################################
+
+def fake_songs(
+    theme: str,
+    length: int,
+    artists: int = 500,
+) -> list[str]:
+    """
+    A deterministic playlist for a theme, drawn from a shared pool of artists so
+    different themes overlap the way real ones do.
+
+    Parameters:
+    ---
+        theme: The playlist theme.
+        length: How many songs to return.
+        artists: The size of the artist pool.
+
+    Returns:
+    ---
+        A list of "Artist - Song Title" strings.
+    """
+    rng = random.Random(hashlib.sha1(theme.casefold().encode()).hexdigest())
+    songs = []
+    while len(songs) < length:
+        artist = rng.randrange(artists)
+        song = f"Artist {artist} - Track {artist}-{rng.randrange(20)}"
+        if song not in songs:
+            songs.append(song)
+    return songs
+
+
+####################################################################
+# Classes
+####################################################################
+
+class FakeService:
+    """
+    Local stand-in for an external API, served from a background thread.
+
+    Every request waits `latency` seconds (give or take `jitter`), then fails with a 500
+    `error_rate` of the time or a 429 `rate_limit_rate` of the time, before the subclass
+    answers it. Calls are counted per endpoint so a load test can tell how many external
+    calls a blend costs.
+
+    Usage:
+    ---
+        with FakeSpotify(latency=0.05, rate_limit_rate=0.01) as spotify:
+            os.environ['SPOTIFY_API_URL'] = f"{spotify.url}/v1"
+    """
+
+    def __init__(
+        self,
+        latency: float = 0,
+        jitter: float = 0,
+        error_rate: float = 0,
+        rate_limit_rate: float = 0,
+        retry_after: int = 1,
+        host: str = '127.0.0.1',
+        port: int = 0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.calls = Counter() # endpoint -> requests
+        self.errors = Counter() # status -> injected failures
+
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def url(self) -> str:
+        """
+        Where the service is listening, eg. http://127.0.0.1:50123.
+        """
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> None:
+        """
+        Start serving in a background thread.
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop serving and close the socket.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset(self) -> None:
+        """
+        Zero the call and error counters.
+        """
+        with self._lock:
+            self.calls.clear()
+            self.errors.clear()
+
+    def endpoint(
+        self,
+        method: str,
+        path: str,
+    ) -> str:
+        """
+        The name calls to `path` are counted under, with IDs templated out.
+        """
+        path = re.sub(r"/(playlists|users)/[^/]+", r"/\1/{id}", path)
+        return f"{method} {path}"
+
+    def handle(
+        self,
+        method: str,
+        path: str,
+        query: dict,
+        body: dict,
+        headers: dict,
+    ) -> tuple[int, dict | str, dict]:
+        """
+        Answer a request that got past the injected failures.
+
+        Returns:
+        ---
+            The status, a JSON body (or a preformatted string) and any extra headers.
+        """
+        raise NotImplementedError
+
+    def _inject(self) -> tuple[int, dict, dict] | None:
+        """
+        Pick an injected failure for this request, if any.
+        """
+        roll = random.random()
+        if roll < self.rate_limit_rate:
+            return 429, { "error": { "status": 429, "message": "API rate limit exceeded" } }, { "Retry-After": str(self.retry_after) }
+        if roll < self.rate_limit_rate + self.error_rate:
+            return 500, { "error": { "status": 500, "message": "Injected server error" } }, {}
+        return None
+
+    def _handler(self):
+        """
+        The request handler class, bound to this service.
+        """
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def dispatch(self):
+                url = urlparse(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length) if length else b""
+                content_type = self.headers.get('Content-Type', '')
+                if 'json' in content_type and raw:
+                    body = json.loads(raw)
+                elif raw:
+                    body = { key: values[0] for key, values in parse_qs(raw.decode()).items() }
+                else:
+                    body = {}
+
+                with service._lock:
+                    service.calls[service.endpoint(self.command, url.path)] += 1
+
+                if service.latency or service.jitter:
+                    time.sleep(max(0, service.latency + random.uniform(-service.jitter, service.jitter)))
+
+                if injected := service._inject():
+                    with service._lock:
+                        service.errors[injected[0]] += 1
+                    status, payload, headers = injected
+                else:
+                    status, payload, headers = service.handle(self.command, url.path, parse_qs(url.query), body, self.headers)
+
+                if isinstance(payload, str): # already formatted (eg. a server-sent event stream)
+                    data = payload.encode()
+                    headers = { "Content-Type": "text/event-stream", **headers }
+                else:
+                    data = json.dumps(payload).encode() if payload is not None else b""
+                    headers = { "Content-Type": "application/json", **headers }
+
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PUT = do_DELETE = dispatch
+
+        return Handler
+
+class FakeSpotify(FakeService):
+    """
+    Fake Spotify Web API and accounts service: token refresh, /me/playlists (with ETags),
+    playlist create/get/update, track replacement and search. Listed playlists are all
+    collaborative, so every user can blend into them. Every search hits, with a
+    URI derived from the query so the same song always gets the same track.
+    """
+
+    def __init__(
+        self,
+        playlists_per_user: int = 20,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.playlists_per_user = playlists_per_user
+
+    def endpoint(
+        self,
+        method: str,
+        path: str,
+    ) -> str:
+        return super().endpoint(method, path.removeprefix("/v1"))
+
+    def handle(
+        self,
+        method: str,
+        path: str,
+        query: dict,
+        body: dict,
+        headers: dict,
+    ) -> tuple[int, dict, dict]:
+
+        if path == "/api/token":
+            return 200, { "access_token": f"fake-{uuid.uuid4().hex}", "token_type": "Bearer", "expires_in": 3600 }, {}
+
+        path = path.removeprefix("/v1")
+
+        if method == "GET" and path == "/search":
+            song = query.get('q', [''])[0]
+            return 200, { "tracks": { "items": [{ "uri": f"spotify:track:{hashlib.sha1(song.encode()).hexdigest()[:22]}" }] } }, {}
+
+        if method == "GET" and path == "/me/playlists":
+            offset, limit = int(query.get('offset', ['0'])[0]), int(query.get('limit', ['50'])[0])
+            items = [
+                { "id": f"loadtest{n}", "name": f"Load Test {n}", "owner": { "id": "loadtest" }, "collaborative": True }
+                for n in range(offset, min(offset + limit, self.playlists_per_user))
+            ]
+            etag = f'"{self.playlists_per_user}-{offset}"'
+            if offset == 0 and headers.get('If-None-Match') == etag:
+                return 304, None, { "ETag": etag }
+            return 200, { "items": items, "total": self.playlists_per_user, "offset": offset, "limit": limit }, { "ETag": etag }
+
+        if method == "POST" and re.fullmatch(r"/users/[^/]+/playlists", path):
+            return 201, { "id": f"created{uuid.uuid4().hex[:12]}", "name": body.get('name') }, {}
+
+        if method == "GET" and re.fullmatch(r"/playlists/[^/]+", path):
+            return 200, { "id": path.rsplit("/", 1)[-1], "description": "A load test playlist" }, {}
+
+        if method == "PUT" and re.fullmatch(r"/playlists/[^/]+", path):
+            return 200, None, {}
+
+        if method == "PUT" and re.fullmatch(r"/playlists/[^/]+/tracks", path):
+            return 200, { "snapshot_id": uuid.uuid4().hex }, {}
+
+        return 404, { "error": { "status": 404, "message": f"No fake for {method} {path}" } }, {}
+
+class FakeOpenAI(FakeService):
+    """
+    Fake OpenAI chat completions. Playlists come from fake_songs(), JSON mode answers the
+    batched playlist and playlist details prompts, and streaming sends one song per chunk
+    followed by a usage chunk.
+    """
+
+    def __init__(
+        self,
+        playlist_length: int = 50,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.playlist_length = playlist_length
+
+    def handle(
+        self,
+        method: str,
+        path: str,
+        query: dict,
+        body: dict,
+        headers: dict,
+    ) -> tuple[int, dict | str, dict]:
+
+        if method != "POST" or not path.endswith("/chat/completions"):
+            return 404, { "error": { "message": f"No fake for {method} {path}" } }, {}
+
+        system = body['messages'][0]['content']
+        prompt = body['messages'][-1]['content']
+
+        if prompt.startswith("Playlist themes: "): # batched generation
+            themes = json.loads(prompt.removeprefix("Playlist themes: "))
+            content = json.dumps({ theme: fake_songs(theme, self.playlist_length) for theme in themes })
+        elif prompt.startswith("Playlist theme: "):
+            content = "\n".join(fake_songs(prompt.removeprefix("Playlist theme: "), self.playlist_length))
+        elif '"name" and "description"' in system:
+            content = json.dumps({ "name": "load test afternoon blend", "description": "Here's some load, some tests – generated with Blendify." })
+        elif "description" in system:
+            content = "Here's some load, some tests – generated with Blendify."
+        else:
+            content = "load test afternoon blend"
+
+        model = body.get('model', 'fake')
+        usage = { "prompt_tokens": len(system + prompt) // 4, "completion_tokens": len(content) // 4, "total_tokens": (len(system + prompt) + len(content)) // 4 }
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+        if not body.get('stream'):
+            return 200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{ "index": 0, "message": { "role": "assistant", "content": content }, "finish_reason": "stop" }],
+                "usage": usage,
+            }, {}
+
+        def event(choices, usage=None):
+            return "data: " + json.dumps({ "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model, "choices": choices, "usage": usage }) + "\n\n"
+
+        events = [event([{ "index": 0, "delta": { "content": line + "\n" }, "finish_reason": None }]) for line in content.split("\n")]
+        events.append(event([{ "index": 0, "delta": {}, "finish_reason": "stop" }]))
+        if (body.get('stream_options') or {}).get('include_usage'):
+            events.append(event([], usage))
+        events.append("data: [DONE]\n\n")
+
+        return 200, "".join(events), {}
@@ -0,0 +1,47 @@
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from core.benchmark_utils import median_ms, sample_songs, seed_songs
+from core.blendify_utils import lookup_song_uris
+from core.models import Song, normalize_song_key
+
+
+class Command(BaseCommand):
+    help = "Benchmark the cached song URI lookup against Song tables of increasing size, in a throwaway test database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000, 1_000_000], help="Cached Song table sizes to benchmark against.")
+        parser.add_argument('--songs', type=int, default=100, help="Songs per lookup (a blend's worth).")
+        parser.add_argument('--repeat', type=int, default=5, help="Timed runs per table size, the median is reported.")
+        parser.add_argument('--skip-legacy', action='store_true', help="Don't time the old iregex lookup (slow on big tables).")
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+        try:
+            self.stdout.write(f"{'rows':>10}  {'indexed (ms)':>14}  {'legacy iregex (ms)':>20}")
+
+            seeded = 0
+            for rows in sorted(options['rows']):
+                seed_songs(seeded, rows)
+                seeded = rows
+
+                song_list = sample_songs(rows, options['songs'])
+                indexed = median_ms(lambda: async_to_sync(lookup_song_uris)([normalize_song_key(song) for song in song_list]), options['repeat'])
+                legacy = '-' if options['skip_legacy'] else f"{median_ms(lambda: self.legacy_lookup(song_list), options['repeat']):.2f}"
+
+                self.stdout.write(f"{rows:>10}  {indexed:>14.2f}  {legacy:>20}")
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def legacy_lookup(self, song_list):
+        """
+        The lookup build_song_uris used before normalized keys, kept here for comparison.
+        """
+        pattern = r'^(' + '|'.join([
+            song.replace('(', r'\(').replace(')', r'\)').replace('[', r'\[').replace(']', r'\]')
+            for song in song_list
+        ]) + ')$'
+        return list(Song.objects.filter(name__iregex=pattern).values('name', 'spotify_uri'))
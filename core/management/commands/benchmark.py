@@ -0,0 +1,175 @@
+import json
+import os
+import random
+import tempfile
+from pathlib import Path
+
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from core.benchmark_utils import median_ms, sample_songs, seed_songs
+from core.blendify_utils import build_combined_playlist, build_individual_playlist, build_song_uris, save_playlist
+from core.cache_utils import playlist_cache, song_cache
+from core.metrics_utils import metrics
+from core.theme_utils import normalize_theme
+
+
+class StubSpotify:
+    """
+    Stands in for SpotifyClient in build_song_uris: nothing is on Spotify, so every search is a miss.
+    """
+
+    async def get_track_uris(self, songs, on_progress=None):
+        return {song: None for song in songs}
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the blend hot paths (combining playlists, resolving URIs against seeded Song tables, and "
+        "individual playlist cache hits) in a throwaway test database. Save the results as a JSON baseline, "
+        "and compare later runs against it to fail on regressions."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--themes', type=int, nargs='+', default=[2, 5, 10, 25, 50], help="Theme counts for build_combined_playlist.")
+        parser.add_argument('--lengths', type=int, nargs='+', default=[20, 100, 1000, 10_000], help="Target playlist lengths for build_combined_playlist.")
+        parser.add_argument('--rows', type=int, nargs='+', default=[1_000, 10_000, 100_000], help="Seeded Song table sizes for build_song_uris.")
+        parser.add_argument('--songs', type=int, default=100, help="Songs per build_song_uris call (a blend's worth).")
+        parser.add_argument('--cached-themes', type=int, default=50, help="Themes looked up per build_individual_playlist run.")
+        parser.add_argument('--repeat', type=int, default=7, help="Timed runs per case, the median is reported.")
+        parser.add_argument('--only', nargs='+', choices=['combined', 'song_uris', 'individual'], help="Only run these groups.")
+        parser.add_argument('--baseline', default='benchmarks/baseline.json', help="The baseline to compare against (and --save to).")
+        parser.add_argument('--save', action='store_true', help="Write this run's results to the baseline.")
+        parser.add_argument('--tolerance', type=float, default=0.25, help="How much slower than the baseline a case may get (0.25 is 25%%).")
+        parser.add_argument('--min-delta', type=float, default=0.05, help="Ignore slowdowns smaller than this many milliseconds (timer noise).")
+
+    def handle(self, *args, **options):
+        random.seed(0) # the same inputs every run, so runs compare
+        groups = options['only'] or ['combined', 'song_uris', 'individual']
+        results = {}
+
+        scratch = tempfile.TemporaryDirectory()
+        metrics.directory = Path(scratch.name) / 'metrics' # keep the runs' metrics out of the real data directory
+
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        old_length = os.environ.get('PLAYLIST_LENGTH')
+        try:
+            if 'combined' in groups:
+                results.update(self.bench_combined(options))
+            if 'song_uris' in groups:
+                results.update(self.bench_song_uris(options))
+            if 'individual' in groups:
+                results.update(self.bench_individual(options))
+        finally:
+            if old_length is None:
+                os.environ.pop('PLAYLIST_LENGTH', None)
+            else:
+                os.environ['PLAYLIST_LENGTH'] = old_length
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            scratch.cleanup()
+
+        baseline_path = Path(options['baseline'])
+        baseline = json.loads(baseline_path.read_text())['results'] if baseline_path.exists() else {}
+        regressions = self.report(results, baseline, options['tolerance'], options['min_delta'])
+
+        if options['save']:
+            baseline_path.parent.mkdir(parents=True, exist_ok=True)
+            baseline_path.write_text(json.dumps({ 'repeat': options['repeat'], 'results': { **baseline, **results } }, indent=2, sort_keys=True))
+            self.stdout.write(f"Saved {len(results)} results to {baseline_path}")
+        elif regressions:
+            raise CommandError(f"{len(regressions)} benchmark(s) regressed past {options['tolerance']:.0%}: " + ", ".join(regressions))
+
+    ## benchmarks ##
+
+    def bench_combined(self, options):
+        """
+        build_combined_playlist across theme counts and target lengths. Each theme's playlist is
+        as long as its share of the target plus half again, with some songs shared between themes.
+        """
+        results = {}
+        for themes in options['themes']:
+            for length in options['lengths']:
+                per_theme = max(1, length // themes * 3 // 2)
+                shared = [f"Shared Artist {n} - Shared Song {n}" for n in range(per_theme // 5)]
+                individual_playlists = {
+                    f"theme {t}": shared + [f"Artist {t}-{n} - Song {n}" for n in range(per_theme - len(shared))]
+                    for t in range(themes)
+                }
+
+                os.environ['PLAYLIST_LENGTH'] = str(length)
+                results[f"combined themes={themes} length={length}"] = median_ms(lambda: build_combined_playlist(individual_playlists), options['repeat'])
+        return results
+
+    def bench_song_uris(self, options):
+        """
+        build_song_uris with a cold in-memory cache against growing Song tables, 80% of the
+        songs cached in the table and the rest known misses. Also once with a warm cache.
+        """
+        results = {}
+        spotify = StubSpotify()
+
+        seeded = 0
+        for rows in sorted(options['rows']):
+            seed_songs(seeded, rows)
+            seeded = rows
+
+            song_list = sample_songs(rows, options['songs'])
+
+            run = lambda: async_to_sync(build_song_uris)(spotify, song_list)
+            run() # records the misses, so every timed run sees the same tables
+
+            results[f"song_uris rows={rows} cold"] = median_ms(run, options['repeat'], setup=song_cache.clear)
+            results[f"song_uris rows={rows} warm"] = median_ms(run, options['repeat'])
+        return results
+
+    def bench_individual(self, options):
+        """
+        build_individual_playlist for themes that are already cached, in memory and in the database.
+        """
+        themes = [f"benchmark theme {n}" for n in range(options['cached_themes'])]
+        songs = [f"Artist {n} - Song {n}" for n in range(50)]
+        for theme in themes:
+            async_to_sync(save_playlist)(theme, songs)
+
+        async def build_all():
+            for theme in themes:
+                await build_individual_playlist(theme)
+
+        def clear_memory():
+            for theme in themes:
+                playlist_cache.delete(normalize_theme(theme))
+
+        run = async_to_sync(build_all)
+        return {
+            f"individual themes={len(themes)} database": median_ms(run, options['repeat'], setup=clear_memory),
+            f"individual themes={len(themes)} memory": median_ms(run, options['repeat']),
+        }
+
+    ## helpers ##
+
+    def report(self, results, baseline, tolerance, min_delta):
+        """
+        Print every result next to its baseline, and return the names of the ones that regressed.
+        """
+        regressions = []
+        self.stdout.write(f"{'case':<45}  {'ms':>10}  {'baseline':>10}  {'change':>8}")
+
+        for name, ms in results.items():
+            before = baseline.get(name)
+            if before is None:
+                self.stdout.write(f"{name:<45}  {ms:>10.3f}  {'-':>10}  {'-':>8}")
+                continue
+
+            change = (ms - before) / before if before else 0
+            line = f"{name:<45}  {ms:>10.3f}  {before:>10.3f}  {change:>+8.1%}"
+            if change > tolerance and ms - before > min_delta:
+                regressions.append(name)
+                self.stdout.write(self.style.ERROR(line))
+            elif change < -tolerance:
+                self.stdout.write(self.style.SUCCESS(line))
+            else:
+                self.stdout.write(line)
+
+        return regressions
@@ -0,0 +1,37 @@
+import asyncio
+import os
+import signal
+
+from django.core.management.base import BaseCommand
+
+from core.job_utils import run_blend_worker
+from core.metrics_utils import metrics
+
+
+class Command(BaseCommand):
+    help = "Run a local worker that processes queued blend jobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=int(os.getenv('BLEND_WORKER_CONCURRENCY', 4)), help="Maximum number of blends to run at once.")
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds to wait between queue polls when idle.")
+
+    def handle(self, *args, **options):
+        metrics.enable()
+        self.stdout.write(f"Blend worker started (concurrency {options['concurrency']}).")
+        asyncio.run(self.run(options['concurrency'], options['poll_interval']))
+        self.stdout.write("Blend worker stopped.")
+
+    async def run(self, concurrency, poll_interval):
+        """
+        Run the worker until SIGTERM or SIGINT, which cancel it so the blends in flight are
+        recorded as failed instead of being left RUNNING.
+        """
+        worker = asyncio.current_task()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, worker.cancel)
+
+        try:
+            await run_blend_worker(concurrency, poll_interval)
+        except asyncio.CancelledError:
+            pass
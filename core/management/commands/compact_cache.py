@@ -0,0 +1,127 @@
+from contextlib import nullcontext
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import ProtectedError
+
+from core.blendify_utils import chunked
+from core.models import Playlist, PlaylistEntry, Song
+
+
+# eviction order per policy, the first rows in it go first
+ORDERINGS = {
+    'lru': ('last_used_at', 'hit_count', 'id'),
+    'lfu': ('hit_count', 'last_used_at', 'id'),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Shrink the Playlist and Song cache tables: evict the least recently (lru) or least frequently (lfu) "
+        "used rows down to a target size, then VACUUM and ANALYZE the database and report the space reclaimed. "
+        "Songs still in a cached playlist are never evicted, so playlists are evicted first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-playlists', type=int, default=None, help="Keep at most this many cached playlists (default: don't evict playlists).")
+        parser.add_argument('--max-songs', type=int, default=None, help="Keep at most this many cached songs (default: don't evict songs).")
+        parser.add_argument('--policy', choices=sorted(ORDERINGS), default='lru', help="Evict the least recently used rows (lru) or the least used ones (lfu).")
+        parser.add_argument('--dry-run', action='store_true', help="Report what would be evicted without deleting or vacuuming anything.")
+        parser.add_argument('--no-vacuum', action='store_true', help="Evict only, skip VACUUM and ANALYZE.")
+        parser.add_argument('--full', action='store_true', help="On PostgreSQL, VACUUM FULL so space goes back to the OS (locks the tables while it runs).")
+
+    def handle(self, *args, **options):
+        for option in ('max_playlists', 'max_songs'):
+            if options[option] is not None and options[option] < 0:
+                raise CommandError(f"--{option.replace('_', '-')} can't be negative")
+
+        ordering = ORDERINGS[options['policy']]
+        size_before = self.database_size()
+        rows_before = { 'playlists': Playlist.objects.count(), 'songs': Song.objects.count() }
+
+        # a dry run really evicts, so the song count includes songs freed by evicted playlists, then rolls it back
+        with transaction.atomic() if options['dry_run'] else nullcontext():
+            # playlists first, evicting one frees up its songs
+            evicted_playlists = self.evict(
+                Playlist.objects.all(),
+                rows_before['playlists'] - options['max_playlists'] if options['max_playlists'] is not None else 0,
+                ordering,
+            )
+            evicted_songs = self.evict(
+                Song.objects.filter(playlist_entries__isnull=True),
+                rows_before['songs'] - options['max_songs'] if options['max_songs'] is not None else 0,
+                ordering,
+            )
+            if options['dry_run']:
+                transaction.set_rollback(True)
+
+        action = "Would evict" if options['dry_run'] else "Evicted"
+        self.stdout.write(f"{action} {evicted_playlists} of {rows_before['playlists']} playlists and {evicted_songs} of {rows_before['songs']} songs ({options['policy']})")
+
+        if options['dry_run']:
+            return
+
+        if options['max_songs'] is not None and (songs_left := Song.objects.count()) > options['max_songs']:
+            self.stdout.write(self.style.WARNING(f"{songs_left} songs are left, the rest are in cached playlists; lower --max-playlists to go further"))
+
+        if not options['no_vacuum']:
+            self.vacuum(options['full'])
+
+        size_after = self.database_size()
+        if size_before is None or size_after is None:
+            self.stdout.write(f"Can't measure the size of a {connection.vendor} database")
+            return
+
+        self.stdout.write(f"Database {self.megabytes(size_before)} -> {self.megabytes(size_after)}, reclaimed {self.megabytes(size_before - size_after)}")
+
+    ## helpers ##
+
+    def evict(self, queryset, excess, ordering):
+        """
+        Delete the first `excess` rows of `queryset` in eviction order, returning how many went.
+        """
+        if excess <= 0:
+            return 0
+
+        ids = list(queryset.order_by(*ordering).values_list('id', flat=True)[:excess])
+        evicted = 0
+        for chunk in chunked(ids):
+            try: # re-filtered, in case a playlist picked up one of these songs since we looked
+                evicted += queryset.filter(id__in=chunk).delete()[1].get(queryset.model._meta.label, 0)
+            except ProtectedError:
+                self.stdout.write(self.style.WARNING(f"Skipped {len(chunk)} {queryset.model._meta.verbose_name_plural} that came back into use"))
+        return evicted
+
+    def vacuum(self, full):
+        """
+        Rebuild the database file (or tables) without the freed pages, and refresh the planner's statistics.
+        """
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute("VACUUM")
+                cursor.execute("ANALYZE")
+                cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)") # in WAL mode the file only shrinks once the log is checkpointed
+            elif connection.vendor == 'postgresql':
+                tables = ", ".join(connection.ops.quote_name(model._meta.db_table) for model in (Playlist, PlaylistEntry, Song))
+                cursor.execute(f"VACUUM {'FULL ' if full else ''}ANALYZE {tables}")
+            else:
+                self.stdout.write(f"Skipping VACUUM, not supported on {connection.vendor}")
+
+    def database_size(self):
+        """
+        The database's size on disk in bytes, or None if we can't tell.
+        """
+        if connection.vendor == 'sqlite':
+            path = Path(connection.settings_dict['NAME'])
+            return sum(file.stat().st_size for file in (path, path.with_name(path.name + '-wal')) if file.exists())
+
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_database_size(current_database())")
+                return cursor.fetchone()[0]
+
+        return None
+
+    def megabytes(self, size):
+        return f"{size / 1024 / 1024:.1f} MB"
@@ -0,0 +1,253 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import AsyncClient
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from social_django.models import UserSocialAuth
+
+from core.job_utils import run_blend_worker
+from core.loadtest_utils import FakeOpenAI, FakeSpotify
+from core.metrics_utils import metrics
+from core.models import BlendJob
+from core.openai_utils import openai
+from core.spotify_utils import spotify_rate_limiter
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test the blend pipeline against local fake Spotify and OpenAI servers, in a throwaway test database. "
+        "Simulated users load /blend/, list their playlists and submit blends through it, while a blend worker runs "
+        "in the same process. Reports throughput, latency percentiles and external calls per blend."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help="Concurrent simulated users.")
+        parser.add_argument('--blends', type=int, default=3, help="Blends each user submits, one after the other.")
+        parser.add_argument('--themes', type=int, default=3, help="Themes per blend.")
+        parser.add_argument('--theme-pool', type=int, default=30, help="Distinct themes users pick from, smaller means more cache hits.")
+        parser.add_argument('--create-new', type=float, default=0.2, help="Share of blends that create a new playlist instead of replacing one.")
+        parser.add_argument('--worker-concurrency', type=int, default=int(os.getenv('BLEND_WORKER_CONCURRENCY', 4)), help="Blends the worker runs at once.")
+        parser.add_argument('--spotify-latency', type=float, default=0.05, help="Seconds each fake Spotify call takes.")
+        parser.add_argument('--openai-latency', type=float, default=1.0, help="Seconds each fake OpenAI call takes.")
+        parser.add_argument('--jitter', type=float, default=0.0, help="Random +/- seconds added to every fake call.")
+        parser.add_argument('--error-rate', type=float, default=0.0, help="Share of fake calls that fail with a 500.")
+        parser.add_argument('--rate-limit-rate', type=float, default=0.0, help="Share of fake calls that fail with a 429.")
+        parser.add_argument('--retry-after', type=int, default=1, help="Retry-After seconds sent with injected 429s.")
+        parser.add_argument('--stale-tokens', action='store_true', help="Start every user with an expired token, so the first blend refreshes it.")
+        parser.add_argument('--seed', type=int, default=None, help="Random seed for theme choice and injected failures.")
+        parser.add_argument('--timeout', type=float, default=300, help="Seconds to wait for a blend before counting it as failed.")
+        parser.add_argument('--json', dest='json_path', default=None, help="Also write the report to this file as JSON.")
+        parser.add_argument('--max-p95', type=float, default=None, help="Fail (exit non-zero) if p95 blend latency is above this many seconds.")
+        parser.add_argument('--min-throughput', type=float, default=None, help="Fail (exit non-zero) if fewer than this many blends finish per minute.")
+        parser.add_argument('--max-failures', type=int, default=0, help="Fail (exit non-zero) if more than this many blends fail.")
+
+    def handle(self, *args, **options):
+        if options['seed'] is not None:
+            random.seed(options['seed'])
+        if options['verbosity'] < 2: # the per-blend logging drowns out the report
+            logging.getLogger('core').setLevel(logging.WARNING)
+
+        fakes = {
+            'jitter': options['jitter'],
+            'error_rate': options['error_rate'],
+            'rate_limit_rate': options['rate_limit_rate'],
+            'retry_after': options['retry_after'],
+        }
+        playlist_length = int(os.environ.setdefault('PLAYLIST_LENGTH', '50'))
+        os.environ.setdefault('OPENAI_MODEL', 'gpt-4o-mini')
+        os.environ.setdefault('OPENAI_TEMPERATURE', '1')
+
+        with FakeSpotify(latency=options['spotify_latency'], **fakes) as spotify, \
+             FakeOpenAI(latency=options['openai_latency'], playlist_length=playlist_length, **fakes) as chatgpt, \
+             tempfile.TemporaryDirectory() as scratch:
+
+            # point the app at the fakes, and keep its side effects out of the real data directory
+            os.environ['SPOTIFY_API_URL'] = f"{spotify.url}/v1"
+            os.environ['SPOTIFY_ACCOUNTS_URL'] = spotify.url
+            openai.base_url = f"{chatgpt.url}/v1"
+            spotify_rate_limiter.pause_file = None
+            metrics.directory = Path(scratch) / 'metrics'
+
+            setup_test_environment() # lets the test client through ALLOWED_HOSTS
+            old_name = connection.settings_dict['NAME']
+            if connection.vendor == 'sqlite': # a file rather than shared memory, so concurrent writers behave like production
+                connection.settings_dict['TEST']['NAME'] = str(Path(scratch) / 'loadtest.sqlite3')
+            connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+            channel_layers = { "default": { "BACKEND": "core.channel_layers.SQLiteChannelLayer", "CONFIG": { "path": Path(scratch) / 'channels.sqlite3' } } }
+            try:
+                with override_settings(CHANNEL_LAYERS=channel_layers):
+                    report = asyncio.run(self.run(options, spotify, chatgpt))
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                teardown_test_environment()
+
+        self.print_report(report)
+        if options['json_path']:
+            Path(options['json_path']).write_text(json.dumps(report, indent=2))
+
+        problems = []
+        if report['failed'] > options['max_failures']:
+            problems.append(f"{report['failed']} blends failed (max {options['max_failures']})")
+        if options['max_p95'] is not None and (report['latency']['p95'] or 0) > options['max_p95']:
+            problems.append(f"p95 latency {report['latency']['p95']:.2f}s is over {options['max_p95']}s")
+        if options['min_throughput'] is not None and report['throughput_per_minute'] < options['min_throughput']:
+            problems.append(f"throughput {report['throughput_per_minute']:.1f}/min is under {options['min_throughput']}/min")
+        if problems:
+            raise CommandError("Load test failed: " + "; ".join(problems))
+
+    async def run(self, options, spotify, chatgpt):
+        """
+        Seed the users, start a worker, and drive every user's blends through the views.
+        """
+        users = [await self.create_user(n, options['stale_tokens']) for n in range(options['users'])]
+        theme_pool = [f"load test theme {n}" for n in range(options['theme_pool'])]
+
+        spotify.reset()
+        chatgpt.reset()
+        worker = asyncio.create_task(run_blend_worker(options['worker_concurrency'], poll_interval=0.05))
+
+        started = time.perf_counter()
+        try:
+            results = await asyncio.gather(*(self.simulate_user(user, theme_pool, options) for user in users))
+        finally:
+            worker.cancel()
+        elapsed = time.perf_counter() - started
+
+        blends = [blend for user_blends in results for blend in user_blends]
+        done = [blend for blend in blends if blend['status'] == BlendJob.DONE]
+        latencies = sorted(blend['seconds'] for blend in done)
+
+        stages = metrics.snapshot()['blendify_blend_stage_seconds']['samples']
+
+        return {
+            'users': options['users'],
+            'blends': len(blends),
+            'done': len(done),
+            'failed': len(blends) - len(done),
+            'errors': sorted({ blend['error'] for blend in blends if blend['error'] }),
+            'elapsed_seconds': elapsed,
+            'throughput_per_minute': len(done) / elapsed * 60,
+            'latency': {
+                'mean': statistics.mean(latencies) if latencies else None,
+                'p50': self.percentile(latencies, 50),
+                'p95': self.percentile(latencies, 95),
+                'p99': self.percentile(latencies, 99),
+                'max': latencies[-1] if latencies else None,
+            },
+            'stage_mean_seconds': { json.loads(key)[0]: value[-2] / value[-1] for key, value in stages.items() if value[-1] },
+            'spotify_calls': dict(spotify.calls),
+            'openai_calls': dict(chatgpt.calls),
+            'spotify_calls_per_blend': sum(spotify.calls.values()) / max(len(blends), 1),
+            'openai_calls_per_blend': sum(chatgpt.calls.values()) / max(len(blends), 1),
+            'injected_failures': { 'spotify': dict(spotify.errors), 'openai': dict(chatgpt.errors) },
+        }
+
+    async def create_user(self, n, stale_tokens):
+        """
+        A user with a linked Spotify account, holding a fresh (or already expired) token.
+        """
+        user = await User.objects.acreate(username=f"loadtest{n}")
+        await UserSocialAuth.objects.acreate(
+            user=user,
+            provider='spotify',
+            uid=f"loadtest{n}",
+            extra_data={
+                'access_token': f"fake-{n}",
+                'refresh_token': f"fake-refresh-{n}",
+                'auth_time': int(time.time()) - (7200 if stale_tokens else 0),
+                'expires': 3600,
+            },
+        )
+        return user
+
+    async def simulate_user(self, user, theme_pool, options):
+        """
+        One user's session: open the page, list playlists, then submit blends and wait for each.
+        """
+        client = AsyncClient()
+        await client.aforce_login(user)
+
+        await client.get('/blend/')
+        playlists = (await client.get('/spotify_playlists/')).json().get('playlists', [])
+
+        blends = []
+        for _ in range(options['blends']):
+            themes = random.sample(theme_pool, min(options['themes'], len(theme_pool)))
+            if random.random() < options['create_new'] or not playlists:
+                form = { 'spotify_playlist': 'create_new', 'new_playlist_name': f"{user.username} blend", 'theme': themes }
+            else:
+                playlist = random.choice(playlists)
+                form = { 'spotify_playlist': playlist['id'], 'spotify_playlist_name': playlist['name'], 'theme': themes, 'playlist_rename': 'on' }
+
+            started = time.perf_counter()
+            response = await client.post('/blend/', form)
+            if response.status_code != 302:
+                blends.append({ 'status': BlendJob.FAILED, 'seconds': time.perf_counter() - started, 'error': f"POST /blend/ returned {response.status_code}" })
+                continue
+
+            job_id = int(response['Location'].rsplit('=', 1)[-1])
+            job = await self.wait_for_job(job_id, options['timeout'])
+            await client.get(response['Location']) # the page the browser lands on once the socket says it's done
+
+            blends.append({ 'status': job.status, 'seconds': time.perf_counter() - started, 'error': job.error or None })
+
+        return blends
+
+    async def wait_for_job(self, job_id, timeout):
+        """
+        Poll a job until it's finished (the browser hears about this over the websocket).
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            job = await BlendJob.objects.aget(id=job_id)
+            if job.status in (BlendJob.DONE, BlendJob.FAILED):
+                return job
+            if time.monotonic() > deadline:
+                job.status, job.error = BlendJob.FAILED, f"Timed out after {timeout}s"
+                return job
+            await asyncio.sleep(0.05)
+
+    def percentile(self, values, percent):
+        """
+        Nearest-rank percentile of sorted `values`.
+        """
+        if not values:
+            return None
+        return values[min(len(values) - 1, max(0, round(percent / 100 * len(values) + 0.5) - 1))]
+
+    def print_report(self, report):
+        """
+        Write the report out as a table.
+        """
+        latency = report['latency']
+
+        def seconds(value):
+            return '-' if value is None else f"{value:.2f}s"
+
+        self.stdout.write(f"{report['blends']} blends from {report['users']} users in {report['elapsed_seconds']:.1f}s: {report['done']} done, {report['failed']} failed")
+        self.stdout.write(f"throughput   {report['throughput_per_minute']:.1f} blends/min")
+        self.stdout.write(f"latency      mean {seconds(latency['mean'])}  p50 {seconds(latency['p50'])}  p95 {seconds(latency['p95'])}  p99 {seconds(latency['p99'])}  max {seconds(latency['max'])}")
+        self.stdout.write(f"stages       " + "  ".join(f"{stage} {value:.2f}s" for stage, value in report['stage_mean_seconds'].items()))
+        self.stdout.write(f"per blend    {report['spotify_calls_per_blend']:.1f} Spotify calls, {report['openai_calls_per_blend']:.1f} OpenAI calls")
+
+        for service in ('spotify', 'openai'):
+            for endpoint, calls in sorted(report[f'{service}_calls'].items()):
+                self.stdout.write(f"  {service:<8} {endpoint:<40} {calls:>6}")
+
+        for service, failures in report['injected_failures'].items():
+            if failures:
+                self.stdout.write(f"injected     {service}: " + ", ".join(f"{count} x {status}" for status, count in sorted(failures.items())))
+
+        for error in report['errors']:
+            self.stdout.write(self.style.ERROR(f"error        {error}"))
@@ -0,0 +1,506 @@
+####################################################################
+# Library & Modules
+####################################################################
+
+# system level stuff
+import os
+import atexit
+import logging
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from django.conf import settings
+
+# blendify specific imports
+from core.cache_utils import cache_stats
+
+# data analysis
+import json
+
+try: # file locking, only to stop two processes folding in the same dead snapshot
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+####################################################################
+# Environment Variables
+####################################################################
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# seconds, from a cache hit up to a slow blend
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+####################################################################
+# Functions
+####################################################################
+
+def format_labels(
+    labels: dict,
+) -> str:
+    """
+    Render labels in the Prometheus text format, eg. {stage="uris",status="200"}.
+    """
+    if not labels:
+        return ""
+
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels.items()) + "}"
+
+def format_value(
+    value: float,
+) -> str:
+    """
+    Render a sample value, without the trailing .0 on whole numbers.
+    """
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+def merge_snapshots(
+    snapshots: list[dict],
+) -> dict:
+    """
+    Add metric snapshots together, sample by sample.
+
+    Parameters:
+    ---
+        snapshots: Snapshots in the form MetricsRegistry.snapshot() returns.
+
+    Returns:
+    ---
+        One snapshot holding the totals.
+    """
+    merged = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            entry = merged.setdefault(name, { **metric, 'samples': {} })
+            for key, value in metric['samples'].items():
+                if metric['type'] == 'histogram':
+                    current = entry['samples'].get(key, [0] * len(value))
+                    entry['samples'][key] = [a + b for a, b in zip(current, value)]
+                else:
+                    entry['samples'][key] = entry['samples'].get(key, 0) + value
+    return merged
+
+def process_start_time(
+    pid: int,
+) -> str | None:
+    """
+    When a process started, in clock ticks since boot, or None where there's no /proc.
+    Together with the PID this tells a process apart from a later one that reused its PID.
+    """
+    try:
+        stat = Path(f"/proc/{pid}/stat").read_text()
+    except OSError:
+        return None
+    return stat.rsplit(")", 1)[1].split()[19] # starttime, field 22 (the command name can hold spaces)
+
+def process_alive(
+    pid: int,
+    started: str | None,
+) -> bool:
+    """
+    Whether the process that wrote a snapshot is still running.
+
+    Parameters:
+    ---
+        pid: The PID in the snapshot.
+        started: The process start time in the snapshot.
+
+    Returns:
+    ---
+        False if the PID is gone, or now belongs to a different process.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError: # running, just not ours
+        pass
+    return started is None or process_start_time(pid) in (None, started)
+
+
+####################################################################
+# Classes
+####################################################################
+
+class Counter:
+    """
+    A monotonically increasing count, per label combination.
+    """
+
+    type = 'counter'
+
+    def __init__(
+        self,
+        registry: 'MetricsRegistry',
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+    ):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {} # label values -> count
+
+    def inc(
+        self,
+        amount: float = 1,
+        **labels,
+    ) -> None:
+        """
+        Add to the count for a label combination.
+        """
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self.registry._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        self.registry.changed()
+
+    def samples(self) -> dict:
+        """
+        The current counts, keyed by JSON encoded label values.
+        """
+        with self.registry._lock:
+            return { json.dumps(key): value for key, value in self._values.items() }
+
+class Histogram:
+    """
+    Observations (usually durations in seconds) counted into cumulative buckets, per label combination.
+    """
+
+    type = 'histogram'
+
+    def __init__(
+        self,
+        registry: 'MetricsRegistry',
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        buckets: tuple = DEFAULT_BUCKETS,
+    ):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._values = {} # label values -> [bucket counts..., sum, count]
+
+    def observe(
+        self,
+        value: float,
+        **labels,
+    ) -> None:
+        """
+        Record an observation for a label combination.
+        """
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self.registry._lock:
+            sample = self._values.setdefault(key, [0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    sample[i] += 1
+            sample[-2] += value
+            sample[-1] += 1
+        self.registry.changed()
+
+    def samples(self) -> dict:
+        """
+        The current buckets, sum and count, keyed by JSON encoded label values.
+        """
+        with self.registry._lock:
+            return { json.dumps(key): list(value) for key, value in self._values.items() }
+
+class MetricsRegistry:
+    """
+    Every metric this process records, shared with the other processes on the host.
+
+    The long-lived processes (daphne, blend workers) call enable(), then a background thread
+    writes a snapshot of their metrics to their own file in `directory` every `flush_interval`
+    seconds that anything changed. Anything else (management commands, one-off scripts) only
+    counts in memory, so it can't leak into /metrics. Rendering reads every snapshot and adds
+    them up, so /metrics on any web process covers the workers too. A process that exits folds
+    its final counts into `retired.json` and removes its file, and files left by processes that
+    died without doing so are folded in at render time, so counters never go backwards when a
+    process restarts. Collectors are callables that produce counter values at snapshot time,
+    for numbers that are already counted elsewhere (like the in-memory cache's hits and misses).
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        flush_interval: float = 5,
+    ):
+        self.directory = Path(directory)
+        self.flush_interval = flush_interval
+        self.metrics = {}
+        self.collectors = []
+
+        self.enabled = False
+
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._stopped = threading.Event()
+        self._flusher = None
+        self._started = process_start_time(os.getpid())
+
+    @property
+    def file(self) -> Path:
+        """
+        This process's snapshot file.
+        """
+        return self.directory / f"{os.getpid()}.json"
+
+    @property
+    def retired_file(self) -> Path:
+        """
+        The running totals of every process that has exited.
+        """
+        return self.directory / "retired.json"
+
+    def enable(self) -> None:
+        """
+        Start writing this process's snapshot file, and retire it on exit.
+        """
+        if self.enabled:
+            return
+        self.enabled = True
+        self._stopped.clear()
+        self.flush()
+
+        self._flusher = threading.Thread(target=self._flush_periodically, name="metrics-flusher", daemon=True)
+        self._flusher.start()
+        atexit.register(self.shutdown)
+
+    def shutdown(self) -> None:
+        """
+        Stop flushing, and fold this process's final counts into the retired totals.
+        """
+        if not self.enabled:
+            return
+        self.enabled = False
+        self._stopped.set()
+        self._flusher.join()
+
+        self.flush()
+        self.retire(self.file)
+
+    def _flush_periodically(self) -> None:
+        """
+        The flusher thread, writes the snapshot file every `flush_interval` seconds that something changed.
+        """
+        while not self._stopped.wait(self.flush_interval):
+            if self._dirty:
+                self.flush()
+
+    def counter(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+    ) -> Counter:
+        """
+        Register a counter.
+        """
+        self.metrics[name] = Counter(self, name, documentation, labelnames)
+        return self.metrics[name]
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        buckets: tuple = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        """
+        Register a histogram.
+        """
+        self.metrics[name] = Histogram(self, name, documentation, labelnames, buckets)
+        return self.metrics[name]
+
+    def collector(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple,
+        func,
+    ) -> None:
+        """
+        Register a counter whose values come from `func` at snapshot time.
+
+        Parameters:
+        ---
+            name: The metric name.
+            documentation: The metric's help text.
+            labelnames: The label names, in order.
+            func: Returns a dictionary of label value tuples and their counts.
+        """
+        self.collectors.append((name, documentation, labelnames, func))
+
+    def snapshot(self) -> dict:
+        """
+        This process's metrics, in the form written to its snapshot file.
+        """
+        snapshot = {
+            name: { 'type': metric.type, 'help': metric.documentation, 'labels': metric.labelnames, 'buckets': getattr(metric, 'buckets', None), 'samples': metric.samples() }
+            for name, metric in self.metrics.items()
+        }
+        for name, documentation, labelnames, func in self.collectors:
+            snapshot[name] = { 'type': 'counter', 'help': documentation, 'labels': labelnames, 'buckets': None, 'samples': { json.dumps(list(key)): value for key, value in func().items() } }
+        return snapshot
+
+    def changed(self) -> None:
+        """
+        Called on every update, the flusher thread writes it out.
+        """
+        self._dirty = True
+
+    def flush(self) -> None:
+        """
+        Write this process's snapshot file.
+        """
+        self._dirty = False
+        try:
+            self.write(self.file, { 'pid': os.getpid(), 'started': self._started, 'metrics': self.snapshot() })
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning("Couldn't write metrics snapshot: %s", e)
+
+    def write(
+        self,
+        file: Path,
+        data: dict,
+    ) -> None:
+        """
+        Write a JSON file then rename it into place, so readers never see a half written one.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp_file = file.with_name(f"{file.name}.{os.getpid()}.tmp")
+        tmp_file.write_text(json.dumps(data))
+        os.replace(tmp_file, file)
+
+    @contextmanager
+    def _retire_lock(self):
+        """
+        Hold the lock on the retired totals, across processes.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self.directory / "retired.lock", "w") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def retired(self) -> dict:
+        """
+        The totals of every process that has exited.
+        """
+        try:
+            return json.loads(self.retired_file.read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def retire(
+        self,
+        file: Path,
+    ) -> None:
+        """
+        Fold a finished process's snapshot into the retired totals, then delete it.
+        Whoever gets the lock first does it, later callers find the file already gone.
+        """
+        try:
+            with self._retire_lock():
+                try:
+                    snapshot = json.loads(file.read_text())
+                except FileNotFoundError:
+                    return
+                except ValueError: # never finished writing, nothing to keep
+                    file.unlink(missing_ok=True)
+                    return
+
+                if isinstance(snapshot, dict) and 'metrics' in snapshot:
+                    self.write(self.retired_file, merge_snapshots([self.retired(), snapshot['metrics']]))
+                file.unlink(missing_ok=True)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning("Couldn't retire metrics snapshot %s: %s", file.name, e)
+
+    def collect(self) -> list[dict]:
+        """
+        Every live process's snapshot, ours straight from memory, and the retired totals.
+        Snapshots whose process has died are retired first.
+        """
+        snapshots = [self.snapshot()]
+        for file in self.directory.glob("*.json"):
+            if file in (self.file, self.retired_file):
+                continue
+            try:
+                snapshot = json.loads(file.read_text())
+            except (OSError, ValueError):
+                continue # mid-write or gone, it'll be there next scrape
+
+            if not isinstance(snapshot, dict) or 'metrics' not in snapshot:
+                file.unlink(missing_ok=True)
+            elif not process_alive(snapshot['pid'], snapshot['started']):
+                self.retire(file)
+            else:
+                snapshots.append(snapshot['metrics'])
+        return snapshots + [self.retired()]
+
+    def render(self) -> str:
+        """
+        Every process's metrics added together, in the Prometheus text exposition format.
+        """
+        merged = merge_snapshots(self.collect())
+
+        lines = []
+        for name, metric in sorted(merged.items()):
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            for key, value in sorted(metric['samples'].items()):
+                labels = dict(zip(metric['labels'], json.loads(key)))
+                if metric['type'] == 'histogram':
+                    for bound, count in zip(metric['buckets'], value):
+                        lines.append(f"{name}_bucket{format_labels({ **labels, 'le': format_value(bound) })} {format_value(count)}")
+                    lines.append(f"{name}_bucket{format_labels({ **labels, 'le': '+Inf' })} {format_value(value[-1])}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {format_value(value[-2])}")
+                    lines.append(f"{name}_count{format_labels(labels)} {format_value(value[-1])}")
+                else:
+                    lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+####################################################################
+# Metrics
+####################################################################
+
+metrics = MetricsRegistry(
+    directory=Path(os.getenv('METRICS_DIR', settings.BASE_DIR / 'data' / 'metrics')),
+    flush_interval=float(os.getenv('METRICS_FLUSH_INTERVAL', 5)),
+)
+
+# blends
+blend_seconds = metrics.histogram('blendify_blend_seconds', "Time from a blend starting to it finishing.", ('status',))
+blend_stage_seconds = metrics.histogram('blendify_blend_stage_seconds', "Time spent in each stage of a blend.", ('stage',))
+blend_queue_seconds = metrics.histogram('blendify_blend_queue_seconds', "Time a blend waited for a worker.")
+
+# caches, counted by the caches themselves
+metrics.collector('blendify_cache_lookups_total', "In-process cache lookups.", ('cache', 'result'), lambda: {
+    key: value
+    for stats in cache_stats()
+    for key, value in (((stats['name'], 'hit'), stats['hits']), ((stats['name'], 'miss'), stats['misses']))
+})
+theme_lookups = metrics.counter('blendify_theme_lookups_total', "Cached playlist lookups in the database, by how the theme matched.", ('result',))
+
+# openai
+openai_requests = metrics.counter('blendify_openai_requests_total', "Chat completion calls.", ('model', 'kind', 'status'))
+openai_request_seconds = metrics.histogram('blendify_openai_request_seconds', "Chat completion latency.", ('model', 'kind'))
+openai_tokens = metrics.counter('blendify_openai_tokens_total', "Tokens used by chat completions.", ('model', 'type'))
+
+# spotify
+spotify_requests = metrics.counter('blendify_spotify_requests_total', "Spotify Web API calls.", ('method', 'endpoint', 'status'))
+spotify_request_seconds = metrics.histogram('blendify_spotify_request_seconds', "Spotify Web API latency.", ('method', 'endpoint'))
+spotify_retries = metrics.counter('blendify_spotify_retries_total', "Spotify calls retried, by why.", ('reason',))
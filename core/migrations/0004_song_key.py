@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:19
+
+from django.db import migrations, models
+
+
+def populate_song_keys(apps, schema_editor):
+    """
+    Fill in the normalized key for every song. Rows that normalize to the same key
+    are duplicates, so we keep the oldest one (preferring one with a URI) and drop the rest.
+    """
+    Song = apps.get_model('core', 'Song')
+
+    kept = {}
+    duplicates = []
+    for song in Song.objects.order_by('id').iterator(chunk_size=2000):
+        key = ' '.join(song.name.casefold().split())
+        if key not in kept:
+            song.key = key
+            kept[key] = song
+        elif not kept[key].spotify_uri and song.spotify_uri:
+            duplicates.append(kept[key].id)
+            song.key = key
+            kept[key] = song
+        else:
+            duplicates.append(song.id)
+
+    for i in range(0, len(duplicates), 500):
+        Song.objects.filter(id__in=duplicates[i:i + 500]).delete()
+
+    Song.objects.bulk_update(kept.values(), ['key'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_blendjob'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='song',
+            name='unique_song_name_case_insensitive',
+        ),
+        migrations.RemoveIndex(
+            model_name='song',
+            name='song_name_lower_idx',
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='key',
+            field=models.CharField(max_length=255, null=True),
+        ),
+        migrations.RunPython(populate_song_keys, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='song',
+            name='key',
+            field=models.CharField(max_length=255, unique=True),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_song_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SongMiss',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('key', models.CharField(max_length=255, unique=True)),
+                ('attempts', models.PositiveIntegerField(default=1)),
+                ('checked_at', models.DateTimeField()),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_songmiss'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ThemeClaim',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('theme', models.CharField(max_length=255, unique=True)),
+                ('claimed_at', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_playlist_entries(apps, schema_editor):
+    """
+    Turn each playlist's JSON song list into ordered entries. Songs we've never looked up
+    get a Song row without a URI, which is filled in the first time a blend resolves it.
+    """
+    Playlist = apps.get_model('core', 'Playlist')
+    PlaylistEntry = apps.get_model('core', 'PlaylistEntry')
+    Song = apps.get_model('core', 'Song')
+
+    for playlist in Playlist.objects.order_by('id').iterator(chunk_size=500):
+        names = [name for name in playlist.song_list if isinstance(name, str) and name.strip()]
+        keys = [' '.join(name.casefold().split()) for name in names]
+
+        Song.objects.bulk_create(
+            [Song(name=name, key=key) for name, key in zip(names, keys)],
+            ignore_conflicts=True,
+            batch_size=500,
+        )
+
+        song_ids = {}
+        unique_keys = list(set(keys))
+        for i in range(0, len(unique_keys), 500):
+            song_ids.update(Song.objects.filter(key__in=unique_keys[i:i + 500]).values_list('key', 'id'))
+
+        PlaylistEntry.objects.bulk_create(
+            [PlaylistEntry(playlist_id=playlist.id, song_id=song_ids[key], position=position) for position, key in enumerate(keys)],
+            batch_size=500,
+        )
+
+def populate_song_lists(apps, schema_editor):
+    """
+    The reverse: rebuild each playlist's JSON song list from its entries.
+    """
+    Playlist = apps.get_model('core', 'Playlist')
+    PlaylistEntry = apps.get_model('core', 'PlaylistEntry')
+
+    for playlist in Playlist.objects.order_by('id').iterator(chunk_size=500):
+        playlist.song_list = list(PlaylistEntry.objects.filter(playlist_id=playlist.id).order_by('position').values_list('song__name', flat=True))
+        playlist.save(update_fields=['song_list'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_themeclaim'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlaylistEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField()),
+                ('playlist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entries', to='core.playlist')),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='playlist_entries', to='core.song')),
+            ],
+            options={
+                'ordering': ['playlist', 'position'],
+                'constraints': [models.UniqueConstraint(fields=('playlist', 'position'), name='unique_playlist_position')],
+            },
+        ),
+        migrations.RunPython(populate_playlist_entries, populate_song_lists),
+        migrations.RemoveField(
+            model_name='playlist',
+            name='song_list',
+        ),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:05
+
+import re
+
+from django.db import migrations, models
+
+
+THEME_STOPWORDS = {'a', 'an', 'the', 'of', 'song', 'songs', 'music', 'playlist', 'tracks', 'vibes'}
+
+
+def normalize_theme(theme):
+    """
+    core.theme_utils.normalize_theme as of this migration, frozen so later changes to it don't change what this does.
+    """
+    text = theme.casefold().replace("'", "").replace("’", "").replace("&", " and ")
+    text = re.sub(r"[^\w\s]", " ", text)
+    text = re.sub(r"\b(?:19|20)(\d0s)\b", r"\1", text)
+    tokens = sorted({token for token in text.split() if token not in THEME_STOPWORDS})
+    return ' '.join(tokens) or theme.casefold().strip()
+
+
+def populate_theme_keys(apps, schema_editor):
+    """
+    Fill in the normalized key for every playlist. Playlists that normalize to the same key
+    are duplicates (races, case variants and paraphrases), so we keep the newest one and drop the rest.
+    """
+    Playlist = apps.get_model('core', 'Playlist')
+
+    kept = {}
+    duplicates = []
+    for playlist in Playlist.objects.order_by('-created_at', '-id').iterator(chunk_size=2000):
+        key = normalize_theme(playlist.theme)[:255]
+        if key in kept:
+            duplicates.append(playlist.id)
+        else:
+            playlist.theme_key = key
+            kept[key] = playlist
+
+    for i in range(0, len(duplicates), 500):
+        Playlist.objects.filter(id__in=duplicates[i:i + 500]).delete()
+
+    Playlist.objects.bulk_update(kept.values(), ['theme_key'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    # deleting duplicates cascades to their entries, and PostgreSQL won't ALTER a table with those FK checks
+    # still pending in the same transaction, so the data step commits on its own before the unique constraint
+    atomic = False
+
+    dependencies = [
+        ('core', '0007_playlistentry'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='playlist',
+            name='core_playli_theme_8adb5e_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='playlist',
+            name='playlist_theme_lower_idx',
+        ),
+        migrations.AlterField(
+            model_name='playlist',
+            name='theme',
+            field=models.CharField(max_length=255),
+        ),
+        migrations.AddField(
+            model_name='playlist',
+            name='theme_key',
+            field=models.CharField(max_length=255, null=True),
+        ),
+        migrations.RunPython(populate_theme_keys, migrations.RunPython.noop, atomic=True),
+        migrations.AlterField(
+            model_name='playlist',
+            name='theme_key',
+            field=models.CharField(max_length=255, unique=True),
+        ),
+    ]
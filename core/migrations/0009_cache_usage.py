@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:40
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def backfill_last_used(apps, schema_editor):
+    """
+    We don't know when existing rows were last used, creation is the best guess we have
+    (and better than every row tying at the time of the migration).
+    """
+    for model in ('Playlist', 'Song'):
+        apps.get_model('core', model).objects.update(last_used_at=models.F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_playlist_theme_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='playlist',
+            name='hit_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='playlist',
+            name='last_used_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='hit_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='last_used_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(backfill_last_used, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,6 @@
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
 
 class Generated(models.Model):
     playlist_name = models.CharField(max_length=255)
@@ -8,36 +10,106 @@ class Generated(models.Model):
     def __str__(self):
         return f"{self.playlist_name} ({self.user_id})"
 
-class Playlist(models.Model):
-    theme = models.CharField(max_length=255, db_index=True)
-    song_list = models.JSONField(default=list)
+class BlendJob(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='blend_jobs')
+    themes = models.JSONField()
+    spotify_playlist_id = models.CharField(max_length=255)
+    spotify_playlist_name = models.CharField(max_length=255, blank=True)
+    playlist_rename = models.BooleanField(default=False)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    stage = models.CharField(max_length=32, blank=True)
+    message = models.TextField(blank=True)
+    error = models.TextField(blank=True)
+    result = models.JSONField(null=True, blank=True)
+    stage_timestamps = models.JSONField(default=dict, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         indexes = [
-            models.Index(fields=['theme']),
-            models.Index(models.functions.Lower('theme'), name='playlist_theme_lower_idx'),
+            models.Index(fields=['status', 'created_at']),
         ]
 
+    def __str__(self):
+        return f"{self.spotify_playlist_name or self.spotify_playlist_id} ({self.status})"
+
+class Playlist(models.Model):
+    theme = models.CharField(max_length=255)
+    theme_key = models.CharField(max_length=255, unique=True) # normalize_theme(theme), one playlist per key
+    created_at = models.DateTimeField(auto_now_add=True) # reset when the playlist is regenerated
+    last_used_at = models.DateTimeField(default=timezone.now) # written in batches by playlist_usage
+    hit_count = models.PositiveIntegerField(default=0)
+
     def __str__(self):
         return self.theme
     
+class ThemeClaim(models.Model):
+    theme = models.CharField(max_length=255, unique=True)
+    claimed_at = models.DateTimeField()
+
+    def __str__(self):
+        return self.theme
+
+def normalize_song_key(
+    name: str,
+) -> str:
+    """
+    The lookup key for a song: case-folded, with whitespace collapsed.
+    """
+    return ' '.join(name.casefold().split())
+
 class Song(models.Model):
     name = models.CharField(max_length=255, db_index=True)
+    key = models.CharField(max_length=255, unique=True)
     spotify_uri = models.CharField(max_length=100, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(default=timezone.now) # written in batches by song_usage
+    hit_count = models.PositiveIntegerField(default=0)
 
     class Meta:
         indexes = [
             models.Index(fields=['name']),
-            models.Index(models.functions.Lower('name'), name='song_name_lower_idx'),
         ]
+
+    def save(self, *args, **kwargs):
+        self.key = normalize_song_key(self.name)
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.name} ({self.spotify_uri})"
+
+class SongMiss(models.Model):
+    name = models.CharField(max_length=255)
+    key = models.CharField(max_length=255, unique=True)
+    attempts = models.PositiveIntegerField(default=1)
+    checked_at = models.DateTimeField()
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.name} (miss x{self.attempts})"
+
+class PlaylistEntry(models.Model):
+    playlist = models.ForeignKey(Playlist, on_delete=models.CASCADE, related_name='entries')
+    song = models.ForeignKey(Song, on_delete=models.PROTECT, related_name='playlist_entries')
+    position = models.PositiveIntegerField()
+
+    class Meta:
+        ordering = ['playlist', 'position']
         constraints = [
-            models.UniqueConstraint(
-                models.functions.Lower('name'), 
-                name='unique_song_name_case_insensitive'
-            ),
+            models.UniqueConstraint(fields=['playlist', 'position'], name='unique_playlist_position'),
         ]
 
     def __str__(self):
-        return f"{self.name} ({self.spotify_uri})"
\ No newline at end of file
+        return f"{self.playlist.theme} #{self.position}"
@@ -4,23 +4,33 @@
 
 #system level stuff
 import os
+import re
 import time
+import logging
+import threading
+from pathlib import Path
 from dotenv import load_dotenv
+from django.conf import settings
 
 # data analysis
-import requests
+import httpx
 import base64
 
 # parallels and retries
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import asyncio
 import backoff
 
+# blendify specific imports
+from core.cache_utils import SingleFlight, spotify_playlists_cache, spotify_token_cache
+from core.metrics_utils import spotify_requests, spotify_request_seconds, spotify_retries
+
 
 ####################################################################
 # Environment Variables
 ####################################################################
 
 load_dotenv()
+logger = logging.getLogger(__name__)
 
 
 ####################################################################
@@ -31,7 +41,8 @@ def can_retry(
     exception: Exception,
 ) -> bool:
     """
-    Determines if an exception should be retried.
+    Determines if an exception should be retried. Rate limits are handled by the
+    rate limiter, so this only covers server errors and dropped connections.
 
     Parameters:
         exception: The exception to check.
@@ -40,291 +51,693 @@ def can_retry(
         True if the exception should be retried, False otherwise.
     """
 
-    if isinstance(exception, requests.HTTPError):
-        code = exception.response.status_code
-        return code == 429 or 500 <= code < 600
-    
-    return False
-
-@backoff.on_exception(backoff.expo, Exception, max_tries=5, giveup=lambda e: not can_retry(e))
-def create_spotify_playlist(
-    access_token: str,
-    user_id: str,
-    playlist_name: str,
+    if isinstance(exception, httpx.HTTPStatusError):
+        return 500 <= exception.response.status_code < 600
+
+    return isinstance(exception, httpx.TransportError)
+
+def spotify_endpoint(
+    url: str,
 ) -> str:
     """
-    Create a new Spotify playlist.
-
-    Parameters:
-    ---
-        access_token: The user's Spotify access token.
-        user_id: The user's Spotify ID.
-        playlist_name: The name of the playlist to create.
+    The endpoint a request URL is for, with IDs swapped for a placeholder so metrics
+    don't get a label per playlist. eg. "/playlists/37i9dQZF1DX/tracks?offset=50"
+    becomes "/playlists/{id}/tracks".
+    """
+    path = httpx.URL(url).path.removeprefix("/v1")
+    return re.sub(r"/(playlists|users|tracks|albums|artists)/[^/]+", r"/\1/{id}", path)
 
-    Return:
-    ---
-        The ID of the created playlist.
+def record_spotify_retry(
+    details: dict,
+) -> None:
     """
-    
-    url = f"https://api.spotify.com/v1/users/{user_id}/playlists"
-    headers = { "Authorization": f"Bearer {access_token}", "Content-Type": "application/json" }
-    data = { "name": playlist_name, "description": "Created with Blendify. https://github.com/dsabecky/blendify-web", "public": True }
-    response = requests.post(url, headers=headers, json=data)
-
-    # retry if we're rate limited
-    if response.status_code == 429:
-        retry_after = int(response.headers.get('Retry-After', '5'))
-        time.sleep(retry_after)
-        raise requests.HTTPError(response=response)
-    
-    # fail out due to an error
-    elif response.status_code not in (200, 201):
-        raise Exception(f"Failed to create playlist: {response.status_code} {response.text}")
-    
-    # return the playlistID
-    playlist_data = response.json()
-    return playlist_data['id']
-
-@backoff.on_exception(backoff.expo, Exception, max_tries=5, giveup=lambda e: not can_retry(e))
-def get_spotify_playlist_description(
-    access_token: str,
-    playlist_id: str,
-) -> str | None:
+    backoff hook, counts the retries of server errors and dropped connections.
     """
-    Get the description of a Spotify playlist by playlistID.
+    exception = details.get('exception')
+    spotify_retries.inc(reason='server_error' if isinstance(exception, httpx.HTTPStatusError) else 'connection')
 
-    Parameters:
-    ---
-        access_token: The user's Spotify access token.
-        playlist_id: The ID of the playlist to get the description of.
+async def refresh_spotify_access_token(
+    social,
+) -> None:
+    """
+    Trades the refresh token for a new Spotify access token, and saves it.
 
-    Returns:
+    Parameters:
     ---
-        The description of the playlist, or None if the playlist is not found.
+        social: The user's Spotify UserSocialAuth record.
     """
 
-    url = f"https://api.spotify.com/v1/playlists/{playlist_id}"
-    headers = {"Authorization": f"Bearer {access_token}"}
-    response = requests.get(url, headers=headers)
+    client_id = os.getenv('SPOTIFY_CLIENT_ID')
+    client_secret = os.getenv('SPOTIFY_CLIENT_SECRET')
+
+    credentials = f"{client_id}:{client_secret}"
+    b64_credentials = base64.b64encode(credentials.encode()).decode()
+
+    url = f"{os.getenv('SPOTIFY_ACCOUNTS_URL', 'https://accounts.spotify.com')}/api/token"
+    headers = { "Authorization": f"Basic {b64_credentials}", "Content-Type": "application/x-www-form-urlencoded" }
+    data = {"grant_type": "refresh_token", "refresh_token": social.extra_data['refresh_token']}
+    async with httpx.AsyncClient() as client:
+        response = await client.post(url, headers=headers, data=data)
 
-    if response.status_code == 429:
-        retry_after = int(response.headers.get('Retry-After', '5'))
-        time.sleep(retry_after)
-        raise requests.HTTPError(response=response)
+    if response.status_code != 200:
+        raise Exception(f"Failed to update access token: {response.status_code} {response.text}")
 
-    elif response.status_code != 200:
-        raise Exception(f"Failed to get playlist description: {response.status_code} {response.text}")
-    
     data = response.json()
-    return data.get("description")
+    social.extra_data['access_token'] = data['access_token']
+    social.extra_data['auth_time'] = int(time.time())
+    social.extra_data['expires'] = data.get('expires_in', 3600)
+    if data.get('refresh_token'): # spotify sometimes rotates these
+        social.extra_data['refresh_token'] = data['refresh_token']
+    social.extra_data = social.extra_data
+    await social.asave()
 
-@backoff.on_exception(backoff.expo, Exception, max_tries=5, giveup=lambda e: not can_retry(e))
-def get_spotify_playlists(
-    access_token: str,
-    spotify_id: str,
-) -> list[dict]:
-    """
-    Get the user's Spotify playlists that they can modify (owned or collaborative).
 
-    Parameters:
-    ---
-        access_token: The user's Spotify access token.
-        spotify_id: The user's Spotify ID.
+####################################################################
+# Classes
+####################################################################
 
-    Returns:
-    ---
-        A list of dictionaries containing playlist IDs and names.
+class SpotifyRateLimiter:
     """
+    Process-wide token bucket that every Spotify call waits on.
 
-    url = "https://api.spotify.com/v1/me/playlists"
-    headers = {"Authorization": f"Bearer {access_token}"}
-    data = { "limit": 50 }
+    Calls are let through at `rate` per second (with bursts up to `burst`). When any call
+    sees a 429, the whole bucket pauses for Retry-After seconds instead of each caller
+    sleeping on its own, and the pause is written to `pause_file` so other worker processes
+    on the host back off too. The bucket is emptied on a pause, so traffic ramps back up at
+    the steady rate rather than every waiting call retrying at the same moment.
+    """
 
-    playlists = []
-    next_url = url
-    while next_url:
-        response = requests.get(next_url, headers=headers, params=data)
+    def __init__(
+        self,
+        rate: float,
+        burst: int,
+        pause_file: Path | None = None,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.pause_file = pause_file
+        self.tokens = float(burst)
+        self.updated = time.time()
+        self.paused_until = 0.0
+        self.pauses = 0
+
+        self._pause_file_mtime = None
+        self._lock = threading.Lock()
+
+    def _read_shared_pause(self) -> float:
+        """
+        Pick up a pause written by another process. Only re-reads the file when its mtime changes.
+        """
+        try:
+            mtime = os.stat(self.pause_file).st_mtime
+            if mtime != self._pause_file_mtime:
+                self._pause_file_mtime = mtime
+                return float(Path(self.pause_file).read_text())
+        except (TypeError, OSError, ValueError):
+            pass
+
+        return 0.0
+
+    def _start_pause(
+        self,
+        until: float,
+    ) -> None:
+        """
+        Hold every call until `until` (epoch seconds), then refill from empty.
+        """
+        self.paused_until = until
+        self.tokens = 0.0
+        self.updated = until
+
+    def _reserve(self) -> float:
+        """
+        Take a token if one is available.
+
+        Returns:
+        ---
+            0 if the call can go ahead, otherwise how many seconds to wait before asking again.
+        """
+        with self._lock:
+            now = time.time()
+
+            shared_until = self._read_shared_pause()
+            if shared_until > self.paused_until:
+                self._start_pause(shared_until)
+
+            if self.paused_until > now:
+                return self.paused_until - now
+
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+
+            return (1 - self.tokens) / self.rate
+
+    async def acquire(self) -> None:
+        """
+        Wait (without blocking the thread) until a call is allowed through.
+        """
+        while (wait := self._reserve()) > 0:
+            await asyncio.sleep(wait)
+
+    def pause(
+        self,
+        retry_after: float,
+    ) -> None:
+        """
+        Pause every call in this process (and any process sharing the pause file).
+
+        Parameters:
+        ---
+            retry_after: Seconds to pause for, straight from Spotify's Retry-After header.
+        """
+        with self._lock:
+            now = time.time()
+            until = now + retry_after
+            if until <= self.paused_until: # someone already paused us for at least this long
+                return
+
+            if self.paused_until <= now: # calls that were already in flight don't count as a new pause
+                self.pauses += 1
+                logger.warning("Spotify rate limited, pausing all calls for %ss", retry_after)
+
+            self._start_pause(until)
+
+            if self.pause_file:
+                try: # write then rename, so readers never see a half written file
+                    tmp_file = f"{self.pause_file}.{os.getpid()}"
+                    Path(tmp_file).write_text(str(until))
+                    os.replace(tmp_file, self.pause_file)
+                except OSError:
+                    pass
+
+spotify_rate_limiter = SpotifyRateLimiter(
+    rate=float(os.getenv('SPOTIFY_RATE_LIMIT', 10)),
+    burst=int(os.getenv('SPOTIFY_RATE_LIMIT_BURST', 10)),
+    pause_file=Path(os.getenv('SPOTIFY_RATE_LIMIT_FILE', settings.BASE_DIR / 'data' / 'spotify_ratelimit')),
+)
+
+class SpotifyTokenManager:
+    """
+    Per-user Spotify access tokens, cached in memory.
 
-        if response.status_code == 429:
-            retry_after = int(response.headers.get('Retry-After', '5'))
-            time.sleep(retry_after)
-            raise requests.HTTPError(response=response)
+    A cached token is handed out without touching the database. Once it's within
+    `refresh_margin` seconds of expiring it's refreshed in the background while the
+    current one is still used, and only a missing or (nearly) expired token makes the
+    caller wait. Refreshes for the same user are coalesced, so concurrent requests
+    trigger one call to Spotify's token endpoint.
 
-        elif response.status_code != 200:
-            break
+    Usage:
+    ---
+        access_token, spotify_id = await spotify_tokens.get(user)
+        async with SpotifyClient(access_token, token_provider=lambda: spotify_tokens.refresh(user)) as spotify:
+            ...
+    """
 
-        data = response.json()
-        for item in data.get('items', []):
-            if item['owner']['id'] == spotify_id or item.get('collaborative', False):
-                playlists.append({ 'id': item['id'], 'name': item['name'] })
-        next_url = data.get('next')
-
-    playlists.sort(key=lambda x: x['name'].lower())
-    return playlists
-
-@backoff.on_exception(backoff.expo, Exception, max_tries=5, giveup=lambda e: not can_retry(e))
-def get_spotify_track_uri(
-    access_token: str,
-    song_title: str,
-) -> str | None:
+    def __init__(
+        self,
+        refresh_margin: float,
+    ):
+        self.refresh_margin = refresh_margin
+
+        self._flight = SingleFlight()
+        self._background = set()
+
+    async def get(
+        self,
+        user,
+    ) -> tuple[str, str]:
+        """
+        Get a usable access token for a user.
+
+        Parameters:
+        ---
+            user: The user to get the access token for.
+
+        Returns:
+        ---
+            The access token and the user's Spotify ID.
+        """
+        token = spotify_token_cache.get(user.pk)
+        now = time.time()
+
+        if token is None or token['expires_at'] - 30 < now: # nothing usable, we have to wait
+            token = await self._flight.do(user.pk, lambda: self._load(user))
+        elif token['expires_at'] - self.refresh_margin < now: # getting old, swap it out behind the scenes
+            task = asyncio.create_task(self._refresh_in_background(user))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+
+        return token['access_token'], token['spotify_id']
+
+    async def refresh(
+        self,
+        user,
+    ) -> str:
+        """
+        Force a new access token for a user (eg. after Spotify rejected the current one).
+
+        Parameters:
+        ---
+            user: The user to refresh the access token for.
+
+        Returns:
+        ---
+            The new access token.
+        """
+        # keyed apart from plain loads, joining one of those would hand back the token Spotify just rejected
+        token = await self._flight.do((user.pk, 'refresh'), lambda: self._load(user, force=True))
+        return token['access_token']
+
+    async def _refresh_in_background(
+        self,
+        user,
+    ) -> None:
+        """
+        Refresh a token that's about to expire, without anyone waiting on it.
+        """
+        try:
+            await self._flight.do(user.pk, lambda: self._load(user))
+        except Exception as e:
+            logger.warning("Background Spotify token refresh for user %s failed: %s", user.pk, e)
+
+    async def _load(
+        self,
+        user,
+        force: bool = False,
+    ) -> dict:
+        """
+        Load a user's token from the database, refreshing it with Spotify if it's close to
+        expiring (another process may have refreshed it already), and cache it.
+        """
+        social = await user.social_auth.filter(provider='spotify').afirst()
+        if social is None:
+            raise Exception("You are not authenticated with Spotify.")
+
+        expires_at = social.extra_data.get('auth_time', 0) + (social.extra_data.get('expires') or 3600)
+        if force or expires_at - self.refresh_margin < time.time():
+            await refresh_spotify_access_token(social)
+            expires_at = social.extra_data['auth_time'] + social.extra_data['expires']
+
+        token = { 'access_token': social.extra_data['access_token'], 'spotify_id': social.uid, 'expires_at': expires_at }
+        spotify_token_cache.set(user.pk, token)
+        return token
+
+spotify_tokens = SpotifyTokenManager(refresh_margin=float(os.getenv('SPOTIFY_TOKEN_REFRESH_MARGIN', 300)))
+
+class SpotifyClient:
     """
-    Get a trackURI from Spotify.
+    Pooled client for the Spotify Web API.
 
-    Parameters:
-    ---
-        access_token: The user's Spotify access token.
-        song_title: The title of the song to search for.
+    Owns a keep-alive connection pool sized to our search fan-out, so a blend pays for
+    at most `max_connections` TCP+TLS handshakes no matter how many calls it makes.
+    Also holds the user's token and default timeout, and counts how many requests
+    opened a new connection versus reusing a pooled one. Given a `token_provider`, a
+    request Spotify rejects with a 401 is retried once with a fresh token.
 
-    Returns:
+    Usage:
     ---
-        The URI of the track, or None if the track is not found.
+        async with SpotifyClient(access_token) as spotify:
+            uri = await spotify.get_track_uri("Artist - Song Title")
     """
 
-    url = "https://api.spotify.com/v1/search"
-    headers = {"Authorization": f"Bearer {access_token}"}
-    params = { "q": song_title, "type": "track", "limit": 1 }
-    response = requests.get(url, headers=headers, params=params, timeout=10)
-
-    if response.status_code == 429:
-        retry_after = int(response.headers.get('Retry-After', '5'))
-        time.sleep(retry_after)
-        raise requests.HTTPError(response=response)
-    
-    elif response.status_code != 200:
-        return None
-    
-    data = response.json()
-    items = data.get("tracks", {}).get("items", [])
-    return items[0]["uri"] if items else None
+    def __init__(
+        self,
+        access_token: str,
+        token_provider=None,
+        max_connections: int = int(os.getenv('SPOTIFY_MAX_CONNECTIONS', 10)),
+        timeout: float = 10,
+    ):
+        self.access_token = access_token
+        self.token_provider = token_provider
+        self.max_connections = max_connections
+        self.requests_sent = 0
+        self.connections_opened = 0
+
+        self._semaphore = asyncio.Semaphore(max_connections)
+        self._client = httpx.AsyncClient(
+            base_url=os.getenv('SPOTIFY_API_URL', "https://api.spotify.com/v1"),
+            headers={ "Authorization": f"Bearer {access_token}" },
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=timeout,
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        """
+        Close the connection pool, logging how well it was reused.
+        """
+        await self._client.aclose()
+        logger.info(
+            "Spotify client closed: %d requests, %d connections opened, %d reused",
+            self.requests_sent, self.connections_opened, self.connections_reused,
+        )
+
+    def set_access_token(
+        self,
+        access_token: str,
+    ) -> None:
+        """
+        Switch the client over to a new access token.
+        """
+        self.access_token = access_token
+        self._client.headers["Authorization"] = f"Bearer {access_token}"
+
+    @property
+    def connections_reused(self) -> int:
+        """
+        The number of requests that went out over an already open connection.
+        """
+        return self.requests_sent - self.connections_opened
+
+    async def _trace(
+        self,
+        event_name: str,
+        info: dict,
+    ) -> None:
+        """
+        httpcore trace hook, only fires a TCP connect when the pool has no idle connection to hand out.
+        """
+        if event_name == 'connection.connect_tcp.complete':
+            self.connections_opened += 1
+
+    @backoff.on_exception(backoff.expo, Exception, max_tries=5, giveup=lambda e: not can_retry(e), on_backoff=record_spotify_retry)
+    async def request(
+        self,
+        method: str,
+        url: str,
+        **kwargs,
+    ) -> httpx.Response:
+        """
+        Send a request over the pooled connection, through the shared rate limiter.
+        A 429 pauses the limiter and the request is retried once it lets us through,
+        a 401 is retried once with a new token from `token_provider`.
+
+        Parameters:
+        ---
+            method: The HTTP method.
+            url: The URL, relative to SPOTIFY_API_URL (https://api.spotify.com/v1) or absolute.
+            **kwargs: Passed through to httpx (params, json, ...).
+
+        Returns:
+        ---
+            The response.
+        """
+        endpoint = spotify_endpoint(url)
+        reauthorized = False
+        for _ in range(5):
+            await spotify_rate_limiter.acquire()
+            self.requests_sent += 1
+            started = time.perf_counter()
+            try:
+                response = await self._client.request(method, url, extensions={ "trace": self._trace }, **kwargs)
+            except httpx.TransportError:
+                spotify_requests.inc(method=method, endpoint=endpoint, status='error')
+                raise
+            finally:
+                spotify_request_seconds.observe(time.perf_counter() - started, method=method, endpoint=endpoint)
+            spotify_requests.inc(method=method, endpoint=endpoint, status=response.status_code)
+
+            if response.status_code == 401 and self.token_provider and not reauthorized:
+                spotify_retries.inc(reason='unauthorized')
+                self.set_access_token(await self.token_provider())
+                reauthorized = True
+                continue
+
+            if response.status_code != 429:
+                break
+
+            spotify_retries.inc(reason='rate_limited')
+            spotify_rate_limiter.pause(int(response.headers.get('Retry-After', '5')))
+
+        if 500 <= response.status_code < 600: # let backoff retry server errors
+            response.raise_for_status()
+
+        return response
+
+    async def create_playlist(
+        self,
+        user_id: str,
+        playlist_name: str,
+    ) -> str:
+        """
+        Create a new Spotify playlist.
+
+        Parameters:
+        ---
+            user_id: The user's Spotify ID.
+            playlist_name: The name of the playlist to create.
+
+        Return:
+        ---
+            The ID of the created playlist.
+        """
+
+        data = { "name": playlist_name, "description": "Created with Blendify. https://github.com/dsabecky/blendify-web", "public": True }
+        response = await self.request("POST", f"/users/{user_id}/playlists", json=data)
+
+        # fail out due to an error
+        if response.status_code not in (200, 201):
+            raise Exception(f"Failed to create playlist: {response.status_code} {response.text}")
+
+        spotify_playlists_cache.delete(user_id) # the cached list is missing this one now
+
+        # return the playlistID
+        playlist_data = response.json()
+        return playlist_data['id']
+
+    async def get_playlist_description(
+        self,
+        playlist_id: str,
+    ) -> str | None:
+        """
+        Get the description of a Spotify playlist by playlistID.
+
+        Parameters:
+        ---
+            playlist_id: The ID of the playlist to get the description of.
+
+        Returns:
+        ---
+            The description of the playlist, or None if the playlist is not found.
+        """
+
+        response = await self.request("GET", f"/playlists/{playlist_id}")
+
+        if response.status_code != 200:
+            raise Exception(f"Failed to get playlist description: {response.status_code} {response.text}")
 
-def get_spotify_track_uris(
-    access_token: str,
-    songs: list[str],
-) -> dict[str, str]:
-    """
-    Helper function for batch searching trackURIs.
+        data = response.json()
+        return data.get("description")
+
+    async def get_paged(
+        self,
+        url: str,
+        params: dict | None = None,
+        headers: dict | None = None,
+        limit: int = 50,
+        max_concurrency: int | None = None,
+    ) -> tuple[httpx.Response, list[dict]]:
+        """
+        Get every item from an offset paged list endpoint (eg. /me/playlists).
+        The first page tells us the total, so the rest are fetched side by side and merged in order.
+
+        Parameters:
+        ---
+            url: The list endpoint.
+            params: Any extra query parameters.
+            headers: Headers for the first page only (eg. If-None-Match).
+            limit: Items per page (Spotify caps most lists at 50).
+            max_concurrency: The most pages in flight at once, defaults to the connection pool size.
+
+        Returns:
+        ---
+            The first page's response, and every item in order. Items are only fetched when the first page is a 200.
+        """
+        params = { **(params or {}), "limit": limit }
+        first = await self.request("GET", url, params={ **params, "offset": 0 }, headers=headers)
+        if first.status_code != 200:
+            return first, []
+
+        data = first.json()
+        pages = [data.get('items', [])]
+
+        semaphore = asyncio.Semaphore(max_concurrency or self.max_connections)
+
+        async def get_page(offset):
+            async with semaphore:
+                response = await self.request("GET", url, params={ **params, "offset": offset })
+
+            if response.status_code != 200:
+                raise Exception(f"Failed to get {url} at offset {offset}: {response.status_code} {response.text}")
+
+            return response.json().get('items', [])
+
+        # step by the page size Spotify actually used (it can cap `limit` lower), not by what the first page happened to hold
+        page_size = data.get('limit') or limit
+        offsets = range(page_size, data.get('total', 0), page_size) if pages[0] else []
+        pages += await asyncio.gather(*(get_page(offset) for offset in offsets))
+
+        return first, [item for page in pages for item in page]
+
+    async def get_playlists(
+        self,
+        spotify_id: str,
+    ) -> list[dict]:
+        """
+        Get the user's Spotify playlists that they can modify (owned or collaborative).
+
+        The list is cached per user. Within SPOTIFY_PLAYLISTS_TTL seconds it's served without
+        touching Spotify. After that a list that fits on one page is revalidated with its ETag,
+        and only a changed page (or an evicted entry) re-fetches it. A longer list is re-fetched
+        in full, as the first page's ETag says nothing about the pages after it.
+
+        Parameters:
+        ---
+            spotify_id: The user's Spotify ID.
+
+        Returns:
+        ---
+            A list of dictionaries containing playlist IDs and names.
+        """
+
+        fresh_for = float(os.getenv('SPOTIFY_PLAYLISTS_TTL', 60))
+        cached = spotify_playlists_cache.get(spotify_id)
+        if cached and cached['fresh_until'] > time.monotonic():
+            return cached['playlists']
+
+        headers = { "If-None-Match": cached['etag'] } if cached and cached['etag'] else None
+        response, items = await self.get_paged("/me/playlists", headers=headers)
+
+        if response.status_code == 304: # nothing's changed since we cached it
+            spotify_playlists_cache.set(spotify_id, { **cached, 'fresh_until': time.monotonic() + fresh_for })
+            return cached['playlists']
+
+        if response.status_code != 200:
+            raise Exception(f"Failed to get playlists: {response.status_code} {response.text}")
+
+        playlists = [
+            { 'id': item['id'], 'name': item['name'] }
+            for item in items
+            if item['owner']['id'] == spotify_id or item.get('collaborative', False)
+        ]
+        playlists.sort(key=lambda x: x['name'].lower())
+
+        # an edit past the first page doesn't change its ETag, so only a single page list can be revalidated
+        data = response.json()
+        etag = response.headers.get('ETag') if data.get('total', 0) <= data.get('limit', 0) else None
 
-    Parameters:
-    ---
-        access_token: The user's Spotify access token.
-        songs: The list of songs to search for.
+        spotify_playlists_cache.set(spotify_id, { 'playlists': playlists, 'etag': etag, 'fresh_until': time.monotonic() + fresh_for })
+        return playlists
 
-    Returns:
-    ---
-        A dictionary of song titles and their corresponding trackURIs.
-    """
-    
-    def search_single_song(song):
-        return song, get_spotify_track_uri(access_token, song)
-    
-    results = {}
-    
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        future_to_song = {
-            executor.submit(search_single_song, song): song 
-            for song in songs
-        }
-        
-        for future in as_completed(future_to_song, timeout=30):
+    async def get_track_uri(
+        self,
+        song_title: str,
+    ) -> str | None:
+        """
+        Get a trackURI from Spotify.
+
+        Parameters:
+        ---
+            song_title: The title of the song to search for.
+
+        Returns:
+        ---
+            The URI of the track, or None if the track is not found.
+        """
+
+        params = { "q": song_title, "type": "track", "limit": 1 }
+        response = await self.request("GET", "/search", params=params)
+
+        # a failed search isn't a miss, don't let it look like one
+        if response.status_code != 200:
+            raise Exception(f"Failed to search for track: {response.status_code} {response.text}")
+
+        data = response.json()
+        items = data.get("tracks", {}).get("items", [])
+        return items[0]["uri"] if items else None
+
+    async def get_track_uris(
+        self,
+        songs: list[str],
+        on_progress=None,
+    ) -> dict[str, str | None]:
+        """
+        Helper function for batch searching trackURIs, one search per pooled connection.
+
+        Parameters:
+        ---
+            songs: The list of songs to search for.
+            on_progress: Optional callback, handed (searches finished, total searches) as each search finishes.
+
+        Returns:
+        ---
+            A dictionary of song titles and their corresponding trackURIs. Songs Spotify has
+            no match for map to None; songs whose search failed are left out.
+        """
+
+        finished = 0
+
+        async def search_single_song(song):
+            nonlocal finished
             try:
-                song, uri = future.result()
-                if uri:
-                    results[song] = uri
-            except Exception as e:
-                song = future_to_song[future]
-    
-    return results
-
-def update_spotify_access_token(
-    user,
-) -> bool:
-    """
-    Updates the Spotify access token if it's expired.
+                async with self._semaphore:
+                    return await self.get_track_uri(song)
+            finally:
+                finished += 1
+                if on_progress:
+                    on_progress(finished, len(songs))
 
-    Parameters:
-    ---
-        user: The user to update the access token for.
-    Returns:
-    ---
-        Boolean indicating if the access token is valid or refreshed.
-    """
+        # no overall timeout here, a rate limit pause can legitimately outlast one
+        uris = await asyncio.gather(*(search_single_song(song) for song in songs), return_exceptions=True)
 
-    social = user.social_auth.filter(provider='spotify').first()
-    if social.extra_data.get('auth_time') > time.time() - 3500:
-        return True
+        return {song: uri for song, uri in zip(songs, uris) if not isinstance(uri, Exception)}
 
-    client_id = os.getenv('SPOTIFY_CLIENT_ID')
-    client_secret = os.getenv('SPOTIFY_CLIENT_SECRET')
+    async def update_playlist(
+        self,
+        playlist_id: str,
+        song_uris: list[str],
+        playlist_name: str,
+        playlist_description: str,
+    ) -> bool:
+        """
+        Updates the playlist's name, description, and replaces all tracks with the provided URIs.
 
-    credentials = f"{client_id}:{client_secret}"
-    b64_credentials = base64.b64encode(credentials.encode()).decode()
+        Parameters:
+        ---
+            playlist_id: The ID of the playlist to update.
+            song_uris: The list of song URIs to add to the playlist.
+            playlist_name: The name of the playlist to update.
+            playlist_description: The description of the playlist to update.
 
-    url = "https://accounts.spotify.com/api/token"
-    headers = { "Authorization": f"Basic {b64_credentials}", "Content-Type": "application/x-www-form-urlencoded" }
-    data = {"grant_type": "refresh_token", "refresh_token": social.extra_data['refresh_token']}
-    response = requests.post(url, headers=headers, data=data)
+        Returns:
+        ---
+            Boolean indicating if the playlist was updated successfully.
+        """
 
-    if response.status_code != 200:
-        raise Exception(f"Failed to update access token: {response.status_code} {response.text}")
+        data = {"name": playlist_name, "description": playlist_description}
+        response = await self.request("PUT", f"/playlists/{playlist_id}", json=data)
 
-    social.extra_data['access_token'] = response.json()['access_token']
-    social.extra_data['auth_time'] = int(time.time())
-    social.extra_data = social.extra_data
-    social.save()
-    return True
-
-@backoff.on_exception(backoff.expo, Exception, max_tries=5, giveup=lambda e: not can_retry(e))
-def update_spotify_playlist(
-    access_token: str,
-    playlist_id: str,
-    song_uris: list[str],
-    playlist_name: str,
-    playlist_description: str,
-) -> bool:
-    """
-    Updates the playlist's name, description, and replaces all tracks with the provided URIs.
+        if response.status_code not in (200, 201):
+            raise Exception(f"Failed to update playlist details: {response.status_code} {response.text}")
 
-    Parameters:
-    ---
-        access_token: The user's Spotify access token.
-        playlist_id: The ID of the playlist to update.
-        song_uris: The list of song URIs to add to the playlist.
-        playlist_name: The name of the playlist to update.
-        playlist_description: The description of the playlist to update.
+        valid_uris = [uri for uri in song_uris if uri and uri.startswith('spotify:track:')]
 
-    Returns:
-    ---
-        Boolean indicating if the playlist was updated successfully.
-    """
+        if not valid_uris:
+            raise Exception("No valid song URIs found to add to playlist")
+
+        data = { "uris": valid_uris[:100] }
+        response = await self.request("PUT", f"/playlists/{playlist_id}/tracks", json=data)
 
-    url = f"https://api.spotify.com/v1/playlists/{playlist_id}"
-    headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
-    data = {"name": playlist_name, "description": playlist_description}
-    response = requests.put(url, headers=headers, json=data)
-
-    if response.status_code == 429:
-        retry_after = int(response.headers.get('Retry-After', '5'))
-        time.sleep(retry_after)
-        raise requests.HTTPError(response=response)
-
-    elif response.status_code not in (200, 201):
-        raise Exception(f"Failed to update playlist details: {response.status_code} {response.text}")
-
-    valid_uris = [uri for uri in song_uris if uri and uri.startswith('spotify:track:')]
-    
-    if not valid_uris:
-        raise Exception("No valid song URIs found to add to playlist")
-    
-    url = f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks"
-    data = { "uris": valid_uris[:100] }
-    response = requests.put(url, headers=headers, json=data)
-
-    if response.status_code == 429:
-        retry_after = int(response.headers.get('Retry-After', '5'))
-        time.sleep(retry_after)
-        raise requests.HTTPError(response=response)
-
-    elif response.status_code not in (200, 201):
-        raise Exception(f"Failed to update playlist tracks: {response.status_code} {response.text}")
-
-    return True
\ No newline at end of file
+        if response.status_code not in (200, 201):
+            raise Exception(f"Failed to update playlist tracks: {response.status_code} {response.text}")
+
+        return True
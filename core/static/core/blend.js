@@ -68,6 +68,72 @@ document.addEventListener('DOMContentLoaded', function() {
 
     updateButtons();
 
+    // Playlist Selector, filled in from the server so the page doesn't wait on Spotify
+    const playlistSelect = document.getElementById('spotify_playlist');
+    const playlistSearch = document.getElementById('playlist_search');
+    let playlistQuery = 0;
+
+    function loadPlaylists(query = '') {
+        const loading = document.getElementById('playlist-loading');
+        const queryId = ++playlistQuery;
+
+        // Drop the last results, keeping the placeholder, create new, and the loading note
+        playlistSelect.querySelectorAll('option[data-playlist]').forEach(option => {
+            if (!option.selected) option.remove();
+        });
+        loading.textContent = 'Loading your playlists...';
+        loading.hidden = false;
+
+        function loadPage(offset) {
+            const url = `${playlistSelect.dataset.url}?q=${encodeURIComponent(query)}&offset=${offset}`;
+            fetch(url)
+                .then(response => response.json())
+                .then(data => {
+                    if (queryId !== playlistQuery) return; // they've typed something else since
+
+                    if (data.error) {
+                        loading.textContent = 'Could not load your playlists';
+                        showBlendifyAlert(data.error, 'danger');
+                        return;
+                    }
+
+                    data.playlists.forEach(playlist => {
+                        if (playlistSelect.querySelector(`option[value="${CSS.escape(playlist.id)}"]`)) return;
+                        const option = document.createElement('option');
+                        option.value = playlist.id;
+                        option.textContent = playlist.name;
+                        option.dataset.playlist = '';
+                        playlistSelect.insertBefore(option, loading);
+                    });
+
+                    if (data.next_offset !== null) {
+                        loadPage(data.next_offset);
+                    } else if (data.total === 0) {
+                        loading.textContent = query ? 'No playlists match that search' : 'No playlists found';
+                    } else {
+                        loading.hidden = true;
+                    }
+                })
+                .catch(() => {
+                    if (queryId === playlistQuery) loading.textContent = 'Could not load your playlists';
+                });
+        }
+
+        loadPage(0);
+    }
+
+    if (playlistSelect && playlistSelect.dataset.url) {
+        loadPlaylists();
+
+        if (playlistSearch) {
+            let searchTimer = null;
+            playlistSearch.addEventListener('input', function() {
+                clearTimeout(searchTimer);
+                searchTimer = setTimeout(() => loadPlaylists(playlistSearch.value.trim()), 250);
+            });
+        }
+    }
+
     // New Playlist Section
     const select = document.getElementById('spotify_playlist');
     const nameInput = document.getElementById('spotify_playlist_name');
@@ -152,9 +218,46 @@ document.addEventListener('DOMContentLoaded', function() {
     const ws_path = ws_scheme + '://' + window.location.host + '/ws/progress/';
     const socket = new WebSocket(ws_path);
 
+    // Follow a queued blend, if we're waiting on one
+    const jobStatus = document.getElementById('blendify-job');
+
+    socket.onopen = function(e) {
+        if (jobStatus) {
+            socket.send(JSON.stringify({ job_id: jobStatus.dataset.jobId }));
+        }
+    };
+
+    // Progress bar for a queued blend
+    const progressBar = document.getElementById('blendify-progress-bar');
+    const progressDetail = document.getElementById('blendify-progress-detail');
+    let lastMessage = null;
+
+    function showBlendifyProgress(data) {
+        if (!progressBar || data.percent === undefined) return;
+
+        progressBar.style.width = `${data.percent}%`;
+        progressBar.parentElement.setAttribute('aria-valuenow', data.percent);
+
+        const parts = [];
+        if (data.total) parts.push(`${data.done}/${data.total} ${data.unit || ''}`.trim());
+        if (data.elapsed_ms !== undefined) parts.push(`${(data.elapsed_ms / 1000).toFixed(1)}s`);
+        progressDetail.textContent = parts.join(' · ');
+    }
+
     socket.onmessage = function(e) {
         const data = JSON.parse(e.data);
-        showBlendifyAlert(data.message, data.type || "info");
+
+        // Counts come in several times a second, only redraw the toast when the message changes
+        if (data.message !== lastMessage) {
+            showBlendifyAlert(data.message, data.type || "info");
+            lastMessage = data.message;
+        }
+        showBlendifyProgress(data);
+
+        // The blend finished (or failed), reload to show the results
+        if (data.redirect) {
+            window.location.href = data.redirect;
+        }
     };
 
     socket.onclose = function(e) {
@@ -1,3 +1,1250 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import subprocess
+import tempfile
+import time
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import httpx
+
+from channels.exceptions import ChannelFull
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+from social_django.models import UserSocialAuth
+
+from core import blendify_utils
+from core.blendify_utils import SongPrefetcher, build_individual_playlists, build_playlist_details, build_song_uris, find_cached_playlist, load_or_generate_playlist, load_playlist_songs, refresh_playlist, save_playlist
+from core.cache_utils import LRUCache, SingleFlight, playlist_cache, song_cache, spotify_playlists_cache, spotify_token_cache
+from core.channel_layers import SQLiteChannelLayer
+from core.management.commands.compact_cache import Command as CompactCacheCommand
+from core.job_utils import BlendProgress, claim_next_blend_job, enqueue_blend_job, fail_orphaned_blend_jobs, run_blend_job
+from core.metrics_utils import MetricsRegistry
+from core.models import BlendJob, Playlist, PlaylistEntry, Song, SongMiss, ThemeClaim
+from core.spotify_utils import SpotifyClient, SpotifyRateLimiter, SpotifyTokenManager
+from core.theme_utils import ThemeIndex, normalize_theme
+
+
+class SQLiteChannelLayerTests(SimpleTestCase):
+    """
+    Two layer instances on one file stand in for two processes (eg. daphne and a blend worker).
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = Path(self.directory.name) / 'channels.sqlite3'
+
+    def layer(self, **config):
+        return SQLiteChannelLayer(self.path, poll_interval=0.01, max_poll_interval=0.05, **config)
+
+    async def receive(self, layer, channel, timeout=1):
+        return await asyncio.wait_for(layer.receive(channel), timeout)
+
+    async def test_send_and_receive_across_layers(self):
+        sender, receiver = self.layer(), self.layer()
+        channel = await receiver.new_channel()
+
+        await sender.send(channel, { 'type': 'test.message', 'text': 'hello', 'data': b'\x00\xff' })
+
+        self.assertEqual(await self.receive(receiver, channel), { 'type': 'test.message', 'text': 'hello', 'data': b'\x00\xff' })
+
+    async def test_messages_arrive_in_order(self):
+        sender, receiver = self.layer(), self.layer()
+        channel = await receiver.new_channel()
+
+        for n in range(5):
+            await sender.send(channel, { 'type': 'test.message', 'n': n })
+
+        self.assertEqual([(await self.receive(receiver, channel))['n'] for _ in range(5)], list(range(5)))
+
+    async def test_group_send_fans_out_to_every_member(self):
+        sender, first, second = self.layer(), self.layer(), self.layer()
+        first_channel, second_channel = await first.new_channel(), await second.new_channel()
+        await sender.group_add('user_1', first_channel)
+        await sender.group_add('user_1', second_channel)
+
+        await sender.group_send('user_1', { 'type': 'send_progress', 'percent': 50 })
+
+        self.assertEqual((await self.receive(first, first_channel))['percent'], 50)
+        self.assertEqual((await self.receive(second, second_channel))['percent'], 50)
+
+    async def test_group_discard_stops_delivery(self):
+        sender, receiver = self.layer(), self.layer()
+        channel = await receiver.new_channel()
+        await sender.group_add('user_1', channel)
+        await sender.group_discard('user_1', channel)
+
+        await sender.group_send('user_1', { 'type': 'send_progress' })
+
+        with self.assertRaises(TimeoutError):
+            await self.receive(receiver, channel, timeout=0.2)
+
+    async def test_expired_messages_are_dropped(self):
+        sender, receiver = self.layer(expiry=0.1), self.layer(expiry=0.1)
+        channel = await receiver.new_channel()
+
+        await sender.send(channel, { 'type': 'test.message' })
+        await asyncio.sleep(0.2)
+
+        with self.assertRaises(TimeoutError):
+            await self.receive(receiver, channel, timeout=0.2)
+
+    async def test_expired_group_memberships_are_skipped(self):
+        sender, receiver = self.layer(group_expiry=0.1), self.layer()
+        channel = await receiver.new_channel()
+        await sender.group_add('user_1', channel)
+        await asyncio.sleep(0.2)
+
+        await sender.group_send('user_1', { 'type': 'send_progress' })
+
+        with self.assertRaises(TimeoutError):
+            await self.receive(receiver, channel, timeout=0.2)
+
+    async def test_send_to_a_full_channel_raises(self):
+        layer = self.layer(capacity=2)
+        channel = await layer.new_channel()
+
+        await layer.send(channel, { 'type': 'test.message' })
+        await layer.send(channel, { 'type': 'test.message' })
+
+        with self.assertRaises(ChannelFull):
+            await layer.send(channel, { 'type': 'test.message' })
+
+    async def test_group_send_skips_full_channels(self):
+        sender, receiver = self.layer(capacity=1), self.layer(capacity=1)
+        full, empty = await receiver.new_channel(), await receiver.new_channel()
+        await sender.send(full, { 'type': 'test.message', 'n': 0 })
+        await sender.group_add('user_1', full)
+        await sender.group_add('user_1', empty)
+
+        await sender.group_send('user_1', { 'type': 'test.message', 'n': 1 }) # doesn't raise
+
+        self.assertEqual((await self.receive(receiver, empty))['n'], 1)
+        self.assertEqual((await self.receive(receiver, full))['n'], 0)
+        with self.assertRaises(TimeoutError):
+            await self.receive(receiver, full, timeout=0.2)
+
+    async def test_flush_drops_messages_and_groups(self):
+        sender, receiver = self.layer(), self.layer()
+        channel = await receiver.new_channel()
+        await sender.group_add('user_1', channel)
+        await sender.send(channel, { 'type': 'test.message' })
+
+        await sender.flush()
+        await sender.group_send('user_1', { 'type': 'send_progress' })
+
+        with self.assertRaises(TimeoutError):
+            await self.receive(receiver, channel, timeout=0.2)
+
+    async def test_idle_poller_backs_off_but_still_delivers(self):
+        sender, receiver = self.layer(), self.layer()
+        channel = await receiver.new_channel()
+        waiting = asyncio.create_task(self.receive(receiver, channel, timeout=2))
+        await asyncio.sleep(0.3) # long enough to reach max_poll_interval
+
+        sent = time.monotonic()
+        await sender.send(channel, { 'type': 'test.message' })
+        await waiting
+
+        self.assertLess(time.monotonic() - sent, receiver.max_poll_interval + 0.2)
+
+
+class SpotifyRateLimiterTests(SimpleTestCase):
+    """
+    The limiter runs on time.time(), which these tests drive by hand. Rates and steps are
+    powers of two, so the token arithmetic comes out exact.
+    """
+
+    def setUp(self):
+        self.now = 1024.0
+        patcher = mock.patch('core.spotify_utils.time.time', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst_then_wait_for_refill(self):
+        limiter = SpotifyRateLimiter(rate=4, burst=3)
+
+        self.assertEqual([limiter._reserve() for _ in range(3)], [0, 0, 0])
+        self.assertEqual(limiter._reserve(), 0.25)
+
+    def test_tokens_refill_at_the_rate_up_to_the_burst(self):
+        limiter = SpotifyRateLimiter(rate=4, burst=3)
+        for _ in range(3):
+            limiter._reserve()
+
+        self.now += 0.625 # two and a half tokens
+        self.assertEqual([limiter._reserve() for _ in range(2)], [0, 0])
+        self.assertEqual(limiter._reserve(), 0.125)
+
+        self.now += 60 # never more than the burst
+        self.assertEqual([limiter._reserve() for _ in range(3)], [0, 0, 0])
+        self.assertGreater(limiter._reserve(), 0)
+
+    def test_pause_holds_every_call_then_ramps_up_from_empty(self):
+        limiter = SpotifyRateLimiter(rate=4, burst=3)
+
+        limiter.pause(2)
+        self.assertEqual(limiter._reserve(), 2)
+
+        self.now += 2
+        self.assertEqual(limiter._reserve(), 0.25) # the bucket was emptied, not refilled
+        self.now += 0.25
+        self.assertEqual(limiter._reserve(), 0)
+
+    def test_overlapping_pauses_count_once_and_never_shorten(self):
+        limiter = SpotifyRateLimiter(rate=4, burst=3)
+
+        limiter.pause(5)
+        limiter.pause(1) # a call that was already in flight
+        limiter.pause(6)
+
+        self.assertEqual(limiter.pauses, 1)
+        self.assertEqual(limiter.paused_until, self.now + 6)
+
+    def test_pause_is_shared_through_the_pause_file(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        pause_file = Path(directory.name) / 'spotify_ratelimit'
+        ours, theirs = SpotifyRateLimiter(rate=4, burst=3, pause_file=pause_file), SpotifyRateLimiter(rate=4, burst=3, pause_file=pause_file)
+
+        theirs.pause(3)
+
+        self.assertEqual(ours._reserve(), 3)
+
+    def test_acquire_waits_for_a_token(self):
+        limiter = SpotifyRateLimiter(rate=4, burst=1)
+        limiter._reserve()
+
+        async def acquire():
+            with mock.patch('core.spotify_utils.asyncio.sleep') as sleep:
+                async def advance(seconds):
+                    self.now += seconds
+                sleep.side_effect = advance
+                await limiter.acquire()
+                return [call.args[0] for call in sleep.call_args_list]
+
+        waits = asyncio.run(acquire())
+        self.assertEqual(waits, [0.25])
+
+
+class SpotifyClientPagingTests(SimpleTestCase):
+    """
+    A fake /me/playlists over httpx.MockTransport, with the rate limiter switched off.
+    """
+
+    def setUp(self):
+        self.playlists = [{ 'id': str(i), 'name': f"Playlist {i}", 'owner': { 'id': 'me' } } for i in range(120)]
+        self.page_cap = 50 # the most items Spotify hands back per page, whatever we ask for
+        self.hidden = set()
+        self.requests = []
+
+        patcher = mock.patch('core.spotify_utils.spotify_rate_limiter.acquire', mock.AsyncMock())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def handler(self, request):
+        self.requests.append(request)
+        offset = int(request.url.params['offset'])
+        limit = min(int(request.url.params['limit']), self.page_cap)
+        items = [item for item in self.playlists[offset:offset + limit] if item['id'] not in self.hidden]
+        etag = f'"{hash(repr(items))}"'
+        if request.headers.get('If-None-Match') == etag:
+            return httpx.Response(304, headers={ 'ETag': etag })
+        return httpx.Response(200, headers={ 'ETag': etag }, json={
+            'items': items,
+            'limit': limit,
+            'offset': offset,
+            'total': len(self.playlists),
+        })
+
+    def call(self, method, *args, **kwargs):
+        async def call():
+            async with SpotifyClient("token") as spotify:
+                spotify._client = httpx.AsyncClient(base_url="https://api.spotify.test/v1", transport=httpx.MockTransport(self.handler))
+                return await getattr(spotify, method)(*args, **kwargs)
+
+        return asyncio.run(call())
+
+    def get_paged(self, **kwargs):
+        return self.call('get_paged', "/me/playlists", **kwargs)
+
+    def test_fetches_every_page_in_order(self):
+        response, items = self.get_paged()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['id'] for item in items], [playlist['id'] for playlist in self.playlists])
+        self.assertEqual(sorted(int(request.url.params['offset']) for request in self.requests), [0, 50, 100])
+
+    def test_steps_by_the_page_size_spotify_used(self):
+        self.page_cap = 20
+
+        _, items = self.get_paged(limit=50)
+
+        self.assertEqual([item['id'] for item in items], [playlist['id'] for playlist in self.playlists])
+        self.assertEqual(len(self.requests), 6)
+
+    def test_short_page_doesnt_shift_the_offsets(self):
+        self.hidden = {'10'} # Spotify leaves out items it can't show, but still counts them in the total
+
+        _, items = self.get_paged()
+
+        self.assertEqual(sorted(int(request.url.params['offset']) for request in self.requests), [0, 50, 100])
+        self.assertEqual([item['id'] for item in items], [playlist['id'] for playlist in self.playlists if playlist['id'] != '10'])
+
+    @mock.patch.dict('os.environ', { 'SPOTIFY_PLAYLISTS_TTL': '0' })
+    def test_single_page_playlists_are_revalidated(self):
+        del self.playlists[30:]
+        spotify_playlists_cache.delete('me')
+        self.addCleanup(spotify_playlists_cache.delete, 'me')
+
+        playlists = self.call('get_playlists', 'me')
+        self.requests.clear()
+
+        self.assertEqual(self.call('get_playlists', 'me'), playlists)
+        self.assertEqual(len(self.requests), 1)
+        self.assertIn('If-None-Match', self.requests[0].headers)
+
+    @mock.patch.dict('os.environ', { 'SPOTIFY_PLAYLISTS_TTL': '0' })
+    def test_longer_playlist_lists_are_refetched(self):
+        spotify_playlists_cache.delete('me')
+        self.addCleanup(spotify_playlists_cache.delete, 'me')
+
+        self.call('get_playlists', 'me')
+        self.playlists[100] = { **self.playlists[100], 'name': "Renamed" } # the first page's ETag doesn't change
+        self.requests.clear()
+
+        self.assertIn({ 'id': '100', 'name': "Renamed" }, self.call('get_playlists', 'me'))
+        self.assertEqual(len(self.requests), 3)
+        self.assertFalse(any('If-None-Match' in request.headers for request in self.requests))
+
+class SpotifyClientAuthTests(SimpleTestCase):
+    """
+    A fake endpoint that only accepts the token "fresh".
+    """
+
+    def setUp(self):
+        self.requests = []
+
+        patcher = mock.patch('core.spotify_utils.spotify_rate_limiter.acquire', mock.AsyncMock())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def handler(self, request):
+        self.requests.append(request)
+        if request.headers['Authorization'] != "Bearer fresh":
+            return httpx.Response(401, json={ 'error': { 'status': 401, 'message': "The access token expired" } })
+        return httpx.Response(200, json={ 'description': "A playlist" })
+
+    def request(self, token_provider):
+        async def request():
+            async with SpotifyClient("expired", token_provider=token_provider) as spotify:
+                spotify._client = httpx.AsyncClient(base_url="https://api.spotify.test/v1", transport=httpx.MockTransport(self.handler), headers=spotify._client.headers)
+                return await spotify.request("GET", "/playlists/1")
+
+        return asyncio.run(request())
+
+    def test_a_401_is_retried_with_a_fresh_token(self):
+        token_provider = mock.AsyncMock(return_value="fresh")
+
+        response = self.request(token_provider)
+
+        self.assertEqual(response.status_code, 200)
+        token_provider.assert_awaited_once()
+        self.assertEqual([request.headers['Authorization'] for request in self.requests], ["Bearer expired", "Bearer fresh"])
+
+    def test_a_401_with_the_fresh_token_is_returned(self):
+        token_provider = mock.AsyncMock(return_value="also expired")
+
+        response = self.request(token_provider)
+
+        self.assertEqual(response.status_code, 401)
+        token_provider.assert_awaited_once()
+        self.assertEqual(len(self.requests), 2)
+
+
+class SpotifyTokenManagerTests(TransactionTestCase):
+    """
+    A user whose stored token has five minutes left, with Spotify's token endpoint faked out.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(username="listener")
+        UserSocialAuth.objects.create(user=self.user, provider='spotify', uid='me', extra_data={
+            'access_token': "old", 'refresh_token': "refresh", 'auth_time': int(time.time()) - 3300, 'expires': 3600,
+        })
+        self.manager = SpotifyTokenManager(refresh_margin=600)
+        self.refreshes = 0
+
+        async def refresh_spotify_access_token(social):
+            self.refreshes += 1
+            social.extra_data = { **social.extra_data, 'access_token': f"new {self.refreshes}", 'auth_time': int(time.time()), 'expires': 3600 }
+            await social.asave()
+
+        patcher = mock.patch('core.spotify_utils.refresh_spotify_access_token', refresh_spotify_access_token)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        spotify_token_cache.delete(self.user.pk)
+        self.addCleanup(spotify_token_cache.delete, self.user.pk)
+
+    def test_an_expiring_token_is_refreshed_in_the_background(self):
+        spotify_token_cache.set(self.user.pk, { 'access_token': "old", 'spotify_id': 'me', 'expires_at': time.time() + 300 })
+
+        async def get():
+            token = await self.manager.get(self.user)
+            await asyncio.gather(*self.manager._background)
+            return token, await self.manager.get(self.user)
+
+        before, after = asyncio.run(get())
+
+        self.assertEqual(before, ("old", 'me')) # not kept waiting
+        self.assertEqual(after, ("new 1", 'me'))
+        self.assertEqual(self.refreshes, 1)
+
+    def test_a_forced_refresh_doesnt_join_a_plain_load(self):
+        UserSocialAuth.objects.filter(uid='me').update(extra_data={ 'access_token': "rejected", 'refresh_token': "refresh", 'auth_time': int(time.time()), 'expires': 3600 })
+        load = self.manager._load
+
+        async def slow_load(user, force=False):
+            if not force:
+                await asyncio.sleep(0.05)
+            return await load(user, force)
+
+        async def refresh():
+            with mock.patch.object(self.manager, '_load', slow_load):
+                loading = asyncio.create_task(self.manager.get(self.user))
+                await asyncio.sleep(0)
+                refreshed = await self.manager.refresh(self.user)
+                await loading
+                return refreshed
+
+        self.assertEqual(asyncio.run(refresh()), "new 1")
+        self.assertEqual(self.refreshes, 1)
+
+
+class LRUCacheTests(SimpleTestCase):
+    """
+    Expiry runs on time.monotonic(), which these tests drive by hand.
+    """
+
+    def setUp(self):
+        self.now = 100.0
+        patcher = mock.patch('core.cache_utils.time.monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_evicts_the_least_recently_used_entry(self):
+        cache = LRUCache('test', max_entries=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a') # b is now the least recently used
+
+        cache.set('c', 3)
+
+        self.assertEqual(cache.get_many(['a', 'b', 'c']), { 'a': 1, 'c': 3 })
+        self.assertEqual(cache.evictions, 1)
+
+    def test_setting_an_existing_key_refreshes_it(self):
+        cache = LRUCache('test', max_entries=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.set('a', 10)
+
+        cache.set('c', 3)
+
+        self.assertEqual(cache.get_many(['a', 'b', 'c']), { 'a': 10, 'c': 3 })
+
+    def test_entries_expire_after_the_ttl(self):
+        cache = LRUCache('test', max_entries=10, ttl=60)
+        cache.set('a', 1)
+
+        self.now += 59
+        self.assertEqual(cache.get('a'), 1)
+
+        self.now += 2
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.expirations, 1)
+        self.assertEqual(len(cache), 0)
+
+    def test_falsy_values_are_cached(self):
+        cache = LRUCache('test', max_entries=10, ttl=60)
+        cache.set('empty', [])
+        cache.set('none', None)
+
+        self.assertEqual(cache.get_many(['empty', 'none', 'missing']), { 'empty': [], 'none': None })
+
+    def test_counters(self):
+        cache = LRUCache('test', max_entries=1, ttl=60)
+        cache.set('a', 1)
+        cache.get('a')
+        cache.get('b', 'default')
+        cache.set('b', 2)
+
+        self.assertEqual(cache.stats(), {
+            'name': 'test',
+            'entries': 1,
+            'max_entries': 1,
+            'hits': 1,
+            'misses': 1,
+            'evictions': 1,
+            'expirations': 0,
+        })
+
+    def test_delete_and_clear(self):
+        cache = LRUCache('test', max_entries=10, ttl=60)
+        cache.set_many({ 'a': 1, 'b': 2, 'c': 3 })
+
+        cache.delete('a')
+        cache.delete('missing')
+        self.assertEqual(cache.get_many(['a', 'b', 'c']), { 'b': 2, 'c': 3 })
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+
+class SingleFlightTests(SimpleTestCase):
+
+    def setUp(self):
+        self.flight = SingleFlight()
+        self.calls = 0
+
+    async def work(self, result="done", error=None, delay=0.05):
+        self.calls += 1
+        await asyncio.sleep(delay)
+        if error:
+            raise error
+        return result
+
+    def test_concurrent_callers_share_one_call(self):
+        async def run():
+            return await asyncio.gather(*(self.flight.do('key', self.work) for _ in range(5)))
+
+        self.assertEqual(asyncio.run(run()), ["done"] * 5)
+        self.assertEqual(self.calls, 1)
+
+    def test_different_keys_dont_coalesce(self):
+        async def run():
+            return await asyncio.gather(self.flight.do('a', self.work), self.flight.do('b', self.work))
+
+        asyncio.run(run())
+        self.assertEqual(self.calls, 2)
+
+    def test_errors_reach_every_caller(self):
+        async def run():
+            return await asyncio.gather(*(self.flight.do('key', lambda: self.work(error=ValueError("boom"))) for _ in range(3)), return_exceptions=True)
+
+        results = asyncio.run(run())
+
+        self.assertEqual([type(result) for result in results], [ValueError] * 3)
+        self.assertEqual(self.calls, 1)
+
+    def test_a_cancelled_leader_hands_over_to_a_follower(self):
+        async def run():
+            leader = asyncio.create_task(self.flight.do('key', lambda: self.work("leader")))
+            await asyncio.sleep(0)
+            follower = asyncio.create_task(self.flight.do('key', lambda: self.work("follower")))
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            return await asyncio.gather(leader, follower, return_exceptions=True)
+
+        leader, follower = asyncio.run(run())
+
+        self.assertIsInstance(leader, asyncio.CancelledError)
+        self.assertEqual(follower, "follower")
+        self.assertEqual(self.calls, 2)
+
+    def test_a_cancelled_follower_only_stops_waiting(self):
+        async def run():
+            leader = asyncio.create_task(self.flight.do('key', self.work))
+            await asyncio.sleep(0)
+            follower = asyncio.create_task(self.flight.do('key', self.work))
+            await asyncio.sleep(0.01)
+            follower.cancel()
+            return await asyncio.gather(leader, follower, return_exceptions=True)
+
+        leader, follower = asyncio.run(run())
+
+        self.assertEqual(leader, "done")
+        self.assertIsInstance(follower, asyncio.CancelledError)
+        self.assertEqual(self.calls, 1)
+
+
+class MetricsRegistryTests(SimpleTestCase):
+    """
+    Registries writing to a temporary directory, flushing every 10ms.
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+
+    def registry(self):
+        registry = MetricsRegistry(self.directory, flush_interval=0.01)
+        registry.counter('blends_total', "Blends.", ('status',))
+        registry.histogram('blend_seconds', "Blend time.", buckets=(1, 10))
+        self.addCleanup(registry.shutdown)
+        return registry
+
+    def written(self, registry, timeout=2):
+        """
+        The registry's snapshot file, once its flusher has caught up with memory.
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                written = json.loads(registry.file.read_text())['metrics']
+            except (OSError, ValueError):
+                written = None
+            if written == json.loads(json.dumps(registry.snapshot())):
+                return written
+            time.sleep(0.01)
+        self.fail("the snapshot file never caught up")
+
+    def test_a_single_update_is_flushed(self):
+        registry = self.registry()
+        registry.enable()
+
+        registry.metrics['blend_seconds'].observe(2)
+
+        self.assertEqual(self.written(registry)['blend_seconds']['samples'], { '[]': [0, 1, 2, 1] })
+
+    def test_only_enabled_registries_write(self):
+        registry = self.registry()
+        registry.metrics['blends_total'].inc(status='ok')
+        time.sleep(0.05)
+
+        self.assertFalse(registry.file.exists())
+
+    def test_exiting_keeps_the_counts(self):
+        registry = self.registry()
+        registry.enable()
+        registry.metrics['blends_total'].inc(3, status='ok')
+        registry.shutdown()
+
+        self.assertFalse(registry.file.exists())
+        self.assertIn('blends_total{status="ok"} 3', self.registry().render())
+
+    def test_dead_processes_are_folded_into_the_totals(self):
+        registry = self.registry()
+        registry.metrics['blends_total'].inc(2, status='ok')
+        dead = subprocess.Popen(['true'])
+        dead.wait()
+        registry.write(self.directory / f"{dead.pid}.json", { 'pid': dead.pid, 'started': None, 'metrics': registry.snapshot() })
+
+        self.assertIn('blends_total{status="ok"} 4', registry.render())
+        self.assertFalse((self.directory / f"{dead.pid}.json").exists())
+        self.assertIn('blends_total{status="ok"} 4', registry.render()) # counted once
+
+
+class NormalizeThemeTests(SimpleTestCase):
+
+    def test_paraphrases_normalize_the_same(self):
+        for theme in ("80s rock", "Rock 80s", "Rock 80's", "1980s rock", "80's Rock!", "the 80s rock songs"):
+            with self.subTest(theme=theme):
+                self.assertEqual(normalize_theme(theme), "80s rock")
+
+    def test_ampersands_and_curly_apostrophes(self):
+        self.assertEqual(normalize_theme("R&B"), normalize_theme("r and b"))
+        self.assertEqual(normalize_theme("Rock ’n’ Roll"), normalize_theme("rock n roll"))
+
+    def test_different_themes_stay_different(self):
+        self.assertNotEqual(normalize_theme("70s rock"), normalize_theme("80s rock"))
+        self.assertNotEqual(normalize_theme("indie rock"), normalize_theme("indie folk"))
+
+    def test_all_stopwords_falls_back_to_the_theme(self):
+        self.assertEqual(normalize_theme("  The Music "), "the music")
+
+
+class ThemeIndexTests(TransactionTestCase):
+
+    def test_matches_paraphrases_of_indexed_themes(self):
+        index = ThemeIndex(threshold=0.8)
+        index.add("80s rock")
+
+        self.assertEqual(index.match("1980s Rock!"), ("80s rock", 1.0))
+
+    def test_near_duplicates_clear_the_threshold(self):
+        # MinHash seeds come from hash(), so LSH recall varies per run; at ~0.9 similarity it's all but certain
+        index = ThemeIndex(threshold=0.8)
+        index.add("chill lofi beats to study to")
+
+        match, score = index.match("chill lofi beats to study too")
+
+        self.assertEqual(match, "chill lofi beats to study to")
+        self.assertGreaterEqual(score, 0.8)
+
+    def test_unrelated_themes_dont_match(self):
+        index = ThemeIndex(threshold=0.8)
+        index.add("80s rock")
+        index.add("indie folk")
+
+        self.assertIsNone(index.match("70s disco")[0])
+
+    def test_removed_themes_stop_matching(self):
+        index = ThemeIndex(threshold=0.8)
+        index.add("80s rock")
+        index.add("indie folk")
+
+        index.remove("1980s Rock")
+
+        self.assertEqual(len(index), 1)
+        self.assertIsNone(index.match("80s rock")[0])
+        self.assertEqual(index.match("folk indie")[0], "indie folk")
+
+    def test_evicted_playlists_are_a_miss(self):
+        index = ThemeIndex(threshold=0.8)
+        Playlist.objects.create(theme="80s rock", theme_key=normalize_theme("80s rock"))
+        asyncio.run(index.refresh())
+        Playlist.objects.all().delete() # compact_cache
+
+        with mock.patch('core.blendify_utils.theme_index', index), mock.patch('core.blendify_utils.theme_lookups') as theme_lookups:
+            self.assertIsNone(asyncio.run(find_cached_playlist("Rock, 80s")))
+
+        theme_lookups.inc.assert_called_once_with(result='miss')
+        self.assertEqual(len(index), 0)
+
+    def test_refresh_indexes_new_playlists_only_once(self):
+        index = ThemeIndex(threshold=0.8)
+        Playlist.objects.create(theme="80s rock", theme_key=normalize_theme("80s rock"))
+
+        asyncio.run(index.refresh())
+        Playlist.objects.create(theme="indie folk", theme_key=normalize_theme("indie folk"))
+        asyncio.run(index.refresh())
+        asyncio.run(index.refresh())
+
+        self.assertEqual(len(index), 2)
+        self.assertEqual(asyncio.run(index.find("Folk, Indie")), "indie folk")
+
+
+class SongUsageTests(TransactionTestCase):
+    """
+    Only the songs a blend ends up with count as used, not every song the prefetcher streamed past.
+    """
+
+    def setUp(self):
+        for n in range(4):
+            Song.objects.create(name=f"Artist {n} - Song {n}", key=f"artist {n} - song {n}", spotify_uri=f"spotify:track:{n}")
+        song_cache.clear()
+        self.addCleanup(song_cache.clear)
+
+        self.spotify = mock.Mock()
+        self.spotify.get_track_uris = mock.AsyncMock(return_value={})
+
+        patcher = mock.patch('core.blendify_utils.song_usage.touch', new_callable=mock.AsyncMock)
+        self.touch = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_prefetching_doesnt_count_as_use(self):
+        async def prefetch():
+            prefetcher = SongPrefetcher(self.spotify)
+            for n in range(4):
+                prefetcher.add(f"Artist {n} - Song {n}")
+            await prefetcher.join()
+
+        asyncio.run(prefetch())
+
+        self.touch.assert_not_called()
+        self.assertEqual(len(song_cache), 4)
+
+    def test_final_songs_are_counted_once(self):
+        uris = asyncio.run(build_song_uris(self.spotify, ["Artist 1 - Song 1", "ARTIST 1 - song 1", "Artist 2 - Song 2", "Unknown - Song"]))
+
+        self.assertEqual(uris, ["spotify:track:1", "spotify:track:1", "spotify:track:2"])
+        self.touch.assert_awaited_once()
+        self.assertEqual(sorted(self.touch.await_args.args[0]), ["artist 1 - song 1", "artist 2 - song 2"])
+
+
+@mock.patch.dict('os.environ', { 'SONG_MISS_TTL_DAYS': '7' })
+class SongMissTests(TransactionTestCase):
+    """
+    build_song_uris against a fake Spotify search, with the clock driven by hand.
+    """
+
+    song = "Artist - Unreleased Demo"
+
+    def setUp(self):
+        self.now = timezone.now()
+        self.found = {}
+        song_cache.clear()
+        self.addCleanup(song_cache.clear)
+
+        self.spotify = mock.Mock()
+        self.spotify.get_track_uris = mock.AsyncMock(side_effect=lambda songs, on_progress=None: { song: self.found.get(song) for song in songs })
+
+        for patcher in (mock.patch('core.blendify_utils.timezone.now', lambda: self.now), mock.patch('core.blendify_utils.song_usage.touch', new_callable=mock.AsyncMock)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def build(self):
+        return asyncio.run(build_song_uris(self.spotify, [self.song]))
+
+    def test_a_miss_isnt_searched_again_until_it_expires(self):
+        self.build()
+        self.now += timedelta(days=7) - timedelta(seconds=1)
+        self.build()
+        self.assertEqual(self.spotify.get_track_uris.await_count, 1)
+
+        self.now += timedelta(seconds=1)
+        self.build()
+        self.assertEqual(self.spotify.get_track_uris.await_count, 2)
+
+    def test_repeat_misses_double_the_wait_up_to_eight_times(self):
+        waits = []
+        for _ in range(6):
+            self.build()
+            miss = SongMiss.objects.get()
+            waits.append((miss.expires_at - self.now).days)
+            self.now = miss.expires_at
+
+        self.assertEqual(waits, [7, 14, 28, 56, 56, 56])
+        self.assertEqual(SongMiss.objects.get().attempts, 6)
+
+    def test_a_later_hit_clears_the_miss(self):
+        self.build()
+        self.now += timedelta(days=7)
+        self.found[self.song] = "spotify:track:demo"
+
+        self.assertEqual(self.build(), ["spotify:track:demo"])
+        self.assertFalse(SongMiss.objects.exists())
+        self.assertEqual(Song.objects.get().spotify_uri, "spotify:track:demo")
+
+
+def local_theme_index():
+    """
+    A ThemeIndex that only knows the themes add()ed to it. refresh() reads on an executor thread
+    of its own, which trips over the in-memory test database's table locks when a test writes at the same time.
+    """
+    index = ThemeIndex(threshold=0.8)
+    index.refresh = mock.AsyncMock()
+    return index
+
+
+@mock.patch.dict('os.environ', { 'OPENAI_BATCH_THEMES': 'true', 'OPENAI_STREAMING': 'false' })
+class GenerationFallbackTests(TransactionTestCase):
+    """
+    The combined ChatGPT prompts, falling back to one prompt per theme (or per detail)
+    when the JSON response doesn't hold up.
+    """
+
+    themes = ["80s rock", "indie folk", "city pop"]
+
+    def setUp(self):
+        playlist_cache.clear()
+        self.addCleanup(playlist_cache.clear)
+
+        self.invoke_chatgpt_json = mock.AsyncMock()
+        self.invoke_chatgpt = mock.AsyncMock(side_effect=self.reply)
+        patchers = (
+            mock.patch('core.blendify_utils.invoke_chatgpt_json', self.invoke_chatgpt_json),
+            mock.patch('core.blendify_utils.invoke_chatgpt', self.invoke_chatgpt),
+            mock.patch('core.blendify_utils.theme_index', local_theme_index()),
+            mock.patch('core.blendify_utils.playlist_usage.touch', new_callable=mock.AsyncMock),
+        )
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def reply(self, conversation):
+        prompt = conversation[-1]['content']
+        if prompt.startswith("Playlist theme: "):
+            theme = prompt.removeprefix("Playlist theme: ")
+            return f"{theme} Artist - Single Song 1\n{theme} Artist - Single Song 2"
+        return "single name" if "name of the playlist" in conversation[0]['content'] else "single description"
+
+    def single_calls(self):
+        return sorted(call.args[0][-1]['content'] for call in self.invoke_chatgpt.await_args_list)
+
+    def test_themes_missing_from_the_batch_are_generated_on_their_own(self):
+        self.invoke_chatgpt_json.return_value = {
+            "80S ROCK": ["Batch Artist - Batch Song"],
+            "indie folk": "not a list",
+        }
+
+        playlists = asyncio.run(build_individual_playlists(self.themes))
+
+        self.invoke_chatgpt_json.assert_awaited_once()
+        self.assertEqual(playlists["80s rock"], ["Batch Artist - Batch Song"])
+        self.assertEqual(playlists["indie folk"], ["indie folk Artist - Single Song 1", "indie folk Artist - Single Song 2"])
+        self.assertEqual(self.single_calls(), ["Playlist theme: city pop", "Playlist theme: indie folk"])
+        self.assertEqual(Playlist.objects.count(), 3)
+
+    def test_a_malformed_batch_falls_back_to_every_theme(self):
+        self.invoke_chatgpt_json.side_effect = ValueError("Expecting ',' delimiter")
+
+        playlists = asyncio.run(build_individual_playlists(self.themes))
+
+        self.assertEqual(playlists["city pop"], ["city pop Artist - Single Song 1", "city pop Artist - Single Song 2"])
+        self.assertEqual(len(self.single_calls()), 3)
+
+    def test_details_come_from_one_call(self):
+        self.invoke_chatgpt_json.return_value = { "name": " combined name ", "description": "combined description" }
+
+        details = asyncio.run(build_playlist_details(None, ["Artist - Song"], "Old name", "playlist", True))
+
+        self.assertEqual(tuple(details), ("combined name", "combined description"))
+        self.invoke_chatgpt.assert_not_awaited()
+
+    def test_incomplete_details_fall_back_to_the_single_prompts(self):
+        for response in ({ "name": "combined name" }, { "name": "", "description": "combined description" }, ValueError("not JSON")):
+            with self.subTest(response=response):
+                self.invoke_chatgpt.reset_mock()
+                self.invoke_chatgpt_json.side_effect = response if isinstance(response, Exception) else None
+                self.invoke_chatgpt_json.return_value = response
+
+                details = asyncio.run(build_playlist_details(None, ["Artist - Song"], "Old name", "playlist", True))
+
+                self.assertEqual(tuple(details), ("single name", "single description"))
+                self.assertEqual(self.invoke_chatgpt.await_count, 2)
+
+
+class CachedPlaylistTests(TransactionTestCase):
+    """
+    Cached theme playlists in the database, with ChatGPT (generate_playlist) mocked out.
+    """
+
+    def setUp(self):
+        playlist_cache.clear()
+        song_cache.clear()
+        self.addCleanup(playlist_cache.clear)
+        self.addCleanup(song_cache.clear)
+
+        self.generate_playlist = mock.AsyncMock(return_value=["New Artist - New Song"])
+        patchers = (
+            mock.patch('core.blendify_utils.generate_playlist', self.generate_playlist),
+            mock.patch('core.blendify_utils.theme_index', local_theme_index()),
+            mock.patch('core.blendify_utils.playlist_usage.touch', new_callable=mock.AsyncMock),
+        )
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def songs(self, theme):
+        return asyncio.run(load_playlist_songs(Playlist.objects.get(theme_key=normalize_theme(theme))))
+
+    def test_entries_keep_the_generated_order(self):
+        songs = ["C Artist - C Song", "A Artist - A Song", "B Artist - B Song"]
+        asyncio.run(save_playlist("80s rock", songs))
+        asyncio.run(save_playlist("indie folk", ["B Artist - B Song", "A Artist - A Song"]))
+
+        self.assertEqual(self.songs("80s rock"), songs)
+        self.assertEqual(self.songs("indie folk"), ["B Artist - B Song", "A Artist - A Song"])
+        self.assertEqual(Song.objects.count(), 3) # shared between the playlists
+
+    def test_saving_again_replaces_the_entries(self):
+        asyncio.run(save_playlist("80s rock", ["A Artist - A Song", "B Artist - B Song", "C Artist - C Song"]))
+        asyncio.run(save_playlist("80s rock", ["C Artist - C Song", "D Artist - D Song"]))
+
+        self.assertEqual(self.songs("80s rock"), ["C Artist - C Song", "D Artist - D Song"])
+        self.assertEqual(PlaylistEntry.objects.count(), 2)
+
+    def test_paraphrases_upsert_one_playlist(self):
+        asyncio.run(save_playlist("80s Rock", ["A Artist - A Song"]))
+        asyncio.run(save_playlist("Rock, 1980s!", ["B Artist - B Song"]))
+
+        playlist = Playlist.objects.get()
+        self.assertEqual((playlist.theme_key, playlist.theme), ("80s rock", "rock, 1980s!"))
+        self.assertEqual(self.songs("80s rock"), ["B Artist - B Song"])
+
+    def test_waits_for_a_theme_someone_else_is_generating(self):
+        ThemeClaim.objects.create(theme="80s rock", claimed_at=timezone.now())
+
+        async def other_worker():
+            await asyncio.sleep(0.2)
+            await save_playlist("80s rock", ["Their Artist - Their Song"])
+            await ThemeClaim.objects.filter(theme="80s rock").adelete()
+
+        async def load():
+            return (await asyncio.gather(load_or_generate_playlist("Rock 80s"), other_worker()))[0]
+
+        self.assertEqual(asyncio.run(load()), ["Their Artist - Their Song"])
+        self.generate_playlist.assert_not_awaited()
+
+    @mock.patch.dict('os.environ', { 'THEME_CLAIM_TIMEOUT': '120' })
+    def test_takes_over_an_abandoned_claim(self):
+        ThemeClaim.objects.create(theme="80s rock", claimed_at=timezone.now() - timedelta(minutes=5))
+
+        self.assertEqual(asyncio.run(load_or_generate_playlist("80s rock")), ["New Artist - New Song"])
+        self.assertEqual(self.songs("80s rock"), ["New Artist - New Song"])
+        self.assertFalse(ThemeClaim.objects.exists())
+
+    @mock.patch.dict('os.environ', { 'THEME_MAX_AGE': '30' })
+    def test_stale_playlists_are_served_then_refreshed(self):
+        asyncio.run(save_playlist("80s rock", ["Old Artist - Old Song"]))
+        Playlist.objects.update(created_at=timezone.now() - timedelta(days=31))
+
+        async def load():
+            songs = await load_or_generate_playlist("80s rock")
+            await asyncio.gather(*blendify_utils._refreshing)
+            return songs
+
+        self.assertEqual(asyncio.run(load()), ["Old Artist - Old Song"]) # nobody waits on the refresh
+        self.assertEqual(self.songs("80s rock"), ["New Artist - New Song"])
+        self.assertGreater(Playlist.objects.get().created_at, timezone.now() - timedelta(days=1))
+
+    @mock.patch.dict('os.environ', { 'THEME_MAX_AGE': '30' })
+    def test_fresh_playlists_arent_refreshed(self):
+        asyncio.run(save_playlist("80s rock", ["Old Artist - Old Song"]))
+        Playlist.objects.update(created_at=timezone.now() - timedelta(days=29))
+
+        self.assertEqual(asyncio.run(load_or_generate_playlist("80s rock")), ["Old Artist - Old Song"])
+        self.generate_playlist.assert_not_awaited()
+
+    def test_a_claimed_theme_isnt_refreshed_twice(self):
+        asyncio.run(save_playlist("80s rock", ["Old Artist - Old Song"]))
+        ThemeClaim.objects.create(theme="80s rock", claimed_at=timezone.now())
+
+        asyncio.run(refresh_playlist("80s rock"))
+
+        self.generate_playlist.assert_not_awaited()
+        self.assertEqual(self.songs("80s rock"), ["Old Artist - Old Song"])
+
+
+class CompactCacheTests(TransactionTestCase):
+    """
+    Playlists p0..p3 and unreferenced songs s0..s3, each less recently used than the
+    last but used more often. Song "kept" is in playlist p3.
+    """
+
+    def setUp(self):
+        now = timezone.now()
+        kept = Song.objects.create(name="Kept Artist - Kept Song", key="kept artist - kept song", last_used_at=now - timedelta(days=30))
+        for n in range(4):
+            playlist = Playlist.objects.create(theme=f"p{n}", theme_key=f"p{n}", last_used_at=now - timedelta(days=n), hit_count=n)
+            Song.objects.create(name=f"s{n}", key=f"s{n}", last_used_at=now - timedelta(days=n), hit_count=n)
+        PlaylistEntry.objects.create(playlist=playlist, song=kept, position=0)
+
+    def compact(self, *args):
+        out = io.StringIO()
+        call_command('compact_cache', *args, stdout=out)
+        return out.getvalue()
+
+    def test_lru_evicts_the_least_recently_used(self):
+        self.compact('--max-playlists', '2', '--max-songs', '3', '--no-vacuum')
+
+        self.assertEqual(sorted(Playlist.objects.values_list('theme', flat=True)), ["p0", "p1"])
+        self.assertEqual(sorted(Song.objects.values_list('name', flat=True)), ["s0", "s1", "s2"]) # p3 went, freeing "kept"
+
+    def test_lfu_evicts_the_least_used(self):
+        self.compact('--policy', 'lfu', '--max-playlists', '2', '--max-songs', '2', '--no-vacuum')
+
+        self.assertEqual(sorted(Playlist.objects.values_list('theme', flat=True)), ["p2", "p3"])
+        self.assertEqual(sorted(Song.objects.values_list('name', flat=True)), ["Kept Artist - Kept Song", "s3"])
+
+    def test_songs_in_cached_playlists_are_kept(self):
+        output = self.compact('--max-songs', '0', '--no-vacuum')
+
+        self.assertEqual(list(Song.objects.values_list('name', flat=True)), ["Kept Artist - Kept Song"])
+        self.assertIn("1 songs are left", output)
+
+    def test_dry_run_deletes_nothing(self):
+        output = self.compact('--max-playlists', '0', '--max-songs', '0', '--dry-run')
+
+        self.assertIn("Would evict 4 of 4 playlists and 5 of 5 songs (lru)", output)
+        self.assertEqual((Playlist.objects.count(), Song.objects.count(), PlaylistEntry.objects.count()), (4, 5, 1))
+
+    def test_reports_the_space_reclaimed(self):
+        with mock.patch('core.management.commands.compact_cache.Command.database_size', side_effect=[5 * 1024 * 1024, 3.5 * 1024 * 1024]):
+            output = self.compact('--max-playlists', '1')
+
+        self.assertIn("Evicted 3 of 4 playlists and 0 of 5 songs (lru)", output)
+        self.assertIn("Database 5.0 MB -> 3.5 MB, reclaimed 1.5 MB", output)
+
+    def test_sqlite_size_includes_the_write_ahead_log(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        database = Path(directory.name) / 'db.sqlite3'
+        database.write_bytes(b'x' * 3072)
+        database.with_name('db.sqlite3-wal').write_bytes(b'x' * 1024)
+
+        with mock.patch.dict(connection.settings_dict, { 'NAME': str(database) }):
+            self.assertEqual(CompactCacheCommand().database_size(), 4096)
+
+
+@mock.patch.dict('os.environ', { 'BLEND_JOB_TIMEOUT': '1' })
+class BlendJobTests(TransactionTestCase):
+    """
+    The blend queue and worker, with the pipeline itself (process_blend_job) and socket pushes mocked out.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(username="listener")
+        self.notify = mock.AsyncMock()
+        patcher = mock.patch('core.job_utils.notify_blend_job', self.notify)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    async def hang(job, progress):
+        await asyncio.sleep(60)
+
+    def enqueue(self):
+        return asyncio.run(enqueue_blend_job(self.user, ["80s rock"], "playlist", "Blend", False))
+
+    def run_job(self, process_blend_job):
+        job = asyncio.run(claim_next_blend_job())
+        with mock.patch('core.job_utils.process_blend_job', process_blend_job):
+            asyncio.run(run_blend_job(job))
+        job.refresh_from_db()
+        return job
+
+    def test_each_job_is_claimed_once_oldest_first(self):
+        first, second = self.enqueue(), self.enqueue()
+
+        async def claim():
+            return await asyncio.gather(*(claim_next_blend_job() for _ in range(3)))
+
+        claimed = asyncio.run(claim())
+
+        self.assertEqual([job.id if job else None for job in claimed], [first.id, second.id, None])
+        self.assertEqual(set(BlendJob.objects.values_list('status', flat=True)), { BlendJob.RUNNING })
+
+    def test_a_finished_job_is_done(self):
+        self.enqueue()
+
+        job = self.run_job(mock.AsyncMock(return_value={ 'combined_playlist': [] }))
+
+        self.assertEqual((job.status, job.result), (BlendJob.DONE, { 'combined_playlist': [] }))
+        self.assertIsNotNone(job.finished_at)
+
+    def test_a_timed_out_job_fails(self):
+        self.enqueue()
+
+        job = self.run_job(self.hang)
+
+        self.assertEqual((job.status, job.error), (BlendJob.FAILED, "Blend timed out, please try again."))
+        self.notify.assert_awaited()
+
+    def test_a_cancelled_job_fails_then_stays_cancelled(self):
+        self.enqueue()
+
+        async def cancel():
+            job = await claim_next_blend_job()
+            with mock.patch('core.job_utils.process_blend_job', self.hang):
+                task = asyncio.create_task(run_blend_job(job))
+                await asyncio.sleep(0.05)
+                task.cancel()
+                with self.assertRaises(asyncio.CancelledError):
+                    await task
+
+        asyncio.run(cancel())
+
+        job = BlendJob.objects.get()
+        self.assertEqual((job.status, job.error), (BlendJob.FAILED, "Blend was cancelled, please try again."))
+
+    def test_the_sweep_fails_only_orphaned_jobs(self):
+        orphaned, running, queued = self.enqueue(), self.enqueue(), self.enqueue()
+        BlendJob.objects.filter(id=orphaned.id).update(status=BlendJob.RUNNING, started_at=timezone.now() - timedelta(seconds=62))
+        BlendJob.objects.filter(id=running.id).update(status=BlendJob.RUNNING, started_at=timezone.now() - timedelta(seconds=30))
+
+        self.assertEqual(asyncio.run(fail_orphaned_blend_jobs()), 1)
+        self.assertEqual(asyncio.run(fail_orphaned_blend_jobs()), 0) # already failed
+
+        self.assertEqual(dict(BlendJob.objects.values_list('id', 'status')), {
+            orphaned.id: BlendJob.FAILED, running.id: BlendJob.RUNNING, queued.id: BlendJob.QUEUED,
+        })
+        self.assertEqual(BlendJob.objects.get(id=orphaned.id).error, "Blend was interrupted, please try again.")
+        self.notify.assert_awaited_once()
+
+    def sends(self, *reports):
+        """
+        Run each (progress, done, total) report in turn, returning (user id, done, seconds in) for every message sent.
+        """
+        sent = []
+
+        async def report():
+            start = time.monotonic()
+            self.notify.side_effect = lambda job, **kwargs: sent.append((job.user_id, kwargs['done'], round(time.monotonic() - start, 1)))
+            for progress, done, total in reports:
+                progress.count(done, total)
+            await asyncio.sleep(0.5)
+
+        asyncio.run(report())
+        return sent
+
+    def test_progress_is_coalesced(self):
+        progress = BlendProgress(self.enqueue(), max_rate=5)
+
+        sent = self.sends(*((progress, done, 100) for done in range(1, 101)))
+
+        self.assertEqual(sent, [(self.user.id, 100, 0.0)]) # the loop never yields, so only the latest count goes out
+
+    def test_progress_is_throttled_per_user(self):
+        other = User.objects.create(username="other")
+        first, second = BlendProgress(self.enqueue(), max_rate=5), BlendProgress(self.enqueue(), max_rate=5)
+        theirs = BlendProgress(asyncio.run(enqueue_blend_job(other, ["jazz"], "playlist", "Blend", False)), max_rate=5)
+
+        sent = self.sends((first, 1, 10), (second, 2, 10), (theirs, 3, 10))
+
+        self.assertEqual(sorted(sent, key=lambda message: message[2]), [
+            (self.user.id, 1, 0.0), (other.id, 3, 0.0), (self.user.id, 2, 0.2),
+        ])
+
+
+class SpotifyPlaylistsViewTests(TransactionTestCase):
+    """
+    Paging through a user's playlists, with Spotify mocked out.
+    """
+
+    def setUp(self):
+        self.client.force_login(User.objects.create(username="listener"))
+        playlists = [{ 'id': str(i), 'name': f"Playlist {i}" } for i in range(3)]
+        for patcher in (
+            mock.patch('core.views.spotify_tokens.get', mock.AsyncMock(return_value=("token", "user"))),
+            mock.patch('core.views.SpotifyClient.get_playlists', mock.AsyncMock(return_value=playlists)),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def page(self, **params):
+        return self.client.get(reverse('spotify_playlists'), params).json()
+
+    def test_pages_end(self):
+        first = self.page(limit=2)
+        last = self.page(offset=first['next_offset'], limit=2)
+
+        self.assertEqual([playlist['id'] for playlist in first['playlists'] + last['playlists']], ["0", "1", "2"])
+        self.assertIsNone(last['next_offset'])
+
+    def test_zero_limit_still_moves_on(self):
+        page = self.page(offset=0, limit=0)
+
+        self.assertEqual((len(page['playlists']), page['next_offset']), (1, 1))
+
+
+class ThemeKeyMigrationTests(TransactionTestCase):
+    """
+    0008 keys existing playlists by normalized theme, dropping the older duplicates (and their entries).
+    """
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.migrate([target])
+        return executor.loader.project_state([target]).apps
+
+    def setUp(self):
+        self.addCleanup(lambda: self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes()[0]))
+
+    def test_duplicate_themes_are_merged(self):
+        apps = self.migrate(('core', '0007_playlistentry'))
+        Playlist, PlaylistEntry, Song = (apps.get_model('core', model) for model in ('Playlist', 'PlaylistEntry', 'Song'))
+
+        song = Song.objects.create(name="Artist - Song", key="artist - song")
+        for age, theme in enumerate(["1980s Rock!", "80s rock", "indie folk"]):
+            playlist = Playlist.objects.create(theme=theme)
+            Playlist.objects.filter(id=playlist.id).update(created_at=timezone.now() - timedelta(days=age))
+            PlaylistEntry.objects.create(playlist=playlist, song=song, position=0)
+
+        apps = self.migrate(('core', '0008_playlist_theme_key'))
+        Playlist, PlaylistEntry = (apps.get_model('core', model) for model in ('Playlist', 'PlaylistEntry'))
+
+        self.assertEqual(dict(Playlist.objects.values_list('theme_key', 'theme')), { '80s rock': "1980s Rock!", 'folk indie': "indie folk" })
+        self.assertEqual(PlaylistEntry.objects.count(), 2)
@@ -0,0 +1,246 @@
+####################################################################
+# Library & Modules
+####################################################################
+
+# system level stuff
+import os
+import re
+import logging
+import threading
+from dotenv import load_dotenv
+
+# blendify specific imports
+from core.models import Playlist
+from asgiref.sync import sync_to_async
+from django.db import connection
+
+
+####################################################################
+# Environment Variables
+####################################################################
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# filler words that don't change what a theme means
+THEME_STOPWORDS = {'a', 'an', 'the', 'of', 'song', 'songs', 'music', 'playlist', 'tracks', 'vibes'}
+
+
+####################################################################
+# Functions
+####################################################################
+
+def normalize_theme(
+    theme: str,
+) -> str:
+    """
+    Reduce a theme to a canonical form, so paraphrases compare equal.
+    eg. "80s rock", "Rock 80s", "1980s rock" and "80's Rock!" all become "80s rock".
+
+    Parameters:
+    ---
+        theme: The theme as the user typed it.
+
+    Returns:
+    ---
+        The theme's sorted, de-punctuated, stopword-free tokens.
+    """
+    text = theme.casefold().replace("'", "").replace("’", "").replace("&", " and ")
+    text = re.sub(r"[^\w\s]", " ", text)
+    text = re.sub(r"\b(?:19|20)(\d0s)\b", r"\1", text) # 1980s -> 80s
+    tokens = sorted({token for token in text.split() if token not in THEME_STOPWORDS})
+    return ' '.join(tokens) or theme.casefold().strip()
+
+def theme_ngrams(
+    normalized: str,
+    n: int = 3,
+) -> set[str]:
+    """
+    Character n-grams of a normalized theme, padded so short words still get some.
+    """
+    padded = f" {normalized} "
+    return {padded[i:i + n] for i in range(max(len(padded) - n + 1, 1))}
+
+
+####################################################################
+# Classes
+####################################################################
+
+class ThemeIndex:
+    """
+    Offline near-duplicate index over cached Playlist themes.
+
+    Themes are normalized, broken into character trigrams and MinHashed. Banded
+    locality-sensitive hashing narrows a lookup down to a handful of candidates, which
+    are then scored by exact trigram Jaccard similarity against `threshold`.
+
+    New Playlist rows are picked up by refresh(), which does the hashing in a thread
+    so a big first build doesn't stall the event loop (and every blend on it).
+    """
+
+    def __init__(
+        self,
+        threshold: float,
+        num_perm: int = 64,
+        bands: int = 16,
+    ):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+
+        self._themes = {} # normalized -> stored theme
+        self._ngrams = {} # normalized -> ngram set
+        self._buckets = {} # (band, band signature) -> set of normalized themes
+        self._last_id = 0
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock() # one refresh at a time, the others wait for it
+
+    def __len__(self) -> int:
+        return len(self._themes)
+
+    def _signature(
+        self,
+        ngrams: set[str],
+    ) -> list[int]:
+        """
+        MinHash signature of an ngram set.
+        """
+        return [min(hash((seed, gram)) for gram in ngrams) for seed in range(self.num_perm)]
+
+    def _band_keys(
+        self,
+        signature: list[int],
+    ) -> list[tuple]:
+        """
+        The LSH bucket keys for a signature, one per band.
+        """
+        return [(band, tuple(signature[band * self.rows:(band + 1) * self.rows])) for band in range(self.bands)]
+
+    def add(
+        self,
+        theme: str,
+    ) -> None:
+        """
+        Index a cached theme.
+
+        Parameters:
+        ---
+            theme: The theme as stored on the Playlist.
+        """
+        normalized = normalize_theme(theme)
+        with self._lock:
+            if normalized in self._themes:
+                return
+
+            ngrams = theme_ngrams(normalized)
+            self._themes[normalized] = theme
+            self._ngrams[normalized] = ngrams
+            for band_key in self._band_keys(self._signature(ngrams)):
+                self._buckets.setdefault(band_key, set()).add(normalized)
+
+    def remove(
+        self,
+        theme: str,
+    ) -> None:
+        """
+        Drop a theme whose playlist has gone (eg. evicted by compact_cache).
+
+        Parameters:
+        ---
+            theme: The theme as stored on the Playlist.
+        """
+        normalized = normalize_theme(theme)
+        with self._lock:
+            if self._themes.pop(normalized, None) is None:
+                return
+
+            for band_key in self._band_keys(self._signature(self._ngrams.pop(normalized))):
+                bucket = self._buckets.get(band_key, set())
+                bucket.discard(normalized)
+                if not bucket:
+                    self._buckets.pop(band_key, None)
+
+    def match(
+        self,
+        theme: str,
+    ) -> tuple[str | None, float]:
+        """
+        Find the closest cached theme.
+
+        Parameters:
+        ---
+            theme: The theme to look up.
+
+        Returns:
+        ---
+            The best matching stored theme (or None if nothing clears the threshold), and its score.
+        """
+        normalized = normalize_theme(theme)
+        with self._lock:
+            if normalized in self._themes:
+                return self._themes[normalized], 1.0
+
+            ngrams = theme_ngrams(normalized)
+            candidates = set()
+            for band_key in self._band_keys(self._signature(ngrams)):
+                candidates |= self._buckets.get(band_key, set())
+
+            best, best_score = None, 0.0
+            for candidate in candidates:
+                other = self._ngrams[candidate]
+                score = len(ngrams & other) / len(ngrams | other)
+                if score > best_score:
+                    best, best_score = candidate, score
+
+        if best is not None and best_score >= self.threshold:
+            return self._themes[best], best_score
+
+        return None, best_score
+
+    async def refresh(self) -> None:
+        """
+        Index any Playlist rows added since the last refresh (by this or any other process).
+        """
+        await sync_to_async(self._refresh, thread_sensitive=False)()
+
+    def _refresh(self) -> None:
+        """
+        The blocking part of refresh(): read the new rows and hash them. It runs on whichever
+        executor thread is free, so it closes that thread's connection rather than leave it open.
+        """
+        with self._refresh_lock:
+            try:
+                rows = Playlist.objects.filter(id__gt=self._last_id).order_by('id').values_list('id', 'theme')
+                for playlist_id, theme in rows.iterator(chunk_size=2000):
+                    self.add(theme)
+                    self._last_id = playlist_id
+            finally:
+                connection.close()
+
+    async def find(
+        self,
+        theme: str,
+    ) -> str | None:
+        """
+        Find a cached theme that means the same thing as `theme`, logging the match score.
+
+        Parameters:
+        ---
+            theme: The theme to look up.
+
+        Returns:
+        ---
+            The stored theme to reuse, or None.
+        """
+        await self.refresh()
+        match, score = self.match(theme)
+
+        if match:
+            logger.info("Theme %r matched cached theme %r (score %.2f)", theme, match, score)
+        else:
+            logger.debug("Theme %r has no similar cached theme (best score %.2f, threshold %.2f)", theme, score, self.threshold)
+
+        return match
+
+theme_index = ThemeIndex(threshold=float(os.getenv('THEME_SIMILARITY_THRESHOLD', 0.8)))
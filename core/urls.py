@@ -6,5 +6,7 @@ urlpatterns = [
     path('blend/', views.blend, name='blend'),
     path('lorumipsum/', views.lorumipsum, name='lorumipsum'),
     path('get_playlist_themes/', views.get_playlist_themes, name='get_playlist_themes'),
-    path('hathor/', views.hathor, name='hathor')
+    path('spotify_playlists/', views.spotify_playlists, name='spotify_playlists'),
+    path('hathor/', views.hathor, name='hathor'),
+    path('metrics', views.metrics_view, name='metrics')
 ]
\ No newline at end of file
@@ -1,25 +1,32 @@
-from django.shortcuts import render
-from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
-
-from core.models import Generated
-
-from core.blendify_utils import build_individual_playlists, build_combined_playlist, build_song_uris
-from core.spotify_utils import create_spotify_playlist, get_spotify_playlists, update_spotify_access_token, update_spotify_playlist
-from core.blendify_utils import build_playlist_name, build_playlist_description
+import os
 
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
-
-def send_progress(user_id, message):
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        f"user_{user_id}",
-        {
-            "type": "send_progress",
-            "message": message,
-        }
-    )
+from django.shortcuts import redirect, render
+from django.urls import reverse
+from django.contrib.auth.decorators import login_required
+from django.contrib.auth.views import redirect_to_login
+from django.http import HttpResponse, JsonResponse
+
+from core.models import BlendJob, Generated
+
+from core.job_utils import enqueue_blend_job
+from core.cache_utils import spotify_playlists_cache
+from core.spotify_utils import SpotifyClient, spotify_tokens
+from core.metrics_utils import metrics
+
+from asgiref.sync import sync_to_async
+from functools import wraps
+
+def async_login_required(view):
+    """
+    login_required for async views. social_core backends don't implement aget_user,
+    so we resolve the lazy user in a thread instead of going through request.auser().
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if not await sync_to_async(lambda: request.user.is_authenticated)():
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+    return wrapper
 
 def home(request):
     return render(request, 'home.html')
@@ -30,6 +37,15 @@ def lorumipsum(request):
 def hathor(request):
     return render(request, 'hathor.html')
 
+def metrics_view(request):
+    """
+    Every process's metrics in the Prometheus text format, behind METRICS_TOKEN if it's set.
+    """
+    token = os.getenv('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        return HttpResponse(status=401)
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @login_required
 def get_playlist_themes(request):
     playlist_name = request.GET.get('playlist_name')
@@ -41,105 +57,82 @@ def get_playlist_themes(request):
     else:
         return JsonResponse({'themes': []})
 
-@login_required
-def blend(request):
-
-    try: # get the users info from database
-        social = request.user.social_auth.filter(provider='spotify').first()
-    except Exception:
-        return render(request, 'blend.html', { 'error': 'You are not authenticated with Spotify.' })
+@async_login_required
+async def spotify_playlists(request):
 
-    try: # update the access token if it's expired
-        update_spotify_access_token(request.user)
+    try: # get the user's access token, refreshing it if it's expired
+        access_token, user_id = await spotify_tokens.get(request.user)
     except Exception as e:
-        return render(request, 'blend.html', { 'error': f'Error updating Spotify access token: {e}' })
-    
-    access_token = social.extra_data['access_token']
-    user_id = social.uid
+        return JsonResponse({ 'error': f'Error updating Spotify access token: {e}' }, status=502)
 
-    try: # get the user's spotify playlists
-        spotify_playlists = get_spotify_playlists(access_token, user_id)
+    try: # get the user's spotify playlists (usually from cache)
+        async with SpotifyClient(access_token, token_provider=lambda: spotify_tokens.refresh(request.user)) as spotify:
+            playlists = await spotify.get_playlists(user_id)
     except Exception as e:
-        return render(request, 'blend.html', { 'error': f'Error getting Spotify playlists: {e}' })
+        return JsonResponse({ 'error': f'Error getting Spotify playlists: {e}' }, status=502)
+
+    if query := request.GET.get('q', '').strip().lower(): # filter by name
+        playlists = [playlist for playlist in playlists if query in playlist['name'].lower()]
+
+    offset = int(request.GET.get('offset', '0')) if request.GET.get('offset', '0').isdigit() else 0
+    limit = min(int(request.GET.get('limit', '100')) if request.GET.get('limit', '100').isdigit() else 100, 500)
+    limit = max(limit, 1) # a page of nothing would hand back the same offset forever
+    next_offset = offset + limit if offset + limit < len(playlists) else None
+
+    return JsonResponse({
+        'playlists': playlists[offset:offset + limit],
+        'total': len(playlists),
+        'next_offset': next_offset,
+    })
 
-    if request.method == 'POST': # they've submitted something, so we process it
-        playlist_rename = request.POST.get('playlist_rename')
+@async_login_required
+async def blend(request):
+
+    error = None
+    if request.method == 'GET' and request.GET.get('job', '').isdigit(): # checking in on a queued blend
+        job = await BlendJob.objects.filter(id=request.GET.get('job'), user_id=request.user.id).afirst()
+
+        if job and job.status in (BlendJob.QUEUED, BlendJob.RUNNING): # still going, the websocket takes it from here
+            return render(request, 'blend.html', { 'job': job })
+
+        if job and job.status == BlendJob.DONE: # great success, return the results
+            social = await request.user.social_auth.filter(provider='spotify').afirst()
+            if social: # the worker changed one of their playlists, don't serve the old list
+                spotify_playlists_cache.delete(social.uid)
+            return render(request, 'blend.html', {
+                **job.result,
+                'success': job.message,
+            })
+
+        error = job.error if job else 'That blend could not be found.'
+
+    if request.method == 'POST': # they've submitted something, so we queue it up
+        playlist_rename = bool(request.POST.get('playlist_rename'))
 
         if not request.POST.get('spotify_playlist'): # there's no playlist selected
-            return render(request, 'blend.html', { 'spotify_playlists': spotify_playlists, 'error': 'Please select a playlist.' })
+            return render(request, 'blend.html', { 'error': 'Please select a playlist.' })
         
         spotify_playlist_id = request.POST.get('spotify_playlist')
         spotify_playlist_name = request.POST.get('spotify_playlist_name')
 
         if not request.POST.getlist('theme'): # there's no themes entered
-            return render(request, 'blend.html', { 'spotify_playlists': spotify_playlists, 'error': 'Please enter at least one theme.' })
+            return render(request, 'blend.html', { 'error': 'Please enter at least one theme.' })
         
         # filter and sort our themes
         themes = [theme.strip() for theme in request.POST.getlist('theme') if theme.strip()]
         themes = sorted(themes)
 
         if not themes or len(themes) < 2: # not enough themes
-            return render(request, 'blend.html', { 'spotify_playlists': spotify_playlists, 'error': 'Please enter at least two themes.' })
-        
-        if spotify_playlist_id == 'create_new': # we're creating a new playlist
-            new_playlist_name = request.POST.get('new_playlist_name', '').strip()
-
-            if not new_playlist_name: # no name entered
-                return render(request, 'blend.html', { 'spotify_playlists': spotify_playlists, 'error': 'Please enter a name for the new playlist.' })
-            
-            try: # create the new playlist
-                spotify_playlist_id = create_spotify_playlist(access_token, user_id, new_playlist_name)
-                spotify_playlist_name = new_playlist_name
-            except Exception as e:
-                return render(request, 'blend.html', { 'spotify_playlists': spotify_playlists, 'error': f'Error creating new playlist: {e}' })
+            return render(request, 'blend.html', { 'error': 'Please enter at least two themes.' })
         
-        try: # build the individual playlists
-            send_progress(request.user.id, "Sourcing playlists for:<br>" + "<br>".join([f" {i+1}. {theme}" for i, theme in enumerate(themes)]))
-            individual_playlists = build_individual_playlists(themes)
-        except Exception as e:
-            return render(request, 'blend.html', { 'spotify_playlists': spotify_playlists, 'error': f'Error building individual playlists: {e}' })
-
-        try:# build the combined playlist
-            send_progress(request.user.id, "Building combined playlist")
-            combined_playlist = build_combined_playlist(individual_playlists)
-        except Exception as e:
-            return render(request, 'blend.html', { 'spotify_playlists': spotify_playlists, 'error': f'Error building combined playlist: {e}' })
-
-        try: # grab URIs for the songs in the combined playlist
-            send_progress(request.user.id, "Adding song URIs to database...")
-            song_uris = build_song_uris(access_token, combined_playlist)
-        except Exception as e:
-            return render(request, 'blend.html', { 'spotify_playlists': spotify_playlists, 'error': f'Error building song URIs: {e}' })
-        
-        try: # build a name for the playlist (if selected)
-            send_progress(request.user.id, "Creating a new playlist name...")
-            playlist_name = build_playlist_name(combined_playlist, spotify_playlist_name, playlist_rename)
-        except Exception as e:
-            return render(request, 'blend.html', { 'spotify_playlists': spotify_playlists, 'error': f'Error building playlist name: {e}' })
-
-        try: # build a description for the playlist (if selected)
-            send_progress(request.user.id, "Creating a new playlist description...")
-            playlist_description = build_playlist_description(access_token, combined_playlist, spotify_playlist_id, playlist_rename)
-        except Exception as e:
-            return render(request, 'blend.html', { 'spotify_playlists': spotify_playlists, 'error': f'Error building playlist description: {e}' })
-
-        try: # push the combined playlist to spotify
-            send_progress(request.user.id, "Pushing new playlist to Spotify...")
-            update_spotify_playlist(access_token, spotify_playlist_id, song_uris, playlist_name, playlist_description)
-        except Exception as e:
-            return render(request, 'blend.html', { 'spotify_playlists': spotify_playlists, 'error': f'Error updating playlist: {e}' })
-        
-        Generated.objects.update_or_create(playlist_name=playlist_name, user_id=user_id, defaults={'themes': themes})
-        
-        # great success, return the results
-        return render(request, 'blend.html', {
-            'spotify_playlists': spotify_playlists,
-            'playlist_name': playlist_name,
-            'playlist_description': playlist_description,
-            'combined_playlist': combined_playlist,
-            'individual_playlists': individual_playlists,
-            'success': 'Playlist updated successfully.',
-        })
+        if spotify_playlist_id == 'create_new': # we're creating a new playlist, the worker makes it
+            spotify_playlist_name = request.POST.get('new_playlist_name', '').strip()
+
+            if not spotify_playlist_name: # no name entered
+                return render(request, 'blend.html', { 'error': 'Please enter a name for the new playlist.' })
+
+        job = await enqueue_blend_job(request.user, themes, spotify_playlist_id, spotify_playlist_name, playlist_rename)
+        return redirect(f"{reverse('blend')}?job={job.id}")
         
-    # fresh load of the page    
-    return render(request, 'blend.html', { 'spotify_playlists': spotify_playlists })
\ No newline at end of file
+    # fresh load of the page, blend.js fills in the playlists from spotify_playlists
+    return render(request, 'blend.html', { 'error': error })
\ No newline at end of file
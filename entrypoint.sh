@@ -12,4 +12,25 @@ fi
 
 uv run manage.py migrate
 uv run manage.py collectstatic --noinput
-uv run daphne blendify.asgi:application -b 0.0.0.0 -p 8000
\ No newline at end of file
+# run the worker and daphne side by side, passing SIGTERM/SIGINT on to both so blends in
+# flight are recorded as failed, and take the container down if either one dies
+uv run manage.py blend_worker &
+worker=$!
+uv run daphne blendify.asgi:application -b 0.0.0.0 -p 8000 &
+web=$!
+
+stopping=0
+stop() {
+    kill -TERM "$worker" "$web" 2>/dev/null || true
+}
+trap 'stopping=1; stop' TERM INT
+
+while kill -0 "$worker" 2>/dev/null && kill -0 "$web" 2>/dev/null; do
+    sleep 1 &
+    wait $! || true
+done
+
+stop
+wait "$worker" || true
+wait "$web" || true
+[ "$stopping" = 1 ] # a clean stop if we were asked to, a failure if one of them died on its own
\ No newline at end of file